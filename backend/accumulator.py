@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import heapq
+from typing import Callable, Dict, FrozenSet, List, Optional
+
+from models import Ride
+
+DAY_NAMES = ["Ma", "Di", "Wo", "Do", "Vr", "Za", "Zo"]
+RECENT_RIDES = 5
+WEEKLY_WEEKS = 12
+
+# Sections whose group-bys need the ride's weekday, week key or hour mask.
+TIME_SECTIONS = frozenset({"weekly", "hourly", "day_of_week"})
+
+_TOTAL_FIELDS = (
+    ("total_hours", "total_hours"),
+    ("total_net", "net_pay"),
+    ("total_wwv", "wwv_amount"),
+    ("total_overtime_hours", "overtime_hours"),
+    ("total_night_hours", "night_hours"),
+    ("total_social", "social_contribution"),
+    ("total_extra_costs", "extra_costs"),
+)
+
+
+def gross_total(ride: Ride) -> float:
+    if ride.gross_total is not None:
+        return ride.gross_total
+    return ride.gross_pay + ride.wwv_amount + ride.extra_costs + ride.social_contribution
+
+
+def _rounded(rows: List[dict], keys) -> List[dict]:
+    for row in rows:
+        for key in keys:
+            row[key] = round(row[key], 2)
+    return rows
+
+
+class StatsAccumulator:
+    """Dashboard statistics built in a single pass over a stream of rides.
+
+    Every group-by is updated as a ride is added and only the group rows are
+    kept, plus the ``RECENT_RIDES`` newest rides in a bounded heap, so memory
+    does not grow with the number of rides. Rides are added in query order;
+    ties keep that order, as the sorts over full ride lists did.
+    """
+
+    def __init__(self, sections: FrozenSet[str], serialize: Callable[[Ride], dict]) -> None:
+        self.sections = sections
+        self.serialize = serialize
+        self.needs_time_fields = bool(sections & TIME_SECTIONS)
+        self.count = 0
+        self.gross = 0
+        self.totals: Dict[str, float] = {key: 0 for key, _ in _TOTAL_FIELDS}
+        self.monthly: Dict[str, dict] = {}
+        self.weekly: Dict[str, dict] = {}
+        self.cars: Dict[str, dict] = {}
+        self.brands: Dict[str, dict] = {}
+        self.clients: Dict[str, dict] = {}
+        self.hourly = [0] * 24
+        self.dow = {i: {"day": DAY_NAMES[i], "rides": 0, "hours": 0, "earnings": 0} for i in range(7)}
+        # Min-heap of (date, -position, ride dict): the smallest entry is the
+        # first to be pushed out, and of equal dates the later ride goes first.
+        self.recent: List[tuple] = []
+
+    def add(self, ride: Ride, time_fields: Optional[dict] = None) -> None:
+        sections = self.sections
+        self.count += 1
+        hours = ride.total_hours
+        net = ride.net_pay
+
+        if "totals" in sections:
+            self.gross += gross_total(ride)
+            for key, attribute in _TOTAL_FIELDS:
+                self.totals[key] += getattr(ride, attribute)
+        if "monthly" in sections:
+            month = self.monthly.get(ride.date[:7])
+            if month is None:
+                month = self.monthly[ride.date[:7]] = {
+                    "month": ride.date[:7],
+                    "gross": 0,
+                    "net": 0,
+                    "rides": 0,
+                    "hours": 0,
+                    "overtime": 0,
+                    "night": 0,
+                }
+            month["gross"] += gross_total(ride)
+            month["net"] += net
+            month["rides"] += 1
+            month["hours"] += hours
+            month["overtime"] += ride.overtime_hours
+            month["night"] += ride.night_hours
+        if "weekly" in sections:
+            week_key = time_fields["week_key"]
+            if week_key is None:
+                raise ValueError(f"Invalid ride date {ride.date!r}")
+            week = self.weekly.get(week_key)
+            if week is None:
+                week = self.weekly[week_key] = {"week": week_key, "net": 0, "rides": 0, "hours": 0}
+            week["net"] += net
+            week["rides"] += 1
+            week["hours"] += hours
+        if "cars" in sections:
+            car_key = f"{ride.car_brand} {ride.car_model}"
+            car = self.cars.get(car_key)
+            if car is None:
+                car = self.cars[car_key] = {"car": car_key, "brand": ride.car_brand, "rides": 0, "hours": 0, "earnings": 0}
+            car["rides"] += 1
+            car["hours"] += hours
+            car["earnings"] += net
+        if "brands" in sections:
+            brand = self.brands.get(ride.car_brand)
+            if brand is None:
+                brand = self.brands[ride.car_brand] = {"brand": ride.car_brand, "rides": 0, "hours": 0, "earnings": 0}
+            brand["rides"] += 1
+            brand["hours"] += hours
+            brand["earnings"] += net
+        if "clients" in sections:
+            client = self.clients.get(ride.client_name)
+            if client is None:
+                client = self.clients[ride.client_name] = {"client": ride.client_name, "rides": 0, "earnings": 0, "hours": 0}
+            client["rides"] += 1
+            client["earnings"] += net
+            client["hours"] += hours
+        if "hourly" in sections:
+            mask = time_fields["hour_mask"]
+            while mask:
+                low = mask & -mask
+                self.hourly[low.bit_length() - 1] += 1
+                mask ^= low
+        if "day_of_week" in sections and time_fields["weekday"] is not None:
+            day = self.dow[time_fields["weekday"]]
+            day["rides"] += 1
+            day["hours"] += hours
+            day["earnings"] += net
+        if "recent" in sections:
+            # Only rides that make it into the heap are serialized.
+            entry_key = (ride.date, -self.count)
+            if len(self.recent) < RECENT_RIDES:
+                heapq.heappush(self.recent, (*entry_key, self.serialize(ride)))
+            elif entry_key > self.recent[0][:2]:
+                heapq.heapreplace(self.recent, (*entry_key, self.serialize(ride)))
+
+    def result(self) -> dict:
+        """The statistics of the rides added so far, for the accumulator's sections."""
+        sections = self.sections
+        result: dict = {}
+        if "totals" in sections:
+            total_hours, total_net = self.totals["total_hours"], self.totals["total_net"]
+            result["total_rides"] = self.count
+            result["total_hours"] = round(total_hours, 2)
+            result["total_gross"] = round(self.gross, 2)
+            for key, _ in _TOTAL_FIELDS[1:]:
+                result[key] = round(self.totals[key], 2)
+            result["avg_per_ride"] = round(total_net / self.count if self.count > 0 else 0, 2)
+            result["avg_per_hour"] = round(total_net / total_hours if total_hours > 0 else 0, 2)
+        if "monthly" in sections:
+            result["monthly_earnings"] = _rounded(
+                sorted(self.monthly.values(), key=lambda x: x["month"]), ("gross", "net", "hours", "overtime", "night")
+            )
+        if "weekly" in sections:
+            result["weekly_earnings"] = _rounded(
+                sorted(self.weekly.values(), key=lambda x: x["week"])[-WEEKLY_WEEKS:], ("net", "hours")
+            )
+        if "cars" in sections:
+            result["car_stats"] = _rounded(
+                sorted(self.cars.values(), key=lambda x: x["rides"], reverse=True), ("hours", "earnings")
+            )
+        if "brands" in sections:
+            result["brand_stats"] = _rounded(
+                sorted(self.brands.values(), key=lambda x: x["rides"], reverse=True), ("hours", "earnings")
+            )
+        if "clients" in sections:
+            result["client_stats"] = _rounded(
+                sorted(self.clients.values(), key=lambda x: x["earnings"], reverse=True), ("earnings", "hours")
+            )
+        if "hourly" in sections:
+            result["hourly_distribution"] = [{"hour": str(h).zfill(2), "count": c} for h, c in enumerate(self.hourly)]
+        if "day_of_week" in sections:
+            result["day_of_week_stats"] = _rounded([self.dow[i] for i in range(7)], ("hours", "earnings"))
+        if "recent" in sections:
+            result["recent_rides"] = [entry[2] for entry in sorted(self.recent, reverse=True)]
+        return result
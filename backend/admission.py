@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Dict
+
+from fastapi import HTTPException
+
+from metrics import metrics
+
+
+@dataclass(frozen=True)
+class RouteLimit:
+    rate: float  # sustained requests per second per client
+    burst: int  # requests a client may make back to back
+    max_concurrency: int  # computations in flight for the route across all clients
+
+
+DEFAULT_LIMITS = {
+    "stats": RouteLimit(rate=1.0, burst=10, max_concurrency=4),
+    "leaderboard": RouteLimit(rate=0.5, burst=5, max_concurrency=2),
+}
+
+
+def load_limits() -> Dict[str, RouteLimit]:
+    """Apply RATE_LIMIT_<ROUTE>="rate,burst,concurrency" overrides to the defaults."""
+    limits = dict(DEFAULT_LIMITS)
+    for route, default in DEFAULT_LIMITS.items():
+        raw = os.environ.get(f"RATE_LIMIT_{route.upper()}")
+        if not raw:
+            continue
+        rate, burst, concurrency = (part.strip() for part in raw.split(","))
+        limits[route] = RouteLimit(float(rate), int(burst), int(concurrency))
+    return limits
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, capacity: int, now: float) -> None:
+        self.tokens = float(capacity)
+        self.updated = now
+
+    def take(self, limit: RouteLimit, now: float) -> float:
+        """Consume a token; return 0 on success or the seconds until one is available."""
+        self.tokens = min(limit.burst, self.tokens + (now - self.updated) * limit.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        if limit.rate <= 0:
+            return 60.0
+        return (1 - self.tokens) / limit.rate
+
+
+class AdmissionController:
+    """Per-client token buckets plus a global in-flight cap for one route.
+
+    Both checks happen before the work touches the database, and both fail
+    fast instead of queueing: 429 when the client is over its rate, 503 when
+    the route is saturated. Each comes with a Retry-After header. The rate is
+    checked per request; a slot is only needed for work that actually runs,
+    so requests joining a coalesced computation do not take one.
+    """
+
+    MAX_BUCKETS = 50000
+
+    def __init__(self, route: str, limit: RouteLimit, clock: Callable[[], float] = time.monotonic) -> None:
+        self.route = route
+        self.limit = limit
+        self._clock = clock
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._in_flight = 0
+
+    def _bucket(self, key: str) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.MAX_BUCKETS:
+                self._prune()
+            bucket = self._buckets[key] = TokenBucket(self.limit.burst, self._clock())
+        return bucket
+
+    def _prune(self) -> None:
+        # A bucket idle long enough to have refilled carries no state.
+        now = self._clock()
+        refill = self.limit.burst / self.limit.rate if self.limit.rate > 0 else math.inf
+        for key in [k for k, b in self._buckets.items() if now - b.updated >= refill]:
+            del self._buckets[key]
+        if len(self._buckets) >= self.MAX_BUCKETS:
+            self._buckets.clear()
+
+    def check_rate(self, key: str) -> None:
+        """Take a token from ``key``'s bucket; 429 when it is empty."""
+        wait = self._bucket(key).take(self.limit, self._clock())
+        if wait > 0:
+            metrics.incr(f"admission.{self.route}.rejected_rate")
+            raise HTTPException(
+                status_code=429,
+                detail="Te veel verzoeken, probeer het later opnieuw",
+                headers={"Retry-After": str(max(1, math.ceil(wait)))},
+            )
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold one of the route's in-flight slots; 503 when all are taken."""
+        if self._in_flight >= self.limit.max_concurrency:
+            metrics.incr(f"admission.{self.route}.rejected_concurrency")
+            raise HTTPException(
+                status_code=503,
+                detail="Server is bezet, probeer het later opnieuw",
+                headers={"Retry-After": "1"},
+            )
+        self._in_flight += 1
+        metrics.incr(f"admission.{self.route}.admitted")
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+
+    @asynccontextmanager
+    async def admit(self, key: str) -> AsyncIterator[None]:
+        self.check_rate(key)
+        async with self.slot():
+            yield
+
+controllers = {route: AdmissionController(route, limit) for route, limit in load_limits().items()}
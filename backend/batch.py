@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Type
+from urllib.parse import parse_qsl, urlsplit
+
+from fastapi import HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, Field, ValidationError
+from sqlalchemy.exc import DBAPIError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import overload
+from metrics import metrics
+
+MAX_BATCH_SIZE = 10
+
+# A batchable route: the model validating its query parameters and a handler
+# called with a per-item request, response and the validated parameters.
+BatchHandler = Callable[[Request, Response, Any], Awaitable[Any]]
+BatchRoutes = Dict[str, Tuple[Type[BaseModel], BatchHandler]]
+
+
+class BatchItem(BaseModel):
+    id: Optional[str] = None
+    path: str
+    params: Dict[str, Any] = Field(default_factory=dict)
+    # The client's cached ETag for this item; answered with 304 when current.
+    etag: Optional[str] = None
+
+
+class BatchInput(BaseModel):
+    requests: List[BatchItem] = Field(min_length=1, max_length=MAX_BATCH_SIZE)
+
+
+def _split_path(item: BatchItem) -> Tuple[str, Dict[str, Any]]:
+    """Normalise ``/api/stats?month=2024-03`` style paths to a route and parameters."""
+    parts = urlsplit(item.path)
+    path = "/" + parts.path.strip("/")
+    if path.startswith("/api/"):
+        path = path[len("/api"):]
+    return path, {**dict(parse_qsl(parts.query)), **item.params}
+
+
+def _item_request(path: str, etag: Optional[str]) -> Request:
+    headers = [(b"if-none-match", etag.encode("latin-1"))] if etag else []
+    return Request({"type": "http", "method": "GET", "path": path, "query_string": b"", "headers": headers})
+
+
+async def run_item(routes: BatchRoutes, item: BatchItem, session: AsyncSession) -> dict:
+    """Run one item; errors become its status and body. ``session`` is the one the routes share."""
+    path, raw_params = _split_path(item)
+    result: dict = {"id": item.id, "path": path}
+    route = routes.get(path)
+    if route is None:
+        return {**result, "status": 404, "body": {"detail": "Route niet beschikbaar in batch"}}
+
+    params_model, handler = route
+    try:
+        params = params_model.model_validate(raw_params)
+    except ValidationError as exc:
+        return {**result, "status": 422, "body": {"detail": jsonable_encoder(exc.errors(include_url=False))}}
+
+    response = Response()
+    try:
+        body = await handler(_item_request(path, item.etag), response, params)
+    except HTTPException as exc:
+        return {**result, "status": exc.status_code, "body": {"detail": exc.detail}}
+    except (PoolTimeoutError, DBAPIError) as exc:
+        reason = overload(exc)
+        if reason is None:
+            raise
+        # A cancelled statement aborts the shared transaction; the next item starts a new one.
+        await session.rollback()
+        counter, detail = reason
+        metrics.incr(counter)
+        return {**result, "status": 503, "body": {"detail": detail}}
+
+    etag = response.headers.get("etag")
+    if etag:
+        result["etag"] = etag
+    if isinstance(body, Response):
+        return {**result, "status": body.status_code, "body": None}
+    return {**result, "status": 200, "body": body}
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+MISSING = object()
+
+
+class LocalCache:
+    """Small per-process LRU of per-user values with a TTL.
+
+    Entries are grouped by user so that a write can evict everything derived
+    from that user's data at once. Every eviction bumps a generation counter;
+    callers read ``generation()`` before querying the database and pass it to
+    ``set()`` so a value loaded before a concurrent eviction is never stored.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_users: int = 10000) -> None:
+        self._ttl = ttl
+        self._max_users = max_users
+        self._entries: "OrderedDict[str, Dict[Hashable, Tuple[float, Any]]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._epoch = 0
+
+    def generation(self, user_id: str) -> Tuple[int, int]:
+        return self._epoch, self._generations.get(user_id, 0)
+
+    def get(self, user_id: str, key: Hashable) -> Any:
+        entries = self._entries.get(user_id)
+        if not entries:
+            return MISSING
+        item = entries.get(key)
+        if item is None:
+            return MISSING
+        expires, value = item
+        if expires < time.monotonic():
+            entries.pop(key, None)
+            return MISSING
+        self._entries.move_to_end(user_id)
+        return value
+
+    def set(self, user_id: str, key: Hashable, value: Any, generation: Optional[Tuple[int, int]] = None) -> None:
+        if generation is not None and generation != self.generation(user_id):
+            return
+        entries = self._entries.setdefault(user_id, {})
+        entries[key] = (time.monotonic() + self._ttl, value)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self._max_users:
+            evicted, _ = self._entries.popitem(last=False)
+            self._generations.pop(evicted, None)
+
+    def evict_user(self, user_id: Optional[str]) -> None:
+        """Drop a user's entries, or everything when ``user_id`` is None."""
+        if user_id is None:
+            self._entries.clear()
+            self._generations.clear()
+            self._epoch += 1
+            return
+        self._entries.pop(user_id, None)
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
@@ -2,13 +2,14 @@ from __future__ import annotations
 
 import asyncio
 
-from db import engine
-from models import Base
+from db import shard_engines
+from migrations import upgrade_schema
 
 
 async def main() -> None:
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    for engine in shard_engines:
+        async with engine.begin() as conn:
+            await upgrade_schema(conn)
 
 
 if __name__ == "__main__":
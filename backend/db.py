@@ -1,11 +1,20 @@
 from __future__ import annotations
 
 import os
+import time
+import zlib
+from contextvars import ContextVar
 from pathlib import Path
-from typing import AsyncIterator, Dict
+from typing import AsyncIterator, Dict, Optional, Tuple
 
 from dotenv import load_dotenv
+from sqlalchemy import bindparam, event, select
+from sqlalchemy.exc import DBAPIError, TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+
+from metrics import metrics
+from models import UserDirectory
 
 ROOT_DIR = Path(__file__).resolve().parents[1]
 load_dotenv(ROOT_DIR / ".env")
@@ -16,21 +25,219 @@ if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL is not set")
 
 
-def _connect_args(db_url: str) -> Dict[str, str]:
+# Prepared statements asyncpg keeps per connection. Set to 0 behind a
+# transaction-pooling proxy (pgbouncer, Neon's pooled endpoint), which cannot
+# keep a statement prepared on a server connection between transactions.
+PREPARED_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_PREPARED_STATEMENT_CACHE_SIZE", "100"))
+
+
+def ssl_connect_args(db_url: str) -> Dict[str, str]:
     if "localhost" in db_url or "127.0.0.1" in db_url:
         return {}
     return {"ssl": "require"}
 
 
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=False,
-    pool_pre_ping=True,
-    connect_args=_connect_args(DATABASE_URL),
-)
+def asyncpg_dsn(db_url: str) -> str:
+    """Turn an SQLAlchemy URL into a DSN that asyncpg.connect accepts."""
+    return db_url.replace("postgresql+asyncpg://", "postgresql://", 1)
+
+
+def _count_compiled_cache(conn, cursor, statement, parameters, context, executemany) -> None:
+    # Driver SQL such as the per-transaction SET LOCAL never goes through the
+    # compiled cache; counting it as uncached would skew the hit rate.
+    if context is None or context.compiled is None:
+        return
+    if context.cache_hit == context.dialect.CACHE_HIT:
+        metrics.incr("sql.compiled_cache.hit")
+    elif context.cache_hit == context.dialect.CACHE_MISS:
+        metrics.incr("sql.compiled_cache.miss")
+    else:
+        metrics.incr("sql.compiled_cache.uncached")
+
+
+def _count_checkout(dbapi_connection, connection_record, connection_proxy) -> None:
+    metrics.incr("db.pool.checkout")
+
+
+# Statement timeouts (ms) of the expensive routes, overridable with
+# STATEMENT_TIMEOUT_<ROUTE>. Other work keeps the server's default.
+STATEMENT_TIMEOUTS = {
+    route: int(os.environ.get(f"STATEMENT_TIMEOUT_{route.upper()}", default))
+    for route, default in {"stats": "10000", "leaderboard": "5000", "search": "5000", "batch": "10000"}.items()
+}
+# Set for the current request or task; every transaction a session begins
+# while it is set runs under that timeout.
+statement_timeout: ContextVar[Optional[int]] = ContextVar("statement_timeout", default=None)
+
+
+@event.listens_for(Session, "after_begin")
+def _apply_statement_timeout(session, transaction, connection) -> None:
+    timeout = statement_timeout.get()
+    if timeout:
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout)}")
+
+
+# Postgres' SQLSTATE for a statement cancelled by statement_timeout.
+QUERY_CANCELED = "57014"
+
+
+def overload(exc: BaseException) -> Optional[Tuple[str, str]]:
+    """The counter and 503 detail for a pool or statement timeout; None for any other error."""
+    if isinstance(exc, PoolTimeoutError):
+        return "db.pool.timeout", "Server is bezet, probeer het later opnieuw"
+    if isinstance(exc, DBAPIError) and getattr(exc.orig, "sqlstate", None) == QUERY_CANCELED:
+        return "db.statement_timeout", "Verzoek duurde te lang, probeer het later opnieuw"
+    return None
+
+
+def _create_engine(db_url: str):
+    # Every uvicorn worker gets its own pool, so keep the per-process pool small
+    # enough that WEB_CONCURRENCY * (size + overflow) fits the server's limit.
+    async_engine = create_async_engine(
+        db_url,
+        echo=False,
+        pool_pre_ping=True,
+        pool_size=int(os.environ.get("DB_POOL_SIZE", "5")),
+        max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", "5")),
+        # Seconds a request may wait for a connection before it is shed with a
+        # 503 (see server.database_overloaded) instead of queueing behind the others.
+        pool_timeout=float(os.environ.get("DB_POOL_TIMEOUT", "5")),
+        connect_args={
+            **ssl_connect_args(db_url),
+            "prepared_statement_cache_size": PREPARED_STATEMENT_CACHE_SIZE,
+        },
+    )
+    event.listen(async_engine.sync_engine, "after_cursor_execute", _count_compiled_cache)
+    event.listen(async_engine.sync_engine, "checkout", _count_checkout)
+    return async_engine
+
+
+engine = _create_engine(DATABASE_URL)
 
 AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
 
+# Optional streaming replica for read-only endpoints. Without it every read
+# goes to the primary.
+DATABASE_READ_URL = os.environ.get("DATABASE_READ_URL")
+read_engine = _create_engine(DATABASE_READ_URL) if DATABASE_READ_URL else engine
+
+AsyncReadSessionLocal = async_sessionmaker(read_engine, expire_on_commit=False)
+
+
+class WriteTracker:
+    """Remembers which users wrote recently so their reads skip the replica.
+
+    The window should exceed the replica's usual lag; within it a user always
+    reads their own writes from the primary.
+    """
+
+    def __init__(self, window: float) -> None:
+        self._window = window
+        self._last_write: Dict[str, float] = {}
+        self._all_until = 0.0
+
+    def mark(self, user_id: Optional[str]) -> None:
+        now = time.monotonic()
+        if user_id is None:
+            self._all_until = now + self._window
+            return
+        self._last_write[user_id] = now
+        if len(self._last_write) > 10000:
+            cutoff = now - self._window
+            self._last_write = {k: v for k, v in self._last_write.items() if v >= cutoff}
+
+    def recently_wrote(self, user_id: str) -> bool:
+        now = time.monotonic()
+        if now < self._all_until:
+            return True
+        last = self._last_write.get(user_id)
+        return last is not None and now - last < self._window
+
+
+write_tracker = WriteTracker(float(os.environ.get("READ_YOUR_WRITES_WINDOW", "5")))
+
+
+# Optional sharding: further databases, each with the full schema, that
+# users are spread over. DATABASE_URL is shard 0 and also holds the
+# user_directory saying where every user lives (see sharding.py).
+DATABASE_SHARD_URLS = [url.strip() for url in os.environ.get("DATABASE_SHARD_URLS", "").split(",") if url.strip()]
+shard_engines = [engine, *(_create_engine(url) for url in DATABASE_SHARD_URLS)]
+shard_sessions = [AsyncSessionLocal, *(async_sessionmaker(e, expire_on_commit=False) for e in shard_engines[1:])]
+SHARDED = len(shard_engines) > 1
+
+_SHARD_OF = select(UserDirectory.shard).where(UserDirectory.user_id == bindparam("user_id"))
+
+
+class ShardRouter:
+    """Maps a user to the shard holding their rows.
+
+    New users are placed by a hash of their id; the directory on shard 0
+    records the placement and is updated when a user is moved. Lookups are
+    cached per process; a move publishes a ``moved`` event that updates the
+    cache of every process.
+    """
+
+    def __init__(self, shard_count: int, max_entries: int = 100000) -> None:
+        self.shard_count = shard_count
+        self.max_entries = max_entries
+        self._shards: Dict[str, int] = {}
+
+    def home(self, user_id: str) -> int:
+        """The shard a new user is placed on."""
+        return zlib.crc32(user_id.encode("utf-8")) % self.shard_count
+
+    async def shard_of(self, user_id: str) -> int:
+        if self.shard_count == 1:
+            return 0
+        shard = self._shards.get(user_id)
+        if shard is not None:
+            return shard
+        async with AsyncSessionLocal() as session:
+            shard = (await session.execute(_SHARD_OF, {"user_id": user_id})).scalar_one_or_none()
+        if shard is None:
+            # Unknown ids (deleted users, stale tokens) are not cached.
+            return self.home(user_id)
+        self.remember(user_id, shard)
+        return shard
+
+    def remember(self, user_id: str, shard: int) -> None:
+        if len(self._shards) >= self.max_entries:
+            self._shards.clear()
+        self._shards[user_id] = shard
+
+    def forget(self, user_id: str) -> None:
+        self._shards.pop(user_id, None)
+
+    def on_event(self, user_id: Optional[str], event: Optional[dict]) -> None:
+        if user_id is not None and event and event.get("type") == "moved":
+            self.remember(user_id, int(event["shard"]))
+
+    def on_invalidation(self, user_id: Optional[str]) -> None:
+        # None means notifications may have been missed, moves included.
+        if user_id is None:
+            self._shards.clear()
+
+
+shard_router = ShardRouter(len(shard_engines))
+
+
+async def session_factory_for(user_id: str) -> async_sessionmaker:
+    """The primary session factory of the user's shard."""
+    if not SHARDED:
+        return AsyncSessionLocal
+    return shard_sessions[await shard_router.shard_of(user_id)]
+
+
+async def read_session_factory(user_id: Optional[str]) -> async_sessionmaker:
+    # The replica mirrors shard 0 only, so sharded reads go to the shards.
+    if SHARDED and user_id is not None:
+        return await session_factory_for(user_id)
+    if read_engine is engine:
+        return AsyncSessionLocal
+    if user_id is not None and write_tracker.recently_wrote(user_id):
+        return AsyncSessionLocal
+    return AsyncReadSessionLocal
+
 
 async def get_session() -> AsyncIterator[AsyncSession]:
     async with AsyncSessionLocal() as session:
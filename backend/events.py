@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Optional, Set
+
+from fastapi import HTTPException
+
+from metrics import metrics
+
+SSE_MAX_CONNECTIONS = int(os.environ.get("SSE_MAX_CONNECTIONS", "500"))
+SSE_MAX_PER_USER = int(os.environ.get("SSE_MAX_PER_USER", "5"))
+SSE_HEARTBEAT = float(os.environ.get("SSE_HEARTBEAT", "20"))
+# Streams end after this long and EventSource reconnects on its own. Uvicorn
+# waits for open responses before shutting a worker down, so this also bounds
+# how long a deploy waits for streams.
+SSE_MAX_LIFETIME = float(os.environ.get("SSE_MAX_LIFETIME", "300"))
+SSE_QUEUE_SIZE = 100
+# Room for the ride in the NOTIFY that carries an event to the other workers;
+# Postgres caps the payload at 8000 bytes and the rest of the message is small.
+NOTIFY_RIDE_BYTES = 6000
+
+
+def ride_event(action: str, ride: dict, version: int, totals: Optional[dict]) -> dict:
+    """The delta pushed to a user's own streams after a ride write."""
+    return {"type": "ride", "action": action, "version": version, "ride": ride, "totals": totals}
+
+
+def bus_event(event: Optional[dict]) -> Optional[dict]:
+    """``event`` as published to the other workers.
+
+    A ride too large for a NOTIFY (its notes are unbounded) is sent as just
+    its id and date, with ``partial`` set; clients reload it as they would
+    after a resync.
+    """
+    if not event or event.get("type") != "ride":
+        return event
+    ride = event["ride"]
+    if len(json.dumps(ride, default=str)) <= NOTIFY_RIDE_BYTES:
+        return event
+    metrics.incr("stream.partial")
+    return {**event, "ride": {"id": ride["id"], "date": ride["date"]}, "partial": True}
+
+
+class Subscription:
+    def __init__(self, user_id: str) -> None:
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+
+    def put(self, event) -> None:
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A client this far behind cannot apply deltas any more; drop the
+            # backlog and tell it to reload instead.
+            metrics.incr("stream.overflow")
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync"})
+
+
+class EventBroker:
+    """Fans write events out to the server-sent event streams of this process.
+
+    Ride events go to the writer's own streams, the leaderboard delta to every
+    stream. Streams hold no database session; events carry everything a
+    client needs. Other workers receive the events through the invalidation
+    bus, so a stream sees writes handled by any worker.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = SSE_MAX_CONNECTIONS,
+        max_per_user: int = SSE_MAX_PER_USER,
+        heartbeat: float = SSE_HEARTBEAT,
+        max_lifetime: float = SSE_MAX_LIFETIME,
+    ) -> None:
+        self.max_connections = max_connections
+        self.max_per_user = max_per_user
+        self.heartbeat = heartbeat
+        self.max_lifetime = max_lifetime
+        self._by_user: Dict[str, Set[Subscription]] = defaultdict(set)
+        self._count = 0
+
+    def subscribe(self, user_id: str) -> Subscription:
+        if self._count >= self.max_connections:
+            metrics.incr("stream.rejected")
+            raise HTTPException(
+                status_code=503,
+                detail="Server is bezet, probeer het later opnieuw",
+                headers={"Retry-After": "5"},
+            )
+        if len(self._by_user.get(user_id, ())) >= self.max_per_user:
+            metrics.incr("stream.rejected")
+            raise HTTPException(status_code=429, detail="Te veel open verbindingen")
+        subscription = Subscription(user_id)
+        self._by_user[user_id].add(subscription)
+        self._count += 1
+        metrics.incr("stream.opened")
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscriptions = self._by_user.get(subscription.user_id)
+        if subscriptions is None or subscription not in subscriptions:
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self._by_user[subscription.user_id]
+        self._count -= 1
+
+    def deliver(self, user_id: Optional[str], event: Optional[dict]) -> None:
+        """Hand a committed write's event to the local streams."""
+        if not event:
+            return
+        for subscription in self._by_user.get(user_id, ()):
+            subscription.put(event)
+        if event.get("totals") is not None:
+            leaderboard = {"type": "leaderboard", "user_id": user_id, "totals": event["totals"]}
+            for subscriptions in self._by_user.values():
+                for subscription in subscriptions:
+                    subscription.put(leaderboard)
+
+    async def stream(self, subscription: Subscription) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_lifetime
+        try:
+            yield "retry: 5000\nevent: ready\ndata: {}\n\n"
+            while loop.time() < deadline:
+                try:
+                    event = await asyncio.wait_for(
+                        subscription.queue.get(), min(self.heartbeat, max(0.0, deadline - loop.time()))
+                    )
+                except asyncio.TimeoutError:
+                    # Comment lines keep proxies from closing an idle stream.
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+        finally:
+            self.unsubscribe(subscription)
@@ -0,0 +1,143 @@
+"""Columnar export of ride histories as Arrow IPC streams or Parquet files.
+
+Rides are read through a server-side cursor, EXPORT_BATCH_ROWS at a time, and
+every batch is converted to an Arrow record batch and written to the response
+before the next one is fetched, so memory stays bounded by one batch whatever
+the size of the history. Dates, start and end times and ``created_at`` are
+typed columns (date32, time32, timestamp), amounts and hours float64:
+
+    pyarrow.ipc.open_stream(body).read_all()      # format=arrow
+    pandas.read_parquet(io.BytesIO(body))         # format=parquet
+"""
+from __future__ import annotations
+
+import os
+from typing import AsyncIterator, List, Optional, Sequence
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from metrics import metrics
+from models import Ride
+from whatif import parse_seconds
+
+EXPORT_BATCH_ROWS = int(os.environ.get("EXPORT_BATCH_ROWS", "10000"))
+
+# Media type and file extension per format.
+EXPORT_FORMATS = {
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+_FLOAT_COLUMNS = [
+    "extra_costs",
+    "wwv_km",
+    "wwv_amount",
+    "total_hours",
+    "normal_hours",
+    "overtime_hours",
+    "night_hours",
+    "normal_pay",
+    "overtime_pay",
+    "night_pay",
+    "gross_pay",
+    "gross_total",
+    "social_contribution",
+    "net_pay",
+]
+
+# The fields of serializers.ride_to_dict; ``user_id`` only in exports of all users.
+_FIELDS = [
+    pa.field("id", pa.string(), nullable=False),
+    pa.field("user_id", pa.string(), nullable=False),
+    pa.field("date", pa.date32(), nullable=False),
+    pa.field("client_name", pa.string(), nullable=False),
+    pa.field("car_brand", pa.string(), nullable=False),
+    pa.field("car_model", pa.string(), nullable=False),
+    pa.field("start_time", pa.time32("s"), nullable=False),
+    pa.field("end_time", pa.time32("s"), nullable=False),
+    pa.field("notes", pa.string()),
+    *(pa.field(name, pa.float64()) for name in _FLOAT_COLUMNS),
+    pa.field("created_at", pa.timestamp("us", tz="UTC")),
+]
+
+
+def export_schema(all_users: bool) -> pa.Schema:
+    return pa.schema([field for field in _FIELDS if all_users or field.name != "user_id"])
+
+
+def _column(values: Sequence, type_: pa.DataType) -> pa.Array:
+    if pa.types.is_date32(type_):
+        return pa.array(np.array(values, dtype="datetime64[D]"), type=type_)
+    if pa.types.is_time32(type_):
+        return pa.array(parse_seconds(values).astype(np.int32), type=type_)
+    return pa.array(values, type=type_)
+
+
+def record_batch(rows: Sequence[Sequence], schema: pa.Schema) -> pa.RecordBatch:
+    """Rows holding the schema's columns, in order, as one record batch."""
+    columns = list(zip(*rows))
+    return pa.RecordBatch.from_arrays(
+        [_column(values, field.type) for values, field in zip(columns, schema)], schema=schema
+    )
+
+
+class _Chunks:
+    """Write-only file collecting what the Arrow writers produce until it is taken."""
+
+    closed = False
+
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def export_rides(
+    session_factories: Sequence[async_sessionmaker], user_id: Optional[str], fmt: str
+) -> AsyncIterator[bytes]:
+    """The rides of ``user_id``, or of every user when None, encoded as ``fmt``.
+
+    Each session factory is read in turn (one per shard for an export of all
+    users). Sessions are opened here rather than taken from the request, which
+    is finished by the time a streaming response is sent.
+    """
+    schema = export_schema(user_id is None)
+    query = select(*(getattr(Ride, field.name) for field in schema))
+    if user_id is None:
+        query = query.order_by(Ride.user_id, Ride.date)
+    else:
+        query = query.where(Ride.user_id == user_id).order_by(Ride.date)
+    query = query.execution_options(yield_per=EXPORT_BATCH_ROWS)
+
+    sink = _Chunks()
+    target = pa.PythonFile(sink, mode="w")
+    writer = pa.ipc.new_stream(target, schema) if fmt == "arrow" else pq.ParquetWriter(target, schema)
+    try:
+        for session_factory in session_factories:
+            async with session_factory() as session:
+                result = await session.stream(query)
+                async for rows in result.partitions():
+                    writer.write_batch(record_batch(rows, schema))
+                    metrics.incr("export.rows", len(rows))
+                    yield sink.take()
+    finally:
+        # Writes the Parquet footer or the end of stream marker.
+        writer.close()
+    yield sink.take()
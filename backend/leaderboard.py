@@ -0,0 +1,344 @@
+from __future__ import annotations
+
+import asyncio
+from functools import lru_cache
+from typing import Awaitable, Callable, Iterable, List, Optional, Sequence
+
+from sqlalchemy import Integer, String, and_, bindparam, delete, func, or_, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from models import LeaderboardTotal, Ride, User
+from partitions import month_range
+
+METRICS = ("hours", "net", "gross", "rides")
+ALL_TIME = "all"
+# Deepest page start served. A sharded page reads ``offset + limit`` rows from
+# every shard and merges them in memory, so the offset has to stay bounded.
+MAX_OFFSET = 10000
+
+
+def _refresh_statement(monthly: bool):
+    # Named apart from the target columns, which INSERT reserves for VALUES.
+    user_id = bindparam("for_user", type_=String)
+    period_key = bindparam("for_period", type_=String)
+    query = select(
+        user_id.label("user_id"),
+        period_key.label("period_key"),
+        func.coalesce(func.sum(Ride.total_hours), 0).label("hours"),
+        func.coalesce(func.sum(Ride.net_pay), 0).label("net"),
+        func.coalesce(func.sum(Ride.gross_total), 0).label("gross"),
+        func.count(Ride.id).label("rides"),
+    ).where(Ride.user_id == user_id)
+    if monthly:
+        query = query.where(Ride.date >= bindparam("month_start"), Ride.date < bindparam("month_end"))
+    # Core insert on the table: an ORM-entity insert executed with parameters
+    # would be treated as a bulk INSERT of those parameters.
+    stmt = insert(LeaderboardTotal.__table__).from_select(["user_id", "period_key", "hours", "net", "gross", "rides"], query)
+    return stmt.on_conflict_do_update(
+        index_elements=[LeaderboardTotal.user_id, LeaderboardTotal.period_key],
+        set_={metric: stmt.excluded[metric] for metric in METRICS},
+    )
+
+
+_REFRESH_ALL_TIME = _refresh_statement(monthly=False).returning(
+    *(LeaderboardTotal.__table__.c[metric] for metric in METRICS)
+)
+_REFRESH_MONTH = _refresh_statement(monthly=True)
+# Months without rides drop out of the monthly board entirely.
+_DROP_EMPTY_MONTHS = delete(LeaderboardTotal).where(
+    LeaderboardTotal.user_id == bindparam("user_id"),
+    LeaderboardTotal.period_key != ALL_TIME,
+    LeaderboardTotal.rides == 0,
+)
+
+
+async def refresh_user_totals(session: AsyncSession, user_id: str, months: Iterable[str] = ()) -> dict:
+    """Recompute the user's lifetime row and the given month rows in the write transaction.
+
+    Returns the refreshed lifetime totals.
+    """
+    lifetime = (await session.execute(_REFRESH_ALL_TIME, {"for_user": user_id, "for_period": ALL_TIME})).one()
+    for month in sorted(set(months)):
+        month_start, month_end = month_range(month)
+        await session.execute(
+            _REFRESH_MONTH,
+            {"for_user": user_id, "for_period": month, "month_start": month_start, "month_end": month_end},
+        )
+    await session.execute(_DROP_EMPTY_MONTHS, {"user_id": user_id})
+    return {
+        "hours": round(float(lifetime.hours), 2),
+        "net": round(float(lifetime.net), 2),
+        "gross": round(float(lifetime.gross), 2),
+        "rides": int(lifetime.rides),
+    }
+
+
+def _totals_source(live: bool):
+    """Per-user totals for a period: the maintained table, or a live aggregate for custom ranges."""
+    if not live:
+        return (
+            select(
+                LeaderboardTotal.user_id,
+                LeaderboardTotal.hours,
+                LeaderboardTotal.net,
+                LeaderboardTotal.gross,
+                LeaderboardTotal.rides,
+            )
+            .where(LeaderboardTotal.period_key == bindparam("period_key"))
+            .subquery()
+        )
+    return (
+        select(
+            Ride.user_id,
+            func.coalesce(func.sum(Ride.total_hours), 0).label("hours"),
+            func.coalesce(func.sum(Ride.net_pay), 0).label("net"),
+            func.coalesce(func.sum(Ride.gross_total), 0).label("gross"),
+            func.count(Ride.id).label("rides"),
+        )
+        .where(Ride.date >= bindparam("date_from"), Ride.date <= bindparam("date_to"))
+        .group_by(Ride.user_id)
+        .subquery()
+    )
+
+
+def _ranked(metric: str, live: bool):
+    totals = _totals_source(live)
+    metric_col = totals.c[metric]
+    return (
+        select(
+            totals.c.user_id,
+            totals.c.hours,
+            totals.c.net,
+            totals.c.gross,
+            totals.c.rides,
+            metric_col.label("metric"),
+            func.rank().over(order_by=metric_col.desc()).label("rank"),
+            func.row_number().over(order_by=(metric_col.desc(), totals.c.user_id)).label("position"),
+        )
+    ).subquery()
+
+
+@lru_cache(maxsize=None)
+def _statements(metric: str, live: bool):
+    """Page, count and position statements for one metric, built once and reused with parameters."""
+    ranked = _ranked(metric, live)
+    page = (
+        select(ranked, User.name)
+        .join(User, User.id == ranked.c.user_id)
+        .order_by(ranked.c.position)
+        .limit(bindparam("limit", type_=Integer))
+        .offset(bindparam("offset", type_=Integer))
+    )
+    count = select(func.count()).select_from(ranked)
+    user_id = bindparam("user_id")
+    neighbours = bindparam("neighbours", type_=Integer)
+    mine = select(ranked.c.position).where(ranked.c.user_id == user_id).scalar_subquery()
+    position = (
+        select(ranked, User.name, (ranked.c.user_id == user_id).label("is_me"))
+        .join(User, User.id == ranked.c.user_id)
+        .where(ranked.c.position.between(mine - neighbours, mine + neighbours))
+        .order_by(ranked.c.position)
+    )
+    return page, count, position
+
+
+def _period_params(period_key: Optional[str], date_from: Optional[str], date_to: Optional[str]) -> dict:
+    if period_key is not None:
+        return {"period_key": period_key}
+    return {"date_from": date_from, "date_to": date_to}
+
+
+def _row_to_dict(row, metric: str, rank: Optional[int] = None) -> dict:
+    return {
+        "rank": int(row.rank) if rank is None else rank,
+        "user_id": row.user_id,
+        "name": row.name,
+        "hours": round(float(row.hours or 0), 2),
+        "net": round(float(row.net or 0), 2),
+        "gross": round(float(row.gross or 0), 2),
+        "rides": int(row.rides or 0),
+        "metric": round(float(row.metric or 0), 2) if metric != "rides" else int(row.metric or 0),
+    }
+
+
+async def leaderboard_page(
+    session: AsyncSession,
+    metric: str,
+    period_key: Optional[str],
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = 50,
+    offset: int = 0,
+) -> dict:
+    page, count, _ = _statements(metric, period_key is None)
+    params = _period_params(period_key, date_from, date_to)
+    rows = (await session.execute(page, {**params, "limit": limit, "offset": offset})).all()
+    total = (await session.execute(count, params)).scalar_one()
+    return {"total": total, "rows": [_row_to_dict(row, metric) for row in rows]}
+
+
+async def leaderboard_position(
+    session: AsyncSession,
+    user_id: str,
+    metric: str,
+    period_key: Optional[str],
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    neighbours: int = 2,
+) -> dict:
+    """The user's rank plus up to ``neighbours`` rows on either side of them."""
+    _, _, position = _statements(metric, period_key is None)
+    params = {**_period_params(period_key, date_from, date_to), "user_id": user_id, "neighbours": neighbours}
+    rows = (await session.execute(position, params)).all()
+    result: dict = {"rank": None, "row": None, "above": [], "below": []}
+    target: List[dict] = result["above"]
+    for row in rows:
+        entry = _row_to_dict(row, metric)
+        if row.is_me:
+            result["rank"], result["row"] = entry["rank"], entry
+            target = result["below"]
+        else:
+            target.append(entry)
+    return result
+
+
+# Sharded mode: every shard ranks its own users, the pages are merged here.
+
+
+@lru_cache(maxsize=None)
+def _shard_statements(metric: str, live: bool):
+    """Statements locating a metric value among one shard's users, for the sharded position."""
+    totals = _totals_source(live)
+    metric_col = totals.c[metric]
+    value = bindparam("value")
+    user_id = bindparam("user_id")
+    neighbours = bindparam("neighbours", type_=Integer)
+    rows = select(
+        totals.c.user_id,
+        totals.c.hours,
+        totals.c.net,
+        totals.c.gross,
+        totals.c.rides,
+        metric_col.label("metric"),
+        User.name,
+    ).join(User, User.id == totals.c.user_id)
+    # The board's order: metric descending, then user id.
+    before = or_(metric_col > value, and_(metric_col == value, totals.c.user_id < user_id))
+    after = or_(metric_col < value, and_(metric_col == value, totals.c.user_id > user_id))
+    mine = rows.where(totals.c.user_id == user_id)
+    counts = select(
+        func.count().filter(metric_col > value).label("greater"),
+        func.count().filter(before).label("before"),
+    ).select_from(totals)
+    above = rows.where(before).order_by(metric_col.asc(), totals.c.user_id.desc()).limit(neighbours)
+    below = rows.where(after).order_by(metric_col.desc(), totals.c.user_id.asc()).limit(neighbours)
+    return mine, counts, above, below
+
+
+async def _scatter(factories: Sequence[async_sessionmaker], work: Callable[[AsyncSession], Awaitable]) -> list:
+    async def run(factory: async_sessionmaker):
+        async with factory() as session:
+            return await work(session)
+
+    return await asyncio.gather(*(run(factory) for factory in factories))
+
+
+def _board_order(row):
+    return -row.metric, row.user_id
+
+
+def _ranked_dicts(rows: list, metric: str, first_position: int, first_rank: int) -> List[dict]:
+    """Dicts for consecutive board rows; tied rows share the rank of the first of them."""
+    result: List[dict] = []
+    rank = first_rank
+    for offset, row in enumerate(rows):
+        if offset and row.metric != rows[offset - 1].metric:
+            rank = first_position + offset
+        result.append(_row_to_dict(row, metric, rank))
+    return result
+
+
+async def sharded_leaderboard_page(
+    factories: Sequence[async_sessionmaker],
+    metric: str,
+    period_key: Optional[str],
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = 50,
+    offset: int = 0,
+) -> dict:
+    """``leaderboard_page`` over all shards.
+
+    Each shard returns its first ``offset + limit`` rows; every row ranking
+    above one on the page is among them, so ranks come out as on one database.
+    """
+    page, count, _ = _statements(metric, period_key is None)
+    params = _period_params(period_key, date_from, date_to)
+
+    async def work(session: AsyncSession):
+        rows = (await session.execute(page, {**params, "limit": offset + limit, "offset": 0})).all()
+        total = (await session.execute(count, params)).scalar_one()
+        return rows, total
+
+    results = await _scatter(factories, work)
+    merged = sorted((row for rows, _ in results for row in rows), key=_board_order)[: offset + limit]
+    ranked = _ranked_dicts(merged, metric, 1, 1)
+    return {"total": sum(total for _, total in results), "rows": ranked[offset:]}
+
+
+async def sharded_leaderboard_position(
+    factories: Sequence[async_sessionmaker],
+    home: int,
+    user_id: str,
+    metric: str,
+    period_key: Optional[str],
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    neighbours: int = 2,
+) -> dict:
+    """``leaderboard_position`` over all shards; ``home`` is the index of the user's shard."""
+    mine, counts, above, below = _shard_statements(metric, period_key is None)
+    params = _period_params(period_key, date_from, date_to)
+    result: dict = {"rank": None, "row": None, "above": [], "below": []}
+
+    async with factories[home]() as session:
+        me = (await session.execute(mine, {**params, "user_id": user_id})).one_or_none()
+    if me is None:
+        return result
+
+    located = {**params, "user_id": user_id, "value": me.metric, "neighbours": neighbours}
+
+    async def work(session: AsyncSession):
+        return (
+            (await session.execute(counts, located)).one(),
+            (await session.execute(above, located)).all(),
+            (await session.execute(below, located)).all(),
+        )
+
+    results = await _scatter(factories, work)
+    rank = 1 + sum(found[0].greater for found in results)
+    position = 1 + sum(found[0].before for found in results)
+    # Each shard returned its closest rows on either side; keep the closest overall.
+    rows_above = sorted((row for found in results for row in found[1]), key=_board_order)
+    rows_above = rows_above[max(0, len(rows_above) - neighbours) :]
+    rows_below = sorted((row for found in results for row in found[2]), key=_board_order)[:neighbours]
+
+    window = [*rows_above, me, *rows_below]
+    first_position = position - len(rows_above)
+    if not rows_above or rows_above[0].metric == me.metric:
+        first_rank = rank
+    else:
+        first = {**located, "value": rows_above[0].metric, "user_id": rows_above[0].user_id}
+
+        async def count_greater(session: AsyncSession):
+            return (await session.execute(counts, first)).one().greater
+
+        first_rank = 1 + sum(await _scatter(factories, count_greater))
+    entries = _ranked_dicts(window, metric, first_position, first_rank)
+
+    result["above"] = entries[: len(rows_above)]
+    result["row"] = entries[len(rows_above)]
+    result["rank"] = result["row"]["rank"]
+    result["below"] = entries[len(rows_above) + 1 :]
+    return result
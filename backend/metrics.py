@@ -0,0 +1,23 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import Dict
+
+
+class Metrics:
+    """Process-local counters exposed through GET /api/metrics."""
+
+    def __init__(self) -> None:
+        self._counters: Dict[str, float] = defaultdict(int)
+
+    def incr(self, name: str, amount: float = 1) -> None:
+        self._counters[name] += amount
+
+    def get(self, name: str) -> float:
+        return self._counters.get(name, 0)
+
+    def snapshot(self) -> Dict[str, float]:
+        return dict(sorted(self._counters.items()))
+
+
+metrics = Metrics()
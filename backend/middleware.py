@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Iterable
+
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from metrics import metrics
+
+
+class CancelOnDisconnect:
+    """Cancel the handler of a request whose client went away.
+
+    Starlette keeps running a handler after the client disconnected, holding
+    its connection until the query finishes. For the paths given, the
+    handler runs in its own task while this middleware watches the client;
+    on disconnect the task is cancelled, which makes asyncpg cancel the
+    running statement and releases the connection.
+    """
+
+    def __init__(self, app: ASGIApp, paths: Iterable[str]) -> None:
+        self.app = app
+        self.paths = tuple(paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        # The handler reads the request body through this queue, so only this
+        # middleware calls ``receive``.
+        messages: asyncio.Queue = asyncio.Queue()
+
+        async def receive_message() -> Message:
+            return await messages.get()
+
+        handler = asyncio.create_task(self.app(scope, receive_message, send))
+        try:
+            while not handler.done():
+                listener = asyncio.ensure_future(receive())
+                await asyncio.wait({handler, listener}, return_when=asyncio.FIRST_COMPLETED)
+                if not listener.done():
+                    listener.cancel()
+                    break
+                message = listener.result()
+                if message["type"] == "http.disconnect" and not handler.done():
+                    metrics.incr("request.cancelled")
+                    handler.cancel()
+                    break
+                messages.put_nowait(message)
+        finally:
+            if not handler.done():
+                handler.cancel()
+            try:
+                await handler
+            except asyncio.CancelledError:
+                pass
+
+
+class SelectiveGZip(GZipMiddleware):
+    """GZip responses of at least ``minimum_size`` bytes, except for the paths in ``exclude``.
+
+    Compressing holds back what was written until the compressor emits it,
+    which would stall server-sent events; binary exports are excluded too.
+    """
+
+    def __init__(
+        self, app: ASGIApp, minimum_size: int = 500, compresslevel: int = 9, exclude: Iterable[str] = ()
+    ) -> None:
+        super().__init__(app, minimum_size=minimum_size, compresslevel=compresslevel)
+        self.exclude = tuple(exclude)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"].startswith(self.exclude):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
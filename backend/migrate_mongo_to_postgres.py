@@ -12,7 +12,8 @@ import certifi
 from sqlalchemy import select
 
 from db import AsyncSessionLocal, engine
-from models import Base, Ride, Settings, User
+from migrations import backfill_leaderboard_totals, backfill_ride_time_fields, upgrade_schema
+from models import Ride, Settings, User
 
 ROOT_DIR = Path(__file__).resolve().parents[1]
 load_dotenv(ROOT_DIR / ".env")
@@ -35,7 +36,7 @@ def _strip_mongo_id(doc: Dict[str, Any]) -> Dict[str, Any]:
 
 async def _ensure_tables() -> None:
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await upgrade_schema(conn)
 
 
 async def _migrate_users(mongo_db) -> None:
@@ -92,7 +93,7 @@ async def _migrate_rides(mongo_db) -> None:
     async with AsyncSessionLocal() as session:
         for doc in rides:
             doc = _strip_mongo_id(doc)
-            existing = await session.get(Ride, doc.get("id"))
+            existing = (await session.execute(select(Ride).where(Ride.id == doc.get("id")))).scalar_one_or_none()
             if existing:
                 continue
             ride = Ride(
@@ -125,6 +126,13 @@ async def _migrate_rides(mongo_db) -> None:
         await session.commit()
 
 
+async def _backfill() -> None:
+    # Startup runs the backfills only once, before these rides existed.
+    async with engine.begin() as conn:
+        await backfill_leaderboard_totals(conn)
+        await backfill_ride_time_fields(conn)
+
+
 async def _show_counts() -> None:
     async with AsyncSessionLocal() as session:
         users = (await session.execute(select(User))).scalars().all()
@@ -155,6 +163,7 @@ async def main() -> None:
     await _migrate_users(mongo_db)
     await _migrate_settings(mongo_db)
     await _migrate_rides(mongo_db)
+    await _backfill()
     await _show_counts()
 
     mongo_client.close()
@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+from typing import Awaitable, Callable
+
+from sqlalchemy import bindparam, select, text, tuple_, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from models import RIDE_SEARCH_DOCUMENT, Base, Ride
+from partitions import ensure_partitions, partition_rides
+from stats import ride_time_fields
+
+
+async def backfill_ride_time_fields(conn: AsyncConnection, batch_size: int = 1000) -> None:
+    """Derived time columns for rides that predate them.
+
+    Walks the rides in primary key order, so each batch continues where the
+    last one stopped instead of scanning again from the start, and updates
+    by the full key, so each update touches only the ride's own partition.
+    """
+    last = None
+    while True:
+        query = (
+            select(Ride.id, Ride.date, Ride.start_time, Ride.end_time)
+            .where(Ride.hour_mask.is_(None))
+            .order_by(Ride.id, Ride.date)
+            .limit(batch_size)
+        )
+        if last is not None:
+            query = query.where(tuple_(Ride.id, Ride.date) > tuple_(*last))
+        rows = (await conn.execute(query)).all()
+        if not rows:
+            return
+        await conn.execute(
+            update(Ride.__table__)
+            .where(Ride.__table__.c.id == bindparam("ride_id"), Ride.__table__.c.date == bindparam("ride_date"))
+            .values(
+                weekday=bindparam("weekday"),
+                week_key=bindparam("week_key"),
+                hour_mask=bindparam("hour_mask"),
+            ),
+            [
+                {"ride_id": row.id, "ride_date": row.date, **ride_time_fields(row.date, row.start_time, row.end_time)}
+                for row in rows
+            ],
+        )
+        last = (rows[-1].id, rows[-1].date)
+
+
+async def backfill_leaderboard_totals(conn: AsyncConnection) -> None:
+    """Leaderboard aggregates for users and rides that predate the table; skips users who have them."""
+    await conn.execute(
+        text(
+            """
+            INSERT INTO leaderboard_totals (user_id, period_key, hours, net, gross, rides)
+            SELECT r.user_id, substr(r.date, 1, 7), coalesce(sum(r.total_hours), 0), coalesce(sum(r.net_pay), 0),
+                   coalesce(sum(r.gross_total), 0), count(r.id)
+            FROM rides r
+            WHERE NOT EXISTS (SELECT 1 FROM leaderboard_totals t WHERE t.user_id = r.user_id)
+            GROUP BY r.user_id, substr(r.date, 1, 7)
+            """
+        )
+    )
+    await conn.execute(
+        text(
+            """
+            INSERT INTO leaderboard_totals (user_id, period_key, hours, net, gross, rides)
+            SELECT u.id, 'all', coalesce(sum(r.total_hours), 0), coalesce(sum(r.net_pay), 0),
+                   coalesce(sum(r.gross_total), 0), count(r.id)
+            FROM users u LEFT JOIN rides r ON r.user_id = u.id
+            WHERE NOT EXISTS (SELECT 1 FROM leaderboard_totals t WHERE t.user_id = u.id AND t.period_key = 'all')
+            GROUP BY u.id
+            """
+        )
+    )
+
+
+async def create_search_index(conn: AsyncConnection) -> None:
+    """GIN index over (user_id, search_vector), so a search reads only the user's matches.
+
+    The composite index needs btree_gin; where the extension cannot be
+    installed, fall back to a GIN index on the document alone.
+    """
+    exists = (await conn.execute(text("SELECT to_regclass('ix_rides_user_search')"))).scalar()
+    if exists is not None:
+        return
+    try:
+        async with conn.begin_nested():
+            await conn.execute(text("CREATE EXTENSION IF NOT EXISTS btree_gin"))
+            await conn.execute(text("CREATE INDEX ix_rides_user_search ON rides USING gin (user_id, search_vector)"))
+    except DBAPIError:
+        await conn.execute(text("CREATE INDEX ix_rides_user_search ON rides USING gin (search_vector)"))
+
+
+Step = Callable[[AsyncConnection], Awaitable[None]]
+
+
+def once(name: str, step: Step) -> Step:
+    """``step`` run on the first startup that reaches it and recorded in schema_migrations.
+
+    For backfills: they scan whole tables, and every boot of every worker
+    would otherwise repeat that while holding the schema lock.
+    """
+
+    async def run(conn: AsyncConnection) -> None:
+        applied = await conn.execute(text("SELECT 1 FROM schema_migrations WHERE name = :name"), {"name": name})
+        if applied.first() is not None:
+            return
+        await step(conn)
+        await conn.execute(text("INSERT INTO schema_migrations (name) VALUES (:name)"), {"name": name})
+
+    return run
+
+
+# create_all only creates missing tables; columns added to existing tables
+# after the initial release are brought in here, as SQL strings or async
+# callables taking the connection. Every step must be idempotent because this
+# runs on each startup; backfills are wrapped in once() so they run only once.
+SCHEMA_UPGRADES = [
+    """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        name VARCHAR PRIMARY KEY,
+        applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+    )
+    """,
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS data_version BIGINT NOT NULL DEFAULT 0",
+    once("backfill_leaderboard_totals", backfill_leaderboard_totals),
+    "ALTER TABLE rides ADD COLUMN IF NOT EXISTS weekday SMALLINT",
+    "ALTER TABLE rides ADD COLUMN IF NOT EXISTS week_key VARCHAR",
+    "ALTER TABLE rides ADD COLUMN IF NOT EXISTS hour_mask INTEGER",
+    once("backfill_ride_time_fields", backfill_ride_time_fields),
+    "ALTER TABLE rides ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0",
+    "ALTER TABLE rides ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE",
+    "CREATE INDEX IF NOT EXISTS ix_rides_user_version ON rides (user_id, version)",
+    partition_rides,
+    ensure_partitions,
+    "ALTER TABLE rides ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    f"GENERATED ALWAYS AS ({RIDE_SEARCH_DOCUMENT}) STORED",
+    create_search_index,
+]
+
+
+# Arbitrary constant; serialises schema upgrades when several workers boot at once.
+SCHEMA_LOCK_ID = 0x6764_7276
+
+
+async def upgrade_schema(conn: AsyncConnection) -> None:
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": SCHEMA_LOCK_ID})
+    await conn.run_sync(Base.metadata.create_all)
+    for step in SCHEMA_UPGRADES:
+        if callable(step):
+            await step(conn)
+        else:
+            await conn.execute(text(step))
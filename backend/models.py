@@ -2,8 +2,22 @@ from __future__ import annotations
 
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, Float, ForeignKey, Index, String
-from sqlalchemy.orm import declarative_base
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Computed,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    SmallInteger,
+    String,
+    Text,
+    func,
+)
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
+from sqlalchemy.orm import declarative_base, deferred
 
 Base = declarative_base()
 
@@ -16,6 +30,8 @@ class User(Base):
     name = Column(String, nullable=False)
     password_hash = Column(String, nullable=False)
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+    # Bumped on every ride or settings write; drives ETags on the read endpoints.
+    data_version = Column(BigInteger, nullable=False, default=0, server_default="0")
 
 
 class Settings(Base):
@@ -30,12 +46,25 @@ class Settings(Base):
     normal_hours_threshold = Column(Float, nullable=False)
 
 
+# Text searched by /api/rides/search. The 'simple' configuration does no
+# stemming or stop words, which suits names and mixed Dutch/French notes.
+RIDE_SEARCH_DOCUMENT = (
+    "to_tsvector('simple'::regconfig, coalesce(notes, '') || ' ' || client_name || ' ' "
+    "|| car_brand || ' ' || car_model)"
+)
+
+
 class Ride(Base):
+    """A ride; the table is range partitioned by month on ``date`` (see partitions.py)."""
+
     __tablename__ = "rides"
+    __table_args__ = {"postgresql_partition_by": "RANGE (date)"}
 
+    # The partition key has to be part of the primary key.
     id = Column(String, primary_key=True)
     user_id = Column(String, ForeignKey("users.id"), index=True, nullable=False)
-    date = Column(String, index=True, nullable=False)
+    # Byte-wise collation keeps the partition bounds and month ranges exact.
+    date = Column(String(collation="C"), primary_key=True, index=True, nullable=False)
     client_name = Column(String, nullable=False)
     car_brand = Column(String, nullable=False)
     car_model = Column(String, nullable=False)
@@ -57,6 +86,90 @@ class Ride(Base):
     social_contribution = Column(Float, default=0.0)
     net_pay = Column(Float, default=0.0)
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+    # Derived from date/start_time/end_time on write (see stats.ride_time_fields).
+    weekday = Column(SmallInteger)
+    week_key = Column(String)
+    hour_mask = Column(Integer)
+    # The owner's data_version at the time of the last write, for delta sync.
+    version = Column(BigInteger, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+    # Maintained by Postgres and indexed together with user_id (see
+    # migrations.create_search_index); never loaded with the ride.
+    search_vector = deferred(Column(TSVECTOR, Computed(RIDE_SEARCH_DOCUMENT, persisted=True)))
 
 
 Index("ix_rides_user_date", Ride.user_id, Ride.date)
+Index("ix_rides_user_version", Ride.user_id, Ride.version)
+
+
+class RideDeletion(Base):
+    """Tombstone for a deleted ride so delta sync clients can drop it."""
+
+    __tablename__ = "ride_deletions"
+
+    ride_id = Column(String, primary_key=True)
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    version = Column(BigInteger, nullable=False)
+    deleted_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+
+
+Index("ix_ride_deletions_user_version", RideDeletion.user_id, RideDeletion.version)
+
+
+class UserStats(Base):
+    """Precomputed unfiltered /api/stats document, tagged with the data version it reflects."""
+
+    __tablename__ = "user_stats"
+
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    data_version = Column(BigInteger, nullable=False)
+    payload = Column(JSONB, nullable=False)
+    updated_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+
+
+class LeaderboardTotal(Base):
+    """Per-user aggregates for the leaderboard, maintained on every ride write.
+
+    ``period_key`` is ``"all"`` for the lifetime totals or a ``YYYY-MM`` month.
+    """
+
+    __tablename__ = "leaderboard_totals"
+
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    period_key = Column(String, primary_key=True)
+    hours = Column(Float, nullable=False, default=0.0)
+    net = Column(Float, nullable=False, default=0.0)
+    gross = Column(Float, nullable=False, default=0.0)
+    rides = Column(Integer, nullable=False, default=0)
+
+
+for _metric in ("hours", "net", "gross", "rides"):
+    Index(
+        f"ix_leaderboard_totals_{_metric}",
+        LeaderboardTotal.period_key,
+        getattr(LeaderboardTotal, _metric).desc(),
+        LeaderboardTotal.user_id,
+    )
+
+
+class UserDirectory(Base):
+    """Which shard holds each user, kept on shard 0 when DATABASE_SHARD_URLS is set (see sharding.py)."""
+
+    __tablename__ = "user_directory"
+
+    user_id = Column(String, primary_key=True)
+    email = Column(String, unique=True, nullable=False)
+    shard = Column(SmallInteger, nullable=False)
+
+
+class SlowQuery(Base):
+    """A statement that exceeded SLOW_QUERY_MS, written by slowlog when SLOW_QUERY_TABLE=1."""
+
+    __tablename__ = "slow_queries"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    recorded_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    duration_ms = Column(Float, nullable=False)
+    statement = Column(Text, nullable=False)
+    parameters = Column(JSONB)
+    plan = Column(JSONB)
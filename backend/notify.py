@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Callable, List, Optional
+
+import asyncpg
+from sqlalchemy import func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import DATABASE_SHARD_URLS, DATABASE_URL, asyncpg_dsn, ssl_connect_args
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "getdriven_invalidate"
+# pg_notify raises, failing the write transaction, on payloads of 8000 bytes or more.
+NOTIFY_MAX_BYTES = 7999
+
+# Worker processes uvicorn starts; it reads the same variable.
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
+
+# LISTEN needs a session-level connection. Transaction-mode poolers such as
+# the Neon "-pooler" endpoint accept LISTEN without error but never deliver a
+# notification, so with several workers a direct URL is required.
+DATABASE_LISTEN_URL = os.environ.get("DATABASE_LISTEN_URL")
+if WEB_CONCURRENCY > 1 and not DATABASE_LISTEN_URL:
+    raise RuntimeError("DATABASE_LISTEN_URL is required when WEB_CONCURRENCY > 1")
+LISTEN_URL = DATABASE_LISTEN_URL or DATABASE_URL
+# Writers notify on their own shard's database, so listen on every shard;
+# DATABASE_SHARD_LISTEN_URLS lists direct URLs for them, in the same order.
+SHARD_LISTEN_URLS = [
+    url.strip() for url in os.environ.get("DATABASE_SHARD_LISTEN_URLS", "").split(",") if url.strip()
+] or DATABASE_SHARD_URLS
+if len(SHARD_LISTEN_URLS) != len(DATABASE_SHARD_URLS):
+    raise RuntimeError("DATABASE_SHARD_LISTEN_URLS must list one URL per entry of DATABASE_SHARD_URLS")
+LISTEN_URLS = [LISTEN_URL, *SHARD_LISTEN_URLS]
+
+
+def is_pooled(url: str) -> bool:
+    """Whether ``url`` points at a transaction pooler: a Neon "-pooler" host or pgbouncer's port."""
+    parsed = make_url(url)
+    return "-pooler" in (parsed.host or "") or parsed.port == 6432
+
+
+for _url in LISTEN_URLS:
+    if not is_pooled(_url):
+        continue
+    _host = make_url(_url).host
+    if WEB_CONCURRENCY > 1:
+        raise RuntimeError(
+            f"Cache invalidation would listen on the pooled endpoint {_host}, which delivers no "
+            "notifications; set DATABASE_LISTEN_URL (and DATABASE_SHARD_LISTEN_URLS) to direct URLs"
+        )
+    logger.warning(
+        "Cache invalidation listens on the pooled endpoint %s, which delivers no notifications; "
+        "other processes will serve stale data after writes",
+        _host,
+    )
+
+Handler = Callable[[Optional[str]], None]
+EventHandler = Callable[[Optional[str], Optional[dict]], None]
+
+
+class InvalidationBus:
+    """Cross-process cache invalidation over Postgres LISTEN/NOTIFY.
+
+    Writers call ``publish`` inside their transaction, so the notification is
+    delivered only if the write commits, and ``notify_local`` after commit to
+    evict their own caches immediately. Every process keeps one dedicated
+    connection per shard listening on the channel and runs the registered handlers with
+    the user id from the payload. Handlers receive ``None`` after the listener
+    reconnects, since notifications may have been missed in the meantime.
+
+    A write may attach a small event (the live update for /api/stream); event
+    handlers get it on the other processes. An event that would push the
+    payload past Postgres' NOTIFY limit is replaced by a ``resync`` event, so
+    the write itself never fails on it.
+    """
+
+    def __init__(self, channel: str = INVALIDATION_CHANNEL, listen_urls: List[str] = LISTEN_URLS) -> None:
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self._listen_urls = listen_urls
+        self._handlers: List[Handler] = []
+        self._event_handlers: List[EventHandler] = []
+        self._tasks: List[asyncio.Task] = []
+
+    def subscribe(self, handler: Handler) -> None:
+        self._handlers.append(handler)
+
+    def subscribe_events(self, handler: EventHandler) -> None:
+        self._event_handlers.append(handler)
+
+    async def publish(self, session: AsyncSession, user_id: str, event: Optional[dict] = None) -> None:
+        message = {"user_id": user_id, "origin": self.origin}
+        if event:
+            message["event"] = event
+        payload = json.dumps(message, default=str)
+        if len(payload.encode("utf-8")) > NOTIFY_MAX_BYTES:
+            metrics.incr("notify.oversized")
+            message["event"] = {"type": "resync"}
+            payload = json.dumps(message)
+        await session.execute(select(func.pg_notify(self.channel, payload)))
+
+    def notify_local(self, user_id: Optional[str]) -> None:
+        for handler in self._handlers:
+            try:
+                handler(user_id)
+            except Exception:
+                logger.exception("Invalidation handler failed")
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._listen_forever(url)) for url in self._listen_urls]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _on_notification(self, connection, pid, channel, payload) -> None:
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            logger.warning("Ignoring malformed invalidation payload %r", payload)
+            return
+        if message.get("origin") == self.origin:
+            return
+        self.notify_local(message.get("user_id"))
+        if message.get("event"):
+            for handler in self._event_handlers:
+                try:
+                    handler(message.get("user_id"), message["event"])
+                except Exception:
+                    logger.exception("Event handler failed")
+
+    async def _listen_forever(self, listen_url: str) -> None:
+        delay = 1.0
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(asyncpg_dsn(listen_url), **ssl_connect_args(listen_url))
+                await connection.add_listener(self.channel, self._on_notification)
+                # Anything published while we were disconnected is lost.
+                self.notify_local(None)
+                logger.info("Listening for cache invalidations on %s", self.channel)
+                delay = 1.0
+                while not connection.is_closed():
+                    await asyncio.sleep(5)
+                    await connection.execute("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.warning("Invalidation listener disconnected (%s); retrying in %.0fs", exc, delay)
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
@@ -0,0 +1,215 @@
+"""Monthly range partitions of the rides table.
+
+``rides`` is partitioned by ``date`` (``YYYY-MM-DD`` strings, collation "C").
+Every month gets its own partition ``rides_YYYY_MM`` covering the string
+range ``['YYYY-MM', next month)``; rides outside those land in
+``rides_default``. Startup creates the partitions up to
+PARTITION_MONTHS_AHEAD months ahead; run ``ensure`` from cron for servers
+that stay up longer than that.
+
+    python partitions.py list
+    python partitions.py ensure --ahead 6
+    python partitions.py detach --before 2021-01
+
+Detached partitions become plain tables, out of every query. The lifetime
+leaderboard totals of their drivers shrink accordingly on their next write.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import re
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from models import Ride
+
+PARTITION_MONTHS_AHEAD = int(os.environ.get("PARTITION_MONTHS_AHEAD", "3"))
+DEFAULT_PARTITION = "rides_default"
+
+_MONTH = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
+_PARTITION_NAME = re.compile(r"^rides_(\d{4})_(\d{2})$")
+
+
+def month_range(prefix: str) -> Tuple[str, str]:
+    """Half-open string range holding exactly the dates starting with ``prefix``.
+
+    For ``"2024-03"`` that is ``["2024-03", "2024-04")``, the bounds of the
+    month's partition, so ``date >= lower AND date < upper`` prunes to it where
+    ``LIKE '2024-03%'`` would scan every partition.
+    """
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def add_months(month: str, count: int) -> str:
+    year, mon = int(month[:4]), int(month[5:7])
+    index = year * 12 + mon - 1 + count
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def partition_name(month: str) -> str:
+    return f"rides_{month[:4]}_{month[5:7]}"
+
+
+async def is_partitioned(conn: AsyncConnection) -> bool:
+    return bool(
+        (
+            await conn.execute(
+                text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('rides'))")
+            )
+        ).scalar()
+    )
+
+
+async def list_partitions(conn: AsyncConnection) -> List[str]:
+    rows = await conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass('rides') ORDER BY c.relname"
+        )
+    )
+    return [row[0] for row in rows]
+
+
+def _copied_columns() -> str:
+    # Generated columns are filled in by Postgres, which refuses explicit values.
+    return ", ".join(column.name for column in Ride.__table__.columns if column.computed is None)
+
+
+async def create_month_partition(conn: AsyncConnection, month: str) -> bool:
+    """Create the partition for ``month`` unless it exists; returns whether it was created.
+
+    Rides of that month already sitting in the default partition are moved
+    into the new one, which Postgres requires before the range can be added.
+    """
+    if not _MONTH.match(month):
+        raise ValueError(f"Invalid month: {month}")
+    name = partition_name(month)
+    if (await conn.execute(text("SELECT to_regclass(:name)"), {"name": name})).scalar() is not None:
+        return False
+    lower, upper = month_range(month)
+    bounds = f"FROM ('{lower}') TO ('{upper}')"
+    stranded = (
+        await conn.execute(
+            text(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE date >= :lower AND date < :upper)"),
+            {"lower": lower, "upper": upper},
+        )
+    ).scalar()
+    if not stranded:
+        await conn.execute(text(f"CREATE TABLE {name} PARTITION OF rides FOR VALUES {bounds}"))
+        return True
+    await conn.execute(text(f"ALTER TABLE rides DETACH PARTITION {DEFAULT_PARTITION}"))
+    await conn.execute(text(f"CREATE TABLE {name} PARTITION OF rides FOR VALUES {bounds}"))
+    params = {"lower": lower, "upper": upper}
+    columns = _copied_columns()
+    await conn.execute(
+        text(
+            f"INSERT INTO rides ({columns}) SELECT {columns} FROM {DEFAULT_PARTITION} "
+            "WHERE date >= :lower AND date < :upper"
+        ),
+        params,
+    )
+    await conn.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE date >= :lower AND date < :upper"), params)
+    await conn.execute(text(f"ALTER TABLE rides ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+    return True
+
+
+async def ensure_partitions(
+    conn: AsyncConnection, months: Iterable[str] = (), ahead: int = PARTITION_MONTHS_AHEAD
+) -> List[str]:
+    """Create the default partition, the given months and the coming ``ahead`` months."""
+    if not await is_partitioned(conn):
+        return []
+    await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF rides DEFAULT"))
+    current = datetime.now(timezone.utc).strftime("%Y-%m")
+    wanted = set(months) | {add_months(current, offset) for offset in range(-1, ahead + 1)}
+    return [month for month in sorted(wanted) if await create_month_partition(conn, month)]
+
+
+async def partition_rides(conn: AsyncConnection) -> None:
+    """Convert an unpartitioned rides table into the partitioned layout, copying all rows.
+
+    Runs once, inside the schema upgrade transaction.
+    """
+    if await is_partitioned(conn):
+        return
+    await conn.execute(text("ALTER TABLE rides RENAME TO rides_unpartitioned"))
+    await conn.execute(text("ALTER TABLE rides_unpartitioned RENAME CONSTRAINT rides_pkey TO rides_unpartitioned_pkey"))
+    # The old indexes keep their names and would clash with the new ones.
+    indexes = await conn.execute(
+        text(
+            "SELECT indexname FROM pg_indexes "
+            "WHERE tablename = 'rides_unpartitioned' AND indexname <> 'rides_unpartitioned_pkey'"
+        )
+    )
+    for (index_name,) in indexes.all():
+        await conn.execute(text(f'DROP INDEX "{index_name}"'))
+
+    await conn.run_sync(Ride.__table__.create)
+    months = (
+        await conn.execute(
+            text(
+                "SELECT DISTINCT substr(date, 1, 7) FROM rides_unpartitioned "
+                "WHERE date ~ '^[0-9]{4}-(0[1-9]|1[0-2])'"
+            )
+        )
+    ).scalars().all()
+    await ensure_partitions(conn, months)
+
+    columns = _copied_columns()
+    await conn.execute(text(f"INSERT INTO rides ({columns}) SELECT {columns} FROM rides_unpartitioned"))
+    await conn.execute(text("DROP TABLE rides_unpartitioned"))
+
+
+async def detach_partitions(conn: AsyncConnection, before: str, drop: bool = False) -> List[str]:
+    """Detach (and optionally drop) the month partitions older than ``before``."""
+    if not _MONTH.match(before):
+        raise ValueError(f"Invalid month: {before}")
+    detached = []
+    for name in await list_partitions(conn):
+        match = _PARTITION_NAME.match(name)
+        if not match or f"{match.group(1)}-{match.group(2)}" >= before:
+            continue
+        await conn.execute(text(f"ALTER TABLE rides DETACH PARTITION {name}"))
+        if drop:
+            await conn.execute(text(f"DROP TABLE {name}"))
+        detached.append(name)
+    return detached
+
+
+async def main(argv: Optional[List[str]] = None) -> None:
+    from db import shard_engines
+
+    parser = argparse.ArgumentParser(description="Manage the monthly partitions of the rides table")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="show the current partitions")
+    ensure = commands.add_parser("ensure", help="create the default and upcoming month partitions")
+    ensure.add_argument("--ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    detach = commands.add_parser("detach", help="detach month partitions older than a month")
+    detach.add_argument("--before", required=True, help="YYYY-MM; partitions before this month are detached")
+    detach.add_argument("--drop", action="store_true", help="drop the detached tables as well")
+    args = parser.parse_args(argv)
+
+    # Every shard has its own rides table.
+    for shard, engine in enumerate(shard_engines):
+        if len(shard_engines) > 1:
+            print(f"Shard {shard}:")
+        async with engine.begin() as conn:
+            if args.command == "list":
+                for name in await list_partitions(conn):
+                    print(name)
+            elif args.command == "ensure":
+                created = await ensure_partitions(conn, ahead=args.ahead)
+                print(f"Created: {', '.join(created) or 'none'}")
+            else:
+                detached = await detach_partitions(conn, args.before, args.drop)
+                print(f"{'Dropped' if args.drop else 'Detached'}: {', '.join(detached) or 'none'}")
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
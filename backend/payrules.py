@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import math
+from bisect import bisect_right
+from dataclasses import dataclass
+from datetime import datetime as dt, timedelta
+from functools import lru_cache
+from typing import Dict, FrozenSet, Tuple
+
+MINUTES_PER_DAY = 1440
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+ALL_DAYS = frozenset(range(7))
+
+# Settings the plan is compiled from, with the defaults calculate_salary used.
+# Every rule's ``rate_setting`` has to be listed here.
+PLAN_SETTINGS = {
+    "base_rate": 12.83,
+    "overtime_multiplier": 1.5,
+    "night_surcharge": 1.46,
+    "normal_hours_threshold": 9.0,
+}
+
+
+@dataclass(frozen=True)
+class SurchargeRule:
+    """An hourly surcharge for work inside daily windows on the given weekdays (Monday is 0).
+
+    ``rate_setting`` names the settings field holding the surcharge per hour.
+    Windows are minutes after midnight, half-open, and may not cross midnight.
+    """
+
+    name: str
+    rate_setting: str
+    windows: Tuple[Tuple[int, int], ...]
+    days: FrozenSet[int] = ALL_DAYS
+
+
+# Pay rules on top of the base and overtime rates. Pricing cost depends on the
+# number of segments in the compiled plan, not on the number of minutes.
+RULES = (
+    SurchargeRule("night", "night_surcharge", ((0, 6 * 60), (20 * 60, MINUTES_PER_DAY))),
+)
+
+
+@dataclass(frozen=True)
+class PayPlan:
+    """Rates plus the week split into segments with the surcharge rules active in each.
+
+    ``starts[i]`` is the first minute of the week of segment ``i``; it runs
+    until ``starts[i + 1]`` (the last one until the end of the week).
+    """
+
+    base_rate: float
+    overtime_multiplier: float
+    threshold_hours: float
+    rule_names: Tuple[str, ...]
+    rule_rates: Tuple[float, ...]
+    starts: Tuple[int, ...]
+    active: Tuple[Tuple[int, ...], ...]
+    weekday_dependent: bool
+
+    def segments(self):
+        """``(start, end, active rule indexes)`` for every segment of the week."""
+        ends = self.starts[1:] + (MINUTES_PER_WEEK,)
+        return zip(self.starts, ends, self.active)
+
+
+def _compile(values: Tuple[float, ...]) -> PayPlan:
+    settings = dict(zip(PLAN_SETTINGS, values))
+    intervals = []
+    for index, rule in enumerate(RULES):
+        for day in rule.days:
+            for window_start, window_end in rule.windows:
+                offset = day * MINUTES_PER_DAY
+                intervals.append((offset + window_start, offset + window_end, index))
+
+    edges = {0, *(start for start, _, _ in intervals), *(end for _, end, _ in intervals)}
+    boundaries = sorted(edges - {MINUTES_PER_WEEK})
+    starts, active = [], []
+    for position, start in enumerate(boundaries):
+        end = boundaries[position + 1] if position + 1 < len(boundaries) else MINUTES_PER_WEEK
+        rules = tuple(sorted({index for low, high, index in intervals if low <= start and end <= high}))
+        if active and active[-1] == rules:
+            continue
+        starts.append(start)
+        active.append(rules)
+
+    return PayPlan(
+        base_rate=settings["base_rate"],
+        overtime_multiplier=settings["overtime_multiplier"],
+        threshold_hours=settings["normal_hours_threshold"],
+        rule_names=tuple(rule.name for rule in RULES),
+        rule_rates=tuple(settings[rule.rate_setting] for rule in RULES),
+        starts=tuple(starts),
+        active=tuple(active),
+        weekday_dependent=any(rule.days != ALL_DAYS for rule in RULES),
+    )
+
+
+_compile_cached = lru_cache(maxsize=1024)(_compile)
+
+
+def plan_for(settings: dict) -> PayPlan:
+    """The compiled plan for a user's settings; compiled once per distinct set of values."""
+    return _compile_cached(tuple(settings.get(name, default) for name, default in PLAN_SETTINGS.items()))
+
+
+def rule_minutes(plan: PayPlan, first_minute: int, minute_count: int) -> Tuple[int, ...]:
+    """Minutes worked under each rule, single sweep over the plan's segments.
+
+    Work covers minutes ``[first_minute, first_minute + minute_count)`` of the
+    week and may wrap into the next one.
+    """
+    totals = [0] * len(plan.rule_names)
+    position = first_minute % MINUTES_PER_WEEK
+    remaining = minute_count
+    index = bisect_right(plan.starts, position) - 1
+    while remaining > 0:
+        end = plan.starts[index + 1] if index + 1 < len(plan.starts) else MINUTES_PER_WEEK
+        taken = min(end - position, remaining)
+        for rule in plan.active[index]:
+            totals[rule] += taken
+        remaining -= taken
+        position += taken
+        index += 1
+        if position >= MINUTES_PER_WEEK:
+            position, index = 0, 0
+    return tuple(totals)
+
+
+def price_ride(plan: PayPlan, date_str: str, start_time_str: str, end_time_str: str) -> dict:
+    """Hours and pay of one ride under ``plan``; the result of ``calculate_salary``."""
+    start_dt = dt.fromisoformat(f"{date_str}T{start_time_str}")
+    end_dt = dt.fromisoformat(f"{date_str}T{end_time_str}")
+    if end_dt <= start_dt:
+        end_dt += timedelta(days=1)
+
+    total_minutes = (end_dt - start_dt).total_seconds() / 60
+    total_hours = total_minutes / 60
+
+    normal_hours = min(total_hours, plan.threshold_hours)
+    overtime_hours = max(0, total_hours - plan.threshold_hours)
+    normal_pay = normal_hours * plan.base_rate
+    overtime_pay = overtime_hours * plan.base_rate * plan.overtime_multiplier
+
+    # Work is counted per started minute: the minute starting at the start
+    # time and every whole minute after it, up to the end time.
+    first_minute = start_dt.weekday() * MINUTES_PER_DAY + start_dt.hour * 60 + start_dt.minute
+    minutes = rule_minutes(plan, first_minute, math.ceil(total_minutes))
+
+    hours: Dict[str, float] = {}
+    pay: Dict[str, float] = {}
+    gross_pay = normal_pay + overtime_pay
+    for name, rate, count in zip(plan.rule_names, plan.rule_rates, minutes):
+        hours[name] = count / 60
+        pay[name] = hours[name] * rate
+        gross_pay += pay[name]
+
+    return {
+        "total_hours": round(total_hours, 2),
+        "normal_hours": round(normal_hours, 2),
+        "overtime_hours": round(overtime_hours, 2),
+        "night_hours": round(hours["night"], 2),
+        "normal_pay": round(normal_pay, 2),
+        "overtime_pay": round(overtime_pay, 2),
+        "night_pay": round(pay["night"], 2),
+        "gross_pay": round(gross_pay, 2),
+    }
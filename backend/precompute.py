@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+import queries
+from db import statement_timeout
+from models import UserStats
+from stats import compute_stats
+
+logger = logging.getLogger(__name__)
+
+
+async def store_default_stats(session: AsyncSession, user_id: str) -> None:
+    """Recompute the unfiltered stats document for a user and upsert it."""
+    # Read the version before aggregating: if a write lands in between, the
+    # stored document is newer than its label and is simply recomputed later,
+    # it can never be served as current while being stale.
+    version = (await session.execute(queries.DATA_VERSION, {"user_id": user_id})).scalar_one_or_none()
+    if version is None:
+        return
+    payload = await compute_stats(session, user_id)
+    values = {
+        "user_id": user_id,
+        "data_version": version,
+        "payload": payload,
+        "updated_at": datetime.now(timezone.utc),
+    }
+    stmt = insert(UserStats).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserStats.user_id],
+        set_={k: stmt.excluded[k] for k in ("data_version", "payload", "updated_at")},
+        where=UserStats.data_version <= stmt.excluded.data_version,
+    )
+    await session.execute(stmt)
+    await session.commit()
+
+
+class StatsPrecomputer:
+    """Debounced in-process queue that refreshes UserStats after writes.
+
+    A burst of writes for the same user collapses into one recomputation that
+    runs ``debounce`` seconds after the last write, but never later than
+    ``max_delay`` seconds after the first one. ``session_factory`` returns
+    the session factory of a user's database.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[str], Awaitable[async_sessionmaker]],
+        debounce: float = 0.5,
+        max_delay: float = 5.0,
+        workers: int = 2,
+        statement_timeout_ms: Optional[int] = None,
+    ) -> None:
+        self._session_factory = session_factory
+        self._statement_timeout = statement_timeout_ms
+        self._debounce = debounce
+        self._max_delay = max_delay
+        self._workers = workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._first_seen: Dict[str, float] = {}
+        self._tasks: list = []
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
+
+    async def stop(self) -> None:
+        for handle in self._timers.values():
+            handle.cancel()
+        self._timers.clear()
+        self._first_seen.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def schedule(self, user_id: str) -> None:
+        if self._queue is None:
+            return
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        first = self._first_seen.setdefault(user_id, now)
+        handle = self._timers.pop(user_id, None)
+        if handle:
+            handle.cancel()
+        delay = max(0.0, min(self._debounce, first + self._max_delay - now))
+        self._timers[user_id] = loop.call_later(delay, self._enqueue, user_id)
+
+    def _enqueue(self, user_id: str) -> None:
+        self._timers.pop(user_id, None)
+        self._first_seen.pop(user_id, None)
+        self._queue.put_nowait(user_id)
+
+    async def _worker(self) -> None:
+        # The worker task's own context; the timeout covers all its sessions.
+        statement_timeout.set(self._statement_timeout)
+        while True:
+            user_id = await self._queue.get()
+            try:
+                async with (await self._session_factory(user_id))() as session:
+                    await store_default_stats(session, user_id)
+            except Exception:
+                logger.exception("Precomputing stats for %s failed", user_id)
+            finally:
+                self._queue.task_done()
+
+
+async def load_default_stats(session: AsyncSession, user_id: str) -> Tuple[int, Optional[dict]]:
+    """Return the user's data version and the stored stats document if it is current."""
+    row = (await session.execute(queries.DEFAULT_STATS, {"user_id": user_id})).one_or_none()
+    if row is None:
+        return 0, None
+    version, stored_version, payload = row
+    if stored_version is not None and stored_version == version:
+        return version, payload
+    return version, None
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Tuple
+
+from sqlalchemy import Integer, bindparam, func, literal_column, select, update
+
+from models import Ride, RideDeletion, User, UserStats
+
+# Hot statements are built once at import and executed with parameters, so a
+# request neither rebuilds the construct nor misses SQLAlchemy's compiled
+# cache; asyncpg then reuses the prepared statement on the connection.
+
+DATA_VERSION = select(User.data_version).where(User.id == bindparam("user_id"))
+
+BUMP_DATA_VERSION = (
+    update(User)
+    .where(User.id == bindparam("user_id"))
+    .values(data_version=User.data_version + 1)
+    .returning(User.data_version)
+)
+
+# Held by sharded writes: conflicts with the FOR UPDATE of sharding.move_user
+# but not with other writers of the same user.
+LOCK_USER = select(User.id).where(User.id == bindparam("user_id")).with_for_update(key_share=True)
+
+USER_BY_EMAIL = select(User).where(User.email == bindparam("email"))
+
+USER_RIDE = select(Ride).where(Ride.id == bindparam("ride_id"), Ride.user_id == bindparam("user_id"))
+
+USER_RIDES = select(Ride).where(Ride.user_id == bindparam("user_id")).order_by(Ride.date.desc())
+
+# Bounds from partitions.month_range, so only the month's partition is read.
+USER_RIDES_IN_MONTH = (
+    select(Ride)
+    .where(
+        Ride.user_id == bindparam("user_id"),
+        Ride.date >= bindparam("month_start"),
+        Ride.date < bindparam("month_end"),
+    )
+    .order_by(Ride.date.desc())
+)
+
+
+@lru_cache(maxsize=64)
+def user_ride_columns(fields: Tuple[str, ...], in_month: bool):
+    """USER_RIDES (or USER_RIDES_IN_MONTH) selecting only the given Ride columns."""
+    statement = USER_RIDES_IN_MONTH if in_month else USER_RIDES
+    return statement.with_only_columns(*(getattr(Ride, name) for name in fields))
+
+
+_SEARCH_QUERY = func.websearch_to_tsquery(literal_column("'simple'::regconfig"), bindparam("q"))
+_SEARCH_MATCH = Ride.search_vector.bool_op("@@")(_SEARCH_QUERY)
+_SEARCH_SCORE = func.ts_rank_cd(Ride.search_vector, _SEARCH_QUERY)
+
+# Best matches first, newest first among equals.
+SEARCH_RIDES = (
+    select(Ride, _SEARCH_SCORE.label("score"))
+    .where(Ride.user_id == bindparam("user_id"), _SEARCH_MATCH)
+    .order_by(_SEARCH_SCORE.desc(), Ride.date.desc(), Ride.id)
+    .limit(bindparam("limit", type_=Integer))
+    .offset(bindparam("offset", type_=Integer))
+)
+
+COUNT_SEARCH_RIDES = select(func.count()).select_from(Ride).where(Ride.user_id == bindparam("user_id"), _SEARCH_MATCH)
+
+RIDES_BY_VERSION = select(Ride).where(Ride.user_id == bindparam("user_id")).order_by(Ride.version, Ride.date)
+
+RIDES_CHANGED_SINCE = (
+    select(Ride)
+    .where(Ride.user_id == bindparam("user_id"), Ride.version > bindparam("since"))
+    .order_by(Ride.version, Ride.date)
+)
+
+DELETIONS_SINCE = (
+    select(RideDeletion.ride_id)
+    .where(RideDeletion.user_id == bindparam("user_id"), RideDeletion.version > bindparam("since"))
+    .order_by(RideDeletion.version)
+)
+
+RIDE_PRICING_COLUMNS = select(
+    Ride.date,
+    Ride.start_time,
+    Ride.end_time,
+    Ride.wwv_km,
+    Ride.extra_costs,
+    Ride.gross_total,
+    Ride.net_pay,
+).where(Ride.user_id == bindparam("user_id"))
+
+DEFAULT_STATS = (
+    select(User.data_version, UserStats.data_version, UserStats.payload)
+    .outerjoin(UserStats, UserStats.user_id == User.id)
+    .where(User.id == bindparam("user_id"))
+)
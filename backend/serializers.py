@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from models import Ride, Settings, User
+
+
+def user_to_dict(user: User) -> dict:
+    return {"id": user.id, "email": user.email, "name": user.name}
+
+
+def settings_to_dict(settings: Settings) -> dict:
+    return {
+        "base_rate": settings.base_rate,
+        "overtime_multiplier": settings.overtime_multiplier,
+        "night_surcharge": settings.night_surcharge,
+        "wwv_rate": settings.wwv_rate,
+        "social_contribution_pct": settings.social_contribution_pct,
+        "normal_hours_threshold": settings.normal_hours_threshold,
+    }
+
+
+def ride_to_dict(ride: Ride) -> dict:
+    return {
+        "id": ride.id,
+        "user_id": ride.user_id,
+        "date": ride.date,
+        "client_name": ride.client_name,
+        "car_brand": ride.car_brand,
+        "car_model": ride.car_model,
+        "start_time": ride.start_time,
+        "end_time": ride.end_time,
+        "extra_costs": ride.extra_costs,
+        "wwv_km": ride.wwv_km,
+        "wwv_amount": ride.wwv_amount,
+        "notes": ride.notes,
+        "total_hours": ride.total_hours,
+        "normal_hours": ride.normal_hours,
+        "overtime_hours": ride.overtime_hours,
+        "night_hours": ride.night_hours,
+        "normal_pay": ride.normal_pay,
+        "overtime_pay": ride.overtime_pay,
+        "night_pay": ride.night_pay,
+        "gross_pay": ride.gross_pay,
+        "gross_total": ride.gross_total,
+        "social_contribution": ride.social_contribution,
+        "net_pay": ride.net_pay,
+        "created_at": ride.created_at.isoformat() if ride.created_at else None,
+    }
+
+
+# The keys of ride_to_dict, which are also the names of the Ride columns.
+RIDE_FIELDS = (
+    "id",
+    "user_id",
+    "date",
+    "client_name",
+    "car_brand",
+    "car_model",
+    "start_time",
+    "end_time",
+    "extra_costs",
+    "wwv_km",
+    "wwv_amount",
+    "notes",
+    "total_hours",
+    "normal_hours",
+    "overtime_hours",
+    "night_hours",
+    "normal_pay",
+    "overtime_pay",
+    "night_pay",
+    "gross_pay",
+    "gross_total",
+    "social_contribution",
+    "net_pay",
+    "created_at",
+)
+
+
+def parse_ride_fields(raw: Optional[str]) -> Tuple[str, ...]:
+    """Parse the comma separated ``fields=`` parameter; empty means every field, in RIDE_FIELDS order."""
+    if not raw:
+        return RIDE_FIELDS
+    wanted = {part.strip() for part in raw.split(",") if part.strip()}
+    unknown = wanted.difference(RIDE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(name for name in RIDE_FIELDS if name in wanted) or RIDE_FIELDS
+
+
+def _ride_column(rows: Sequence, name: str) -> list:
+    if name == "created_at":
+        return [row.created_at.isoformat() if row.created_at else None for row in rows]
+    return [getattr(row, name) for row in rows]
+
+
+def rides_to_columns(rows: Sequence, fields: Sequence[str]) -> Dict[str, list]:
+    """Rides (or rows holding ``fields``) as one list per field instead of one dict per ride."""
+    return {name: _ride_column(rows, name) for name in fields}
+
+
+def rides_to_dicts(rows: Sequence, fields: Sequence[str]) -> List[dict]:
+    """Like ``ride_to_dict`` for every ride, restricted to ``fields``."""
+    if len(fields) == len(RIDE_FIELDS):
+        return [ride_to_dict(row) for row in rows]
+    columns = rides_to_columns(rows, fields)
+    return [dict(zip(fields, values)) for values in zip(*columns.values())]
@@ -1,23 +1,76 @@
 from __future__ import annotations
 
+import hashlib
 import logging
 import os
 import uuid
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Optional, Tuple
 
 import bcrypt
 import jwt
+import numpy as np
 from dotenv import load_dotenv
-from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException
-from pydantic import BaseModel
-from sqlalchemy import select, func, desc
+from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from sqlalchemy.exc import DBAPIError, TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.middleware.cors import CORSMiddleware
 
-from db import engine, get_session
-from models import Base, Ride, Settings, User
+from db import (
+    SHARDED,
+    STATEMENT_TIMEOUTS,
+    engine,
+    get_session,
+    read_engine,
+    read_session_factory,
+    session_factory_for,
+    shard_engines,
+    shard_router,
+    shard_sessions,
+    overload,
+    statement_timeout,
+    write_tracker,
+)
+from export import EXPORT_FORMATS, export_rides
+from leaderboard import (
+    ALL_TIME,
+    MAX_OFFSET as LEADERBOARD_MAX_OFFSET,
+    METRICS as LEADERBOARD_METRICS,
+    leaderboard_page,
+    leaderboard_position,
+    refresh_user_totals,
+    sharded_leaderboard_page,
+    sharded_leaderboard_position,
+)
+from metrics import metrics
+from middleware import CancelOnDisconnect, SelectiveGZip
+from migrations import upgrade_schema
+from notify import InvalidationBus
+from partitions import month_range
+from payrules import plan_for, price_ride
+from admission import controllers as admission_controllers
+from batch import BatchInput, BatchRoutes, run_item
+from cache import MISSING, LocalCache
+from events import EventBroker, bus_event, ride_event
+from models import LeaderboardTotal, Ride, RideDeletion, Settings, User
+from precompute import StatsPrecomputer, load_default_stats
+import queries
+from singleflight import SingleFlight
+from serializers import (
+    parse_ride_fields,
+    ride_to_dict,
+    rides_to_columns,
+    rides_to_dicts,
+    settings_to_dict,
+    user_to_dict,
+)
+from sharding import claim_email, locate_email, release_email
+from slowlog import slow_query_log
+from stats import compute_stats, parse_sections, ride_time_fields, select_sections
+from whatif import price_rides, summarise
 
 ROOT_DIR = Path(__file__).resolve().parents[1]
 load_dotenv(ROOT_DIR / ".env")
@@ -25,10 +78,39 @@ load_dotenv(Path(__file__).resolve().parent / ".env", override=False)
 
 JWT_SECRET = os.environ.get("JWT_SECRET", "get-driven-secret-key-2024")
 JWT_ALGORITHM = "HS256"
+# Stream tickets go in a query string, which access logs record, so they are
+# signed with their own key (never valid as a bearer token) and expire soon.
+STREAM_TICKET_SECRET = f"{JWT_SECRET}:stream"
+STREAM_TICKET_TTL = int(os.environ.get("STREAM_TICKET_TTL", "60"))
+# Comma separated emails of the users allowed to read /api/metrics and to
+# export every user's rides.
+ADMIN_EMAILS = frozenset(
+    email.strip().lower() for email in os.environ.get("ADMIN_EMAILS", "").split(",") if email.strip()
+)
 
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
+local_cache = LocalCache(ttl=float(os.environ.get("LOCAL_CACHE_TTL", "300")))
+invalidation_bus = InvalidationBus()
+invalidation_bus.subscribe(local_cache.evict_user)
+invalidation_bus.subscribe(write_tracker.mark)
+invalidation_bus.subscribe(shard_router.on_invalidation)
+invalidation_bus.subscribe_events(shard_router.on_event)
+event_broker = EventBroker()
+invalidation_bus.subscribe_events(event_broker.deliver)
+# Concurrent identical requests (double clicks, several open tabs) share one
+# aggregation instead of running it side by side.
+stats_flights = SingleFlight("stats")
+leaderboard_flights = SingleFlight("leaderboard")
+
+stats_precomputer = StatsPrecomputer(
+    session_factory_for,
+    statement_timeout_ms=STATEMENT_TIMEOUTS["stats"],
+    debounce=float(os.environ.get("STATS_PRECOMPUTE_DEBOUNCE", "0.5")),
+    max_delay=float(os.environ.get("STATS_PRECOMPUTE_MAX_DELAY", "5")),
+)
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
@@ -105,106 +187,230 @@ async def get_current_user(authorization: Optional[str] = Header(None)):
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
-def user_to_dict(user: User) -> dict:
-    return {"id": user.id, "email": user.email, "name": user.name}
+async def get_optional_user(authorization: Optional[str] = Header(None)) -> Optional[dict]:
+    if not authorization:
+        return None
+    try:
+        return await get_current_user(authorization)
+    except HTTPException:
+        return None
 
 
-def settings_to_dict(settings: Settings) -> dict:
-    return {
-        "base_rate": settings.base_rate,
-        "overtime_multiplier": settings.overtime_multiplier,
-        "night_surcharge": settings.night_surcharge,
-        "wwv_rate": settings.wwv_rate,
-        "social_contribution_pct": settings.social_contribution_pct,
-        "normal_hours_threshold": settings.normal_hours_threshold,
-    }
+def create_stream_ticket(user_id: str) -> str:
+    payload = {"user_id": user_id, "exp": datetime.now(timezone.utc).timestamp() + STREAM_TICKET_TTL}
+    return jwt.encode(payload, STREAM_TICKET_SECRET, algorithm=JWT_ALGORITHM)
 
 
-def ride_to_dict(ride: Ride) -> dict:
-    return {
-        "id": ride.id,
-        "user_id": ride.user_id,
-        "date": ride.date,
-        "client_name": ride.client_name,
-        "car_brand": ride.car_brand,
-        "car_model": ride.car_model,
-        "start_time": ride.start_time,
-        "end_time": ride.end_time,
-        "extra_costs": ride.extra_costs,
-        "wwv_km": ride.wwv_km,
-        "wwv_amount": ride.wwv_amount,
-        "notes": ride.notes,
-        "total_hours": ride.total_hours,
-        "normal_hours": ride.normal_hours,
-        "overtime_hours": ride.overtime_hours,
-        "night_hours": ride.night_hours,
-        "normal_pay": ride.normal_pay,
-        "overtime_pay": ride.overtime_pay,
-        "night_pay": ride.night_pay,
-        "gross_pay": ride.gross_pay,
-        "gross_total": ride.gross_total,
-        "social_contribution": ride.social_contribution,
-        "net_pay": ride.net_pay,
-        "created_at": ride.created_at.isoformat() if ride.created_at else None,
-    }
-
+async def get_stream_user(authorization: Optional[str] = Header(None), ticket: Optional[str] = None):
+    """Like ``get_current_user``, also accepting a ``?ticket=`` since EventSource cannot send headers."""
+    if authorization or not ticket:
+        return await get_current_user(authorization)
+    try:
+        return jwt.decode(ticket, STREAM_TICKET_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Ticket expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid ticket")
 
-def calculate_salary(start_time_str: str, end_time_str: str, date_str: str, settings: dict):
-    """Calculate salary for a ride based on Belgian rules."""
-    from datetime import datetime as dt, timedelta
 
-    start_dt = dt.fromisoformat(f"{date_str}T{start_time_str}")
-    end_dt = dt.fromisoformat(f"{date_str}T{end_time_str}")
+def is_admin(user: dict) -> bool:
+    return user.get("email", "").lower() in ADMIN_EMAILS
 
-    if end_dt <= start_dt:
-        end_dt += timedelta(days=1)
 
-    total_minutes = (end_dt - start_dt).total_seconds() / 60
-    total_hours = total_minutes / 60
+async def get_admin_user(current_user: dict = Depends(get_current_user)):
+    if not is_admin(current_user):
+        raise HTTPException(status_code=403, detail="Geen toegang")
+    return current_user
 
-    base_rate = settings.get("base_rate", 12.83)
-    overtime_multiplier = settings.get("overtime_multiplier", 1.5)
-    night_surcharge = settings.get("night_surcharge", 1.46)
-    threshold = settings.get("normal_hours_threshold", 9.0)
 
-    normal_hours = min(total_hours, threshold)
-    overtime_hours = max(0, total_hours - threshold)
+# Session dependencies for authenticated routes depend on the token check
+# themselves, so a rejected request is answered before a session exists and
+# never reaches the pool. A session only checks out a connection on its first
+# statement, so 304s served from the local cache do not touch the pool either.
+async def get_user_session(current_user: dict = Depends(get_current_user)):
+    """Primary session of the caller's shard.
 
-    normal_pay = normal_hours * base_rate
-    overtime_pay = overtime_hours * base_rate * overtime_multiplier
+    Sharded, the session first locks the caller's user row, so a move to
+    another shard cannot start during the write. A write that had to wait for
+    a move finds the row gone and is opened again on the user's new shard.
+    """
+    user_id = current_user["user_id"]
+    async with (await session_factory_for(user_id))() as session:
+        if not SHARDED or (await session.execute(queries.LOCK_USER, {"user_id": user_id})).first():
+            yield session
+            return
+    shard_router.forget(user_id)
+    async with (await session_factory_for(user_id))() as session:
+        await session.execute(queries.LOCK_USER, {"user_id": user_id})
+        yield session
+
+
+async def get_read_session(current_user: dict = Depends(get_current_user)):
+    """Session for read-only endpoints: the replica, unless the caller wrote recently."""
+    async with (await read_session_factory(current_user["user_id"]))() as session:
+        yield session
+
+
+def _admission_key(request: Request, current_user: Optional[dict]) -> str:
+    if current_user:
+        return current_user["user_id"]
+    return request.client.host if request.client else "anonymous"
+
+
+def admit(route: str):
+    """Dependency enforcing the admission limits of ``route`` before any DB work."""
+    controller = admission_controllers[route]
+
+    async def dependency(request: Request, current_user: Optional[dict] = Depends(get_optional_user)):
+        async with controller.admit(_admission_key(request, current_user)):
+            yield
+
+    return dependency
+
+
+def rate_limit(route: str):
+    """Dependency enforcing only the per-client rate of ``route``.
+
+    For coalesced routes: their computation takes the in-flight slot itself,
+    so requests that join a running one, or are answered from a cache, never
+    count against the route's concurrency cap.
+    """
+    controller = admission_controllers[route]
+
+    async def dependency(request: Request, current_user: Optional[dict] = Depends(get_optional_user)):
+        controller.check_rate(_admission_key(request, current_user))
+
+    return dependency
+
+
+def limit_statements(route: str):
+    """Dependency running the request's queries under the statement timeout of ``route``."""
+    timeout = STATEMENT_TIMEOUTS[route]
+
+    async def dependency():
+        # Each request runs in its own context, so this never leaks into another.
+        statement_timeout.set(timeout)
+
+    return dependency
+
+
+async def get_data_version(session: AsyncSession, user_id: str) -> int:
+    version = local_cache.get(user_id, "data_version")
+    if version is not MISSING:
+        return version
+    generation = local_cache.generation(user_id)
+    version = (await session.execute(queries.DATA_VERSION, {"user_id": user_id})).scalar_one_or_none()
+    version = version or 0
+    local_cache.set(user_id, "data_version", version, generation)
+    return version
+
+
+async def bump_data_version(session: AsyncSession, user_id: str) -> int:
+    """Increment the user's data version inside the current write transaction."""
+    result = await session.execute(queries.BUMP_DATA_VERSION, {"user_id": user_id})
+    return result.scalar_one_or_none() or 0
+
+
+async def record_write(
+    session: AsyncSession,
+    user_id: str,
+    months: Iterable[str] = (),
+    ride: Optional[Ride] = None,
+    action: str = "updated",
+) -> Tuple[int, Optional[dict]]:
+    """Mark the user's data as changed; call inside the write transaction.
+
+    ``months`` lists the ``YYYY-MM`` months whose rides changed, so the
+    leaderboard aggregates for them are refreshed as well. For ride writes,
+    pass the ride and ``action`` (created, updated or deleted): the ride gets
+    the new version and the live event for /api/stream is published with the
+    invalidation. Returns the version and that event, for ``after_write``.
+    """
+    version = await bump_data_version(session, user_id)
+    totals = await refresh_user_totals(session, user_id, months) if months else None
+    event = None
+    if ride is not None:
+        if action == "deleted":
+            payload = {"id": ride.id, "date": ride.date}
+        else:
+            ride.version = version
+            payload = ride_to_dict(ride)
+        event = ride_event(action, payload, version, totals)
+    await invalidation_bus.publish(session, user_id, bus_event(event))
+    return version, event
 
-    night_minutes = 0
-    current = start_dt
-    while current < end_dt:
-        hour = current.hour
-        if hour >= 20 or hour < 6:
-            night_minutes += 1
-        current += timedelta(minutes=1)
 
-    night_hours = night_minutes / 60
-    night_pay = night_hours * night_surcharge
+def after_write(user_id: str, event: Optional[dict] = None) -> None:
+    """Evict this process' caches, queue stats precomputation and push live events after commit."""
+    invalidation_bus.notify_local(user_id)
+    stats_precomputer.schedule(user_id)
+    event_broker.deliver(user_id, event)
+
+
+async def cached_default_stats(session: AsyncSession, user_id: str):
+    entry = local_cache.get(user_id, "default_stats")
+    if entry is not MISSING:
+        return entry
+    generation = local_cache.generation(user_id)
+    version, stored = await load_default_stats(session, user_id)
+    local_cache.set(user_id, "data_version", version, generation)
+    # Only a current document is worth keeping; a miss must be retried so the
+    # precomputed copy is picked up as soon as the worker has stored it.
+    if stored is not None:
+        local_cache.set(user_id, "default_stats", (version, stored), generation)
+    return version, stored
+
+
+def make_etag(user_id: str, version: int, *parts) -> str:
+    digest = hashlib.sha1(repr((user_id, parts)).encode("utf-8")).hexdigest()[:16]
+    return f'W/"{version}-{digest}"'
+
+
+def not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """Set caching headers and return a 304 response when the client copy is current."""
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    response.headers.update(headers)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (
+        if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+    ):
+        return Response(status_code=304, headers=headers)
+    return None
 
-    gross_pay = normal_pay + overtime_pay + night_pay
 
-    return {
-        "total_hours": round(total_hours, 2),
-        "normal_hours": round(normal_hours, 2),
-        "overtime_hours": round(overtime_hours, 2),
-        "night_hours": round(night_hours, 2),
-        "normal_pay": round(normal_pay, 2),
-        "overtime_pay": round(overtime_pay, 2),
-        "night_pay": round(night_pay, 2),
-        "gross_pay": round(gross_pay, 2),
-    }
+def calculate_salary(start_time_str: str, end_time_str: str, date_str: str, settings: dict):
+    """Calculate salary for a ride based on Belgian rules (see payrules.RULES)."""
+    return price_ride(plan_for(settings), date_str, start_time_str, end_time_str)
 
 
 @api_router.post("/auth/register")
 async def register(input: RegisterInput, session: AsyncSession = Depends(get_session)):
-    existing = (await session.execute(select(User).where(User.email == input.email))).scalar_one_or_none()
-    if existing:
-        raise HTTPException(status_code=400, detail="Email al in gebruik")
-
     user_id = str(uuid.uuid4())
+    if not SHARDED:
+        existing = (await session.execute(queries.USER_BY_EMAIL, {"email": input.email})).scalar_one_or_none()
+        if existing:
+            raise HTTPException(status_code=400, detail="Email al in gebruik")
+        user = await create_user(session, user_id, input)
+    else:
+        # The directory on shard 0 keeps emails unique across the shards.
+        shard = shard_router.home(user_id)
+        if not await claim_email(session, input.email, user_id, shard):
+            raise HTTPException(status_code=400, detail="Email al in gebruik")
+        try:
+            async with shard_sessions[shard]() as shard_session:
+                user = await create_user(shard_session, user_id, input)
+        except Exception:
+            await release_email(session, input.email)
+            raise
+        shard_router.remember(user_id, shard)
+
+    # The client loads /auth/me right away; keep that read off a lagging replica.
+    write_tracker.mark(user_id)
+    token = create_token(user_id, input.email)
+    return {"token": token, "user": user_to_dict(user)}
+
+
+async def create_user(session: AsyncSession, user_id: str, input: RegisterInput) -> User:
     user = User(
         id=user_id,
         email=input.email,
@@ -218,15 +424,23 @@ async def register(input: RegisterInput, session: AsyncSession = Depends(get_ses
     session.add(user)
     await session.flush()
     session.add(settings)
+    session.add(LeaderboardTotal(user_id=user_id, period_key=ALL_TIME, hours=0.0, net=0.0, gross=0.0, rides=0))
     await session.commit()
-
-    token = create_token(user_id, input.email)
-    return {"token": token, "user": user_to_dict(user)}
+    return user
 
 
 @api_router.post("/auth/login")
 async def login(input: LoginInput, session: AsyncSession = Depends(get_session)):
-    user = (await session.execute(select(User).where(User.email == input.email))).scalar_one_or_none()
+    if not SHARDED:
+        user = (await session.execute(queries.USER_BY_EMAIL, {"email": input.email})).scalar_one_or_none()
+    else:
+        located = await locate_email(session, input.email)
+        user = None
+        if located:
+            async with shard_sessions[located[1]]() as shard_session:
+                user = (
+                    await shard_session.execute(queries.USER_BY_EMAIL, {"email": input.email})
+                ).scalar_one_or_none()
     if not user or not verify_password(input.password, user.password_hash):
         raise HTTPException(status_code=401, detail="Ongeldige inloggegevens")
 
@@ -237,9 +451,14 @@ async def login(input: LoginInput, session: AsyncSession = Depends(get_session))
 @api_router.get("/auth/me")
 async def get_me(
     current_user: dict = Depends(get_current_user),
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
 ):
-    user = await session.get(User, current_user["user_id"])
+    user_id = current_user["user_id"]
+    user = await session.get(User, user_id)
+    if not user and read_engine is not engine:
+        # Registered on another worker moments ago and not on the replica yet.
+        async with (await session_factory_for(user_id))() as primary:
+            user = await primary.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Gebruiker niet gevonden")
     return user_to_dict(user)
@@ -249,7 +468,7 @@ async def get_me(
 async def create_ride(
     ride: RideInput,
     current_user: dict = Depends(get_current_user),
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_user_session),
 ):
     user_id = current_user["user_id"]
 
@@ -284,26 +503,140 @@ async def create_ride(
         social_contribution=social_contribution,
         net_pay=net_pay,
         created_at=datetime.now(timezone.utc),
+        updated_at=datetime.now(timezone.utc),
+        **ride_time_fields(ride.date, ride.start_time, ride.end_time),
     )
 
     session.add(ride_doc)
+    await session.flush()
+    _, event = await record_write(session, user_id, [ride.date[:7]], ride_doc, "created")
     await session.commit()
+    after_write(user_id, event)
 
     return ride_to_dict(ride_doc)
 
 
 @api_router.get("/rides")
 async def get_rides(
+    request: Request,
+    response: Response,
     current_user: dict = Depends(get_current_user),
     month: Optional[str] = None,
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
+    fields: Optional[str] = None,
+    fmt: str = Query("rows", alias="format", pattern="^(rows|columns)$"),
 ):
-    query = select(Ride).where(Ride.user_id == current_user["user_id"])
+    """The user's rides, newest first.
+
+    ``fields`` is a comma separated subset of the ride fields to return;
+    ``format=columns`` returns one list per field instead of one object per ride.
+    """
+    user_id = current_user["user_id"]
+    try:
+        wanted = parse_ride_fields(fields)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    version = await get_data_version(session, user_id)
+    cached = not_modified(request, response, make_etag(user_id, version, "rides", month, wanted, fmt))
+    if cached:
+        return cached
+
     if month:
-        query = query.where(Ride.date.like(f"{month}%"))
-    query = query.order_by(Ride.date.desc())
-    rides = (await session.execute(query)).scalars().all()
-    return [ride_to_dict(r) for r in rides]
+        month_start, month_end = month_range(month)
+        result = await session.execute(
+            queries.user_ride_columns(wanted, True),
+            {"user_id": user_id, "month_start": month_start, "month_end": month_end},
+        )
+    else:
+        result = await session.execute(queries.user_ride_columns(wanted, False), {"user_id": user_id})
+    rows = result.all()
+    if fmt == "columns":
+        return rides_to_columns(rows, wanted)
+    return rides_to_dicts(rows, wanted)
+
+
+@api_router.get("/rides/changes")
+async def get_ride_changes(
+    current_user: dict = Depends(get_current_user),
+    since: int = Query(0, ge=0),
+    session: AsyncSession = Depends(get_read_session),
+):
+    """Rides written and ids deleted after change version ``since``.
+
+    Clients keep the returned ``version`` and pass it as ``since`` next time;
+    ``since=0`` returns the full list.
+    """
+    user_id = current_user["user_id"]
+    # Read the version first: anything committed afterwards is either in this
+    # response or will be picked up by the next sync, never skipped.
+    version = (await session.execute(queries.DATA_VERSION, {"user_id": user_id})).scalar_one_or_none() or 0
+
+    deleted = []
+    if since:
+        params = {"user_id": user_id, "since": since}
+        rides = (await session.execute(queries.RIDES_CHANGED_SINCE, params)).scalars().all()
+        deleted = (await session.execute(queries.DELETIONS_SINCE, params)).scalars().all()
+    else:
+        rides = (await session.execute(queries.RIDES_BY_VERSION, {"user_id": user_id})).scalars().all()
+
+    return {"version": version, "rides": [ride_to_dict(r) for r in rides], "deleted": list(deleted)}
+
+
+@api_router.get("/rides/search", dependencies=[Depends(limit_statements("search"))])
+async def search_rides(
+    request: Request,
+    response: Response,
+    current_user: dict = Depends(get_current_user),
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    session: AsyncSession = Depends(get_read_session),
+):
+    """Full-text search over the notes, client and car of the user's rides, best match first.
+
+    ``q`` takes web search syntax: words, "quoted phrases", ``or`` and ``-word``.
+    """
+    user_id = current_user["user_id"]
+    version = await get_data_version(session, user_id)
+    cached = not_modified(request, response, make_etag(user_id, version, "search", q, limit, offset))
+    if cached:
+        return cached
+
+    params = {"user_id": user_id, "q": q}
+    rows = (await session.execute(queries.SEARCH_RIDES, {**params, "limit": limit, "offset": offset})).all()
+    total = (await session.execute(queries.COUNT_SEARCH_RIDES, params)).scalar_one()
+    return {
+        "q": q,
+        "limit": limit,
+        "offset": offset,
+        "total": total,
+        "rides": [{**ride_to_dict(ride), "score": round(float(score), 4)} for ride, score in rows],
+    }
+
+
+@api_router.get("/rides/export")
+async def export_ride_history(
+    current_user: dict = Depends(get_current_user),
+    fmt: str = Query("parquet", alias="format", pattern="^(arrow|parquet)$"),
+    all_users: bool = Query(False, alias="all"),
+):
+    """The user's rides as an Arrow IPC stream or a Parquet file; ``all=true`` exports every user (admins only)."""
+    if all_users:
+        if not is_admin(current_user):
+            raise HTTPException(status_code=403, detail="Geen toegang")
+        user_id = None
+        session_factories = shard_sessions if SHARDED else [await read_session_factory(None)]
+    else:
+        user_id = current_user["user_id"]
+        session_factories = [await read_session_factory(user_id)]
+
+    metrics.incr(f"export.{fmt}")
+    media_type, extension = EXPORT_FORMATS[fmt]
+    return StreamingResponse(
+        export_rides(session_factories, user_id, fmt),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="rides.{extension}"'},
+    )
 
 
 @api_router.put("/rides/{ride_id}")
@@ -311,12 +644,12 @@ async def update_ride(
     ride_id: str,
     ride: RideInput,
     current_user: dict = Depends(get_current_user),
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_user_session),
 ):
     user_id = current_user["user_id"]
 
     ride_row = (
-        await session.execute(select(Ride).where(Ride.id == ride_id, Ride.user_id == user_id))
+        await session.execute(queries.USER_RIDE, {"ride_id": ride_id, "user_id": user_id})
     ).scalar_one_or_none()
     if not ride_row:
         raise HTTPException(status_code=404, detail="Rit niet gevonden")
@@ -332,6 +665,7 @@ async def update_ride(
     gross_total = round(wage_pay + wwv_amount + ride.extra_costs + social_contribution, 2)
     net_pay = round(gross_total - social_contribution, 2)
 
+    old_month = ride_row.date[:7]
     ride_row.date = ride.date
     ride_row.client_name = ride.client_name
     ride_row.car_brand = ride.car_brand
@@ -353,8 +687,14 @@ async def update_ride(
     ride_row.gross_total = gross_total
     ride_row.social_contribution = social_contribution
     ride_row.net_pay = net_pay
+    for key, value in ride_time_fields(ride.date, ride.start_time, ride.end_time).items():
+        setattr(ride_row, key, value)
+    ride_row.updated_at = datetime.now(timezone.utc)
 
+    await session.flush()
+    _, event = await record_write(session, user_id, [old_month, ride.date[:7]], ride_row, "updated")
     await session.commit()
+    after_write(user_id, event)
 
     return ride_to_dict(ride_row)
 
@@ -363,26 +703,43 @@ async def update_ride(
 async def delete_ride(
     ride_id: str,
     current_user: dict = Depends(get_current_user),
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_user_session),
 ):
     ride_row = (
-        await session.execute(
-            select(Ride).where(Ride.id == ride_id, Ride.user_id == current_user["user_id"])
-        )
+        await session.execute(queries.USER_RIDE, {"ride_id": ride_id, "user_id": current_user["user_id"]})
     ).scalar_one_or_none()
     if not ride_row:
         raise HTTPException(status_code=404, detail="Rit niet gevonden")
 
     await session.delete(ride_row)
+    await session.flush()
+    version, event = await record_write(session, current_user["user_id"], [ride_row.date[:7]], ride_row, "deleted")
+    session.add(
+        RideDeletion(
+            ride_id=ride_row.id,
+            user_id=current_user["user_id"],
+            version=version,
+            deleted_at=datetime.now(timezone.utc),
+        )
+    )
     await session.commit()
+    after_write(current_user["user_id"], event)
     return {"message": "Rit verwijderd"}
 
 
 @api_router.get("/settings")
 async def get_settings(
+    request: Request,
+    response: Response,
     current_user: dict = Depends(get_current_user),
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
 ):
+    user_id = current_user["user_id"]
+    version = await get_data_version(session, user_id)
+    cached = not_modified(request, response, make_etag(user_id, version, "settings"))
+    if cached:
+        return cached
+
     settings_row = await session.get(Settings, current_user["user_id"])
     if not settings_row:
         return DEFAULT_SETTINGS
@@ -393,7 +750,7 @@ async def get_settings(
 async def update_settings(
     input: SettingsInput,
     current_user: dict = Depends(get_current_user),
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_user_session),
 ):
     update_data = {k: v for k, v in input.model_dump().items() if v is not None}
     if not update_data:
@@ -408,253 +765,102 @@ async def update_settings(
         for key, value in update_data.items():
             setattr(settings_row, key, value)
 
+    await record_write(session, current_user["user_id"])
     await session.commit()
+    after_write(current_user["user_id"])
     return settings_to_dict(settings_row)
 
 
-@api_router.get("/stats")
+@api_router.get("/stats", dependencies=[Depends(rate_limit("stats")), Depends(limit_statements("stats"))])
 async def get_stats(
+    request: Request,
+    response: Response,
     current_user: dict = Depends(get_current_user),
     month: Optional[str] = None,
     client_name: Optional[str] = None,
     car_brand: Optional[str] = None,
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
-    session: AsyncSession = Depends(get_session),
+    sections: Optional[str] = None,
+    session: AsyncSession = Depends(get_read_session),
 ):
     user_id = current_user["user_id"]
+    try:
+        wanted = parse_sections(sections)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
 
-    query = select(Ride).where(Ride.user_id == user_id)
-    if month:
-        query = query.where(Ride.date.like(f"{month}%"))
-    if client_name:
-        query = query.where(Ride.client_name.ilike(f"%{client_name}%"))
-    if car_brand:
-        query = query.where(Ride.car_brand.ilike(f"%{car_brand}%"))
-    if date_from and date_to:
-        query = query.where(Ride.date >= date_from, Ride.date <= date_to)
-    elif date_from:
-        query = query.where(Ride.date >= date_from)
-    elif date_to:
-        query = query.where(Ride.date <= date_to)
-
-    rides = (await session.execute(query)).scalars().all()
-    all_rides = (
-        await session.execute(select(Ride).where(Ride.user_id == user_id))
-    ).scalars().all()
-
-    rides_list = [ride_to_dict(r) for r in rides]
-    all_rides_list = [ride_to_dict(r) for r in all_rides]
-
-    def get_gross_total(r):
-        if r.get("gross_total") is not None:
-            return r["gross_total"]
-        wage = r.get("gross_pay", 0)
-        wwv = r.get("wwv_amount", 0)
-        extra = r.get("extra_costs", 0)
-        social = r.get("social_contribution", 0)
-        return wage + wwv + extra + social
-
-    empty_response = {
-        "total_rides": 0,
-        "total_hours": 0,
-        "total_gross": 0,
-        "total_net": 0,
-        "total_wwv": 0,
-        "total_overtime_hours": 0,
-        "total_night_hours": 0,
-        "total_social": 0,
-        "total_extra_costs": 0,
-        "avg_per_ride": 0,
-        "avg_per_hour": 0,
-        "monthly_earnings": [],
-        "weekly_earnings": [],
-        "car_stats": [],
-        "client_stats": [],
-        "brand_stats": [],
-        "hourly_distribution": [],
-        "day_of_week_stats": [],
-        "recent_rides": [],
-        "available_months": [],
-        "available_clients": [],
-        "available_brands": [],
-    }
-
-    if not rides_list:
-        if all_rides_list:
-            empty_response["available_months"] = sorted(
-                {r["date"][:7] for r in all_rides_list}, reverse=True
+    filtered = any((month, client_name, car_brand, date_from, date_to))
+    if filtered:
+        version, stored = await get_data_version(session, user_id), None
+    else:
+        version, stored = await cached_default_stats(session, user_id)
+    etag = make_etag(
+        user_id, version, "stats", month, client_name, car_brand, date_from, date_to, sorted(wanted)
+    )
+    cached = not_modified(request, response, etag)
+    if cached:
+        return cached
+
+    if stored is not None:
+        return select_sections(stored, wanted)
+    if not filtered:
+        stats_precomputer.schedule(user_id)
+
+    async def compute():
+        async with admission_controllers["stats"].slot(), (await read_session_factory(user_id))() as flight_session:
+            return await compute_stats(
+                flight_session, user_id, month, client_name, car_brand, date_from, date_to, wanted
             )
-            empty_response["available_clients"] = sorted({r["client_name"] for r in all_rides_list})
-            empty_response["available_brands"] = sorted({r["car_brand"] for r in all_rides_list})
-        return empty_response
-
-    total_rides = len(rides_list)
-    total_hours = sum(r.get("total_hours", 0) for r in rides_list)
-    total_gross = sum(get_gross_total(r) for r in rides_list)
-    total_net = sum(r.get("net_pay", 0) for r in rides_list)
-    total_wwv = sum(r.get("wwv_amount", 0) for r in rides_list)
-    total_overtime = sum(r.get("overtime_hours", 0) for r in rides_list)
-    total_night = sum(r.get("night_hours", 0) for r in rides_list)
-    total_social = sum(r.get("social_contribution", 0) for r in rides_list)
-    total_extra = sum(r.get("extra_costs", 0) for r in rides_list)
-    avg_per_ride = total_net / total_rides if total_rides > 0 else 0
-    avg_per_hour = total_net / total_hours if total_hours > 0 else 0
-
-    monthly = {}
-    for r in rides_list:
-        mk = r["date"][:7]
-        if mk not in monthly:
-            monthly[mk] = {
-                "month": mk,
-                "gross": 0,
-                "net": 0,
-                "rides": 0,
-                "hours": 0,
-                "overtime": 0,
-                "night": 0,
-            }
-        monthly[mk]["gross"] += get_gross_total(r)
-        monthly[mk]["net"] += r.get("net_pay", 0)
-        monthly[mk]["rides"] += 1
-        monthly[mk]["hours"] += r.get("total_hours", 0)
-        monthly[mk]["overtime"] += r.get("overtime_hours", 0)
-        monthly[mk]["night"] += r.get("night_hours", 0)
-    monthly_earnings = sorted(monthly.values(), key=lambda x: x["month"])
-    for m in monthly_earnings:
-        for k in ["gross", "net", "hours", "overtime", "night"]:
-            m[k] = round(m[k], 2)
-
-    from datetime import datetime as dt
-
-    weekly = {}
-    for r in rides_list:
-        d = dt.fromisoformat(r["date"])
-        wk = d.strftime("%Y-W%W")
-        if wk not in weekly:
-            weekly[wk] = {"week": wk, "net": 0, "rides": 0, "hours": 0}
-        weekly[wk]["net"] += r.get("net_pay", 0)
-        weekly[wk]["rides"] += 1
-        weekly[wk]["hours"] += r.get("total_hours", 0)
-    weekly_earnings = sorted(weekly.values(), key=lambda x: x["week"])[-12:]
-    for w in weekly_earnings:
-        w["net"] = round(w["net"], 2)
-        w["hours"] = round(w["hours"], 2)
-
-    cars = {}
-    for r in rides_list:
-        car_key = f"{r['car_brand']} {r['car_model']}"
-        if car_key not in cars:
-            cars[car_key] = {
-                "car": car_key,
-                "brand": r["car_brand"],
-                "rides": 0,
-                "hours": 0,
-                "earnings": 0,
-            }
-        cars[car_key]["rides"] += 1
-        cars[car_key]["hours"] += r.get("total_hours", 0)
-        cars[car_key]["earnings"] += r.get("net_pay", 0)
-    car_stats = sorted(cars.values(), key=lambda x: x["rides"], reverse=True)
-    for c in car_stats:
-        c["hours"] = round(c["hours"], 2)
-        c["earnings"] = round(c["earnings"], 2)
-
-    brands = {}
-    for r in rides_list:
-        b = r["car_brand"]
-        if b not in brands:
-            brands[b] = {"brand": b, "rides": 0, "hours": 0, "earnings": 0}
-        brands[b]["rides"] += 1
-        brands[b]["hours"] += r.get("total_hours", 0)
-        brands[b]["earnings"] += r.get("net_pay", 0)
-    brand_stats = sorted(brands.values(), key=lambda x: x["rides"], reverse=True)
-    for b in brand_stats:
-        b["hours"] = round(b["hours"], 2)
-        b["earnings"] = round(b["earnings"], 2)
-
-    clients = {}
-    for r in rides_list:
-        cl = r["client_name"]
-        if cl not in clients:
-            clients[cl] = {"client": cl, "rides": 0, "earnings": 0, "hours": 0}
-        clients[cl]["rides"] += 1
-        clients[cl]["earnings"] += r.get("net_pay", 0)
-        clients[cl]["hours"] += r.get("total_hours", 0)
-    client_stats = sorted(clients.values(), key=lambda x: x["earnings"], reverse=True)
-    for c in client_stats:
-        c["earnings"] = round(c["earnings"], 2)
-        c["hours"] = round(c["hours"], 2)
-
-    hourly = {str(h).zfill(2): 0 for h in range(24)}
-    for r in rides_list:
-        try:
-            sh = int(r["start_time"].split(":")[0])
-            eh = int(r["end_time"].split(":")[0])
-            if eh <= sh:
-                eh += 24
-            for h in range(sh, eh):
-                hourly[str(h % 24).zfill(2)] += 1
-        except (ValueError, IndexError):
-            pass
-    hourly_distribution = [{"hour": h, "count": c} for h, c in sorted(hourly.items())]
-
-    day_names = ["Ma", "Di", "Wo", "Do", "Vr", "Za", "Zo"]
-    dow = {i: {"day": day_names[i], "rides": 0, "hours": 0, "earnings": 0} for i in range(7)}
-    for r in rides_list:
-        try:
-            d = dt.fromisoformat(r["date"])
-            di = d.weekday()
-            dow[di]["rides"] += 1
-            dow[di]["hours"] += r.get("total_hours", 0)
-            dow[di]["earnings"] += r.get("net_pay", 0)
-        except (ValueError, IndexError):
-            pass
-    day_of_week_stats = [dow[i] for i in range(7)]
-    for d in day_of_week_stats:
-        d["hours"] = round(d["hours"], 2)
-        d["earnings"] = round(d["earnings"], 2)
-
-    recent_rides = sorted(rides_list, key=lambda x: x["date"], reverse=True)[:5]
-
-    available_months = sorted({r["date"][:7] for r in all_rides_list}, reverse=True)
-    available_clients = sorted({r["client_name"] for r in all_rides_list})
-    available_brands = sorted({r["car_brand"] for r in all_rides_list})
 
+    # The version is part of the key, so a request made after a write never
+    # joins a computation that started before it.
+    key = (user_id, version, month, client_name, car_brand, date_from, date_to, tuple(sorted(wanted)))
+    # The computation runs on a session of its own; return this one's
+    # connection so the request does not hold two while it waits.
+    await session.close()
+    return await stats_flights.do(key, compute)
+
+
+@api_router.post("/stats/what-if", dependencies=[Depends(admit("stats")), Depends(limit_statements("stats"))])
+async def simulate_earnings(
+    input: SettingsInput,
+    current_user: dict = Depends(get_current_user),
+    session: AsyncSession = Depends(get_read_session),
+):
+    """Re-price the user's whole ride history under hypothetical settings, without writing."""
+    user_id = current_user["user_id"]
+    settings_row = await session.get(Settings, user_id)
+    current = settings_to_dict(settings_row) if settings_row else DEFAULT_SETTINGS
+    hypothetical = {**current, **{k: v for k, v in input.model_dump().items() if v is not None}}
+
+    rows = (await session.execute(queries.RIDE_PRICING_COLUMNS, {"user_id": user_id})).all()
+    dates, starts, ends, wwv_km, extra_costs, gross_totals, net_pays = list(zip(*rows)) or [()] * 7
+
+    priced = price_rides(
+        dates,
+        starts,
+        ends,
+        np.nan_to_num(np.array(wwv_km, dtype=float)),
+        np.nan_to_num(np.array(extra_costs, dtype=float)),
+        hypothetical,
+    )
     return {
-        "total_rides": total_rides,
-        "total_hours": round(total_hours, 2),
-        "total_gross": round(total_gross, 2),
-        "total_net": round(total_net, 2),
-        "total_wwv": round(total_wwv, 2),
-        "total_overtime_hours": round(total_overtime, 2),
-        "total_night_hours": round(total_night, 2),
-        "total_social": round(total_social, 2),
-        "total_extra_costs": round(total_extra, 2),
-        "avg_per_ride": round(avg_per_ride, 2),
-        "avg_per_hour": round(avg_per_hour, 2),
-        "monthly_earnings": monthly_earnings,
-        "weekly_earnings": weekly_earnings,
-        "car_stats": car_stats,
-        "brand_stats": brand_stats,
-        "client_stats": client_stats,
-        "hourly_distribution": hourly_distribution,
-        "day_of_week_stats": day_of_week_stats,
-        "recent_rides": recent_rides,
-        "available_months": available_months,
-        "available_clients": available_clients,
-        "available_brands": available_brands,
+        "settings": hypothetical,
+        **summarise(dates, priced),
+        "actual": {
+            "total_gross": round(float(np.nansum(np.array(gross_totals, dtype=float))), 2),
+            "total_net": round(float(np.nansum(np.array(net_pays, dtype=float))), 2),
+        },
     }
 
 
-@api_router.get("/leaderboard")
-async def get_leaderboard(
-    metric: str = "net",
-    period: str = "all",
-    month: Optional[str] = None,
-    date_from: Optional[str] = None,
-    date_to: Optional[str] = None,
-    session: AsyncSession = Depends(get_session),
+def resolve_leaderboard_period(
+    metric: str,
+    period: str,
+    month: Optional[str],
+    date_from: Optional[str],
+    date_to: Optional[str],
 ):
     from datetime import datetime as dt, timedelta
 
@@ -672,57 +878,44 @@ async def get_leaderboard(
         raise HTTPException(status_code=400, detail="Month is required")
     if period == "custom" and (not date_from or not date_to):
         raise HTTPException(status_code=400, detail="date_from and date_to are required")
-
-    metric_map = {
-        "hours": func.coalesce(func.sum(Ride.total_hours), 0).label("metric"),
-        "net": func.coalesce(func.sum(Ride.net_pay), 0).label("metric"),
-        "gross": func.coalesce(func.sum(Ride.gross_total), 0).label("metric"),
-        "rides": func.count(Ride.id).label("metric"),
-    }
-    if metric not in metric_map:
+    if metric not in LEADERBOARD_METRICS:
         raise HTTPException(status_code=400, detail="Invalid metric")
 
-    total_hours = func.coalesce(func.sum(Ride.total_hours), 0).label("hours")
-    total_net = func.coalesce(func.sum(Ride.net_pay), 0).label("net")
-    total_gross = func.coalesce(func.sum(Ride.gross_total), 0).label("gross")
-    total_rides = func.count(Ride.id).label("rides")
-
-    query = (
-        select(
-            User.id,
-            User.name,
-            User.email,
-            total_hours,
-            total_net,
-            total_gross,
-            total_rides,
-            metric_map[metric],
-        )
-        .join(Ride, Ride.user_id == User.id, isouter=True)
-        .group_by(User.id, User.name, User.email)
-    )
-
-    if period == "month" and month:
-        query = query.where(Ride.date.like(f"{month}%"))
+    if period == "month":
+        period_key = month
     elif period == "custom":
-        query = query.where(Ride.date >= date_from, Ride.date <= date_to)
-
-    query = query.order_by(desc("metric"), User.name.asc())
-
-    rows = (await session.execute(query)).all()
-    leaderboard = [
-        {
-            "user_id": row.id,
-            "name": row.name,
-            "email": row.email,
-            "hours": round(float(row.hours or 0), 2),
-            "net": round(float(row.net or 0), 2),
-            "gross": round(float(row.gross or 0), 2),
-            "rides": int(row.rides or 0),
-            "metric": round(float(row.metric or 0), 2) if metric != "rides" else int(row.metric or 0),
-        }
-        for row in rows
-    ]
+        period_key = None
+    else:
+        period_key = ALL_TIME
+    return metric, period, month, period_key
+
+
+@api_router.get(
+    "/leaderboard", dependencies=[Depends(rate_limit("leaderboard")), Depends(limit_statements("leaderboard"))]
+)
+async def get_leaderboard(
+    metric: str = "net",
+    period: str = "all",
+    month: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0, le=LEADERBOARD_MAX_OFFSET),
+):
+    metric, period, month, period_key = resolve_leaderboard_period(metric, period, month, date_from, date_to)
+
+    async def compute():
+        async with admission_controllers["leaderboard"].slot():
+            if SHARDED:
+                return await sharded_leaderboard_page(
+                    shard_sessions, metric, period_key, date_from, date_to, limit, offset
+                )
+            async with (await read_session_factory(None))() as session:
+                return await leaderboard_page(session, metric, period_key, date_from, date_to, limit, offset)
+
+    # The page is the same for every caller, so it is not keyed on the user.
+    key = ("page", metric, period_key, date_from, date_to, limit, offset)
+    page = await leaderboard_flights.do(key, compute)
 
     return {
         "metric": metric,
@@ -730,17 +923,209 @@ async def get_leaderboard(
         "month": month,
         "date_from": date_from,
         "date_to": date_to,
-        "rows": leaderboard,
+        "limit": limit,
+        "offset": offset,
+        **page,
+    }
+
+
+@api_router.get(
+    "/leaderboard/me", dependencies=[Depends(rate_limit("leaderboard")), Depends(limit_statements("leaderboard"))]
+)
+async def get_leaderboard_position(
+    current_user: dict = Depends(get_current_user),
+    metric: str = "net",
+    period: str = "all",
+    month: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    neighbours: int = Query(2, ge=0, le=25),
+):
+    user_id = current_user["user_id"]
+    metric, period, month, period_key = resolve_leaderboard_period(metric, period, month, date_from, date_to)
+
+    async def compute():
+        async with admission_controllers["leaderboard"].slot():
+            if SHARDED:
+                home = await shard_router.shard_of(user_id)
+                return await sharded_leaderboard_position(
+                    shard_sessions, home, user_id, metric, period_key, date_from, date_to, neighbours
+                )
+            async with (await read_session_factory(user_id))() as session:
+                return await leaderboard_position(
+                    session, user_id, metric, period_key, date_from, date_to, neighbours
+                )
+
+    key = ("me", user_id, metric, period_key, date_from, date_to, neighbours)
+    position = await leaderboard_flights.do(key, compute)
+    return {"metric": metric, "period": period, "month": month, **position}
+
+
+class _NoParams(BaseModel):
+    pass
+
+
+class _RidesParams(BaseModel):
+    month: Optional[str] = None
+    fields: Optional[str] = None
+    format: str = Field("rows", pattern="^(rows|columns)$")
+
+
+class _RideChangesParams(BaseModel):
+    since: int = Field(0, ge=0)
+
+
+class _RideSearchParams(BaseModel):
+    q: str = Field(min_length=1, max_length=200)
+    limit: int = Field(20, ge=1, le=100)
+    offset: int = Field(0, ge=0)
+
+
+class _StatsParams(BaseModel):
+    month: Optional[str] = None
+    client_name: Optional[str] = None
+    car_brand: Optional[str] = None
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    sections: Optional[str] = None
+
+
+class _LeaderboardParams(BaseModel):
+    metric: str = "net"
+    period: str = "all"
+    month: Optional[str] = None
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    limit: int = Field(50, ge=1, le=500)
+    offset: int = Field(0, ge=0, le=LEADERBOARD_MAX_OFFSET)
+
+
+class _LeaderboardPositionParams(BaseModel):
+    metric: str = "net"
+    period: str = "all"
+    month: Optional[str] = None
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    neighbours: int = Field(2, ge=0, le=25)
+
+
+def batch_routes(current_user: dict, session: AsyncSession) -> BatchRoutes:
+    """The GET routes /api/batch may call, bound to the caller and the batch session."""
+    user_id = current_user["user_id"]
+
+    async def me(request, response, params):
+        return await get_me(current_user, session)
+
+    async def settings(request, response, params):
+        return await get_settings(request, response, current_user, session)
+
+    async def rides(request, response, params):
+        return await get_rides(request, response, current_user, params.month, session, params.fields, params.format)
+
+    async def ride_changes(request, response, params):
+        return await get_ride_changes(current_user, params.since, session)
+
+    async def ride_search(request, response, params):
+        return await search_rides(request, response, current_user, **params.model_dump(), session=session)
+
+    # As for the routes themselves, only the rate is checked here; the
+    # computations take the in-flight slots.
+    async def stats(request, response, params):
+        admission_controllers["stats"].check_rate(user_id)
+        return await get_stats(request, response, current_user, **params.model_dump(), session=session)
+
+    # The leaderboard routes compute on sessions of their own, so the batch
+    # session's connection is returned first, as get_stats does.
+    async def leaderboard(request, response, params):
+        admission_controllers["leaderboard"].check_rate(user_id)
+        await session.close()
+        return await get_leaderboard(**params.model_dump())
+
+    async def leaderboard_me(request, response, params):
+        admission_controllers["leaderboard"].check_rate(user_id)
+        await session.close()
+        return await get_leaderboard_position(current_user, **params.model_dump())
+
+    return {
+        "/auth/me": (_NoParams, me),
+        "/settings": (_NoParams, settings),
+        "/rides": (_RidesParams, rides),
+        "/rides/changes": (_RideChangesParams, ride_changes),
+        "/rides/search": (_RideSearchParams, ride_search),
+        "/stats": (_StatsParams, stats),
+        "/leaderboard": (_LeaderboardParams, leaderboard),
+        "/leaderboard/me": (_LeaderboardPositionParams, leaderboard_me),
     }
 
 
+@api_router.post("/batch", dependencies=[Depends(limit_statements("batch"))])
+async def run_batch(
+    input: BatchInput,
+    current_user: dict = Depends(get_current_user),
+    session: AsyncSession = Depends(get_read_session),
+):
+    """Run several GET routes in one round trip, one after another.
+
+    The items share one session, which holds at most one connection at a time:
+    stats and leaderboard items release it while their computation runs on a
+    session of its own. Every item gets its own status and body; a failing
+    item does not fail the batch.
+    """
+    routes = batch_routes(current_user, session)
+    responses = []
+    for item in input.requests:
+        responses.append(await run_item(routes, item, session))
+    metrics.incr("batch.requests")
+    metrics.incr("batch.items", len(input.requests))
+    return {"responses": responses}
+
+
+@api_router.post("/stream/ticket")
+async def create_stream_access(current_user: dict = Depends(get_current_user)):
+    """A short-lived ticket for ``GET /api/stream?ticket=``; fetch a new one for every (re)connect."""
+    return {"ticket": create_stream_ticket(current_user["user_id"]), "expires_in": STREAM_TICKET_TTL}
+
+
+@api_router.get("/stream")
+async def stream_events(current_user: dict = Depends(get_stream_user)):
+    """Server-sent events with live ride and leaderboard deltas; holds no database session."""
+    subscription = event_broker.subscribe(current_user["user_id"])
+    return StreamingResponse(
+        event_broker.stream(subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @api_router.get("/health")
 async def health():
     return {"status": "ok"}
 
 
+@api_router.get("/metrics", dependencies=[Depends(get_admin_user)])
+async def get_metrics():
+    return metrics.snapshot()
+
+
 app.include_router(api_router)
 
+@app.exception_handler(PoolTimeoutError)
+@app.exception_handler(DBAPIError)
+async def database_overloaded(request: Request, exc: Exception):
+    """Shed the request with a 503 when no connection freed up in time or a statement timed out."""
+    reason = overload(exc)
+    if reason is None:
+        raise exc
+    counter, detail = reason
+    metrics.incr(counter)
+    return JSONResponse(status_code=503, content={"detail": detail}, headers={"Retry-After": "5"})
+
+
+# Read-only routes whose queries are worth cancelling when the client leaves.
+app.add_middleware(
+    CancelOnDisconnect,
+    paths=("/api/stats", "/api/leaderboard", "/api/rides/search", "/api/batch"),
+)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -748,14 +1133,34 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Responses from GZIP_MIN_SIZE bytes up, such as long ride histories, are
+# compressed for clients that accept it.
+app.add_middleware(
+    SelectiveGZip,
+    minimum_size=int(os.environ.get("GZIP_MIN_SIZE", "1024")),
+    compresslevel=6,
+    exclude=("/api/stream", "/api/rides/export"),
+)
 
 
 @app.on_event("startup")
 async def startup_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    for shard_engine in shard_engines:
+        async with shard_engine.begin() as conn:
+            await upgrade_schema(conn)
+        slow_query_log.install(shard_engine)
+    if read_engine is not engine:
+        slow_query_log.install(read_engine)
+    stats_precomputer.start()
+    invalidation_bus.start()
 
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    await engine.dispose()
+    await invalidation_bus.stop()
+    await stats_precomputer.stop()
+    await slow_query_log.close()
+    for shard_engine in shard_engines:
+        await shard_engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
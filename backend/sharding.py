@@ -0,0 +1,196 @@
+"""Users spread over several databases.
+
+Set DATABASE_SHARD_URLS to a comma separated list of further databases;
+DATABASE_URL stays shard 0. Every shard has the full schema and holds all
+rows of its users, so per-user endpoints talk to one database and only the
+leaderboard merges results from all of them. ``user_directory`` on shard 0
+maps every email and user id to its shard: registration claims the email
+there, login looks it up, and the router reads it for unknown users.
+
+    python sharding.py init                 # directory for existing users, once
+    python sharding.py where <user id or email>
+    python sharding.py move <user id> <shard>
+    python sharding.py rebalance [--dry-run]
+
+``init`` registers the users already in the databases; run it before the
+servers start with DATABASE_SHARD_URLS set for the first time. ``rebalance``
+moves every user to the shard the router places new users on, which spreads
+them out after shards were added. A move locks the user's row on the
+source for its duration. Writes lock that row too (server.get_user_session),
+so a move waits for the user's writes in progress, and writes arriving
+during the move wait for it and then go to the new shard.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+from typing import List, Optional, Tuple
+
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import engine, shard_engines, shard_router
+from models import Base, Ride, User, UserDirectory
+from notify import INVALIDATION_CHANNEL
+from partitions import ensure_partitions
+
+# Tables holding a user's rows, parents first, with the column naming the user.
+USER_TABLES = [
+    (table, table.c.id if table is User.__table__ else table.c.user_id)
+    for table in Base.metadata.sorted_tables
+    if table is User.__table__ or ("user_id" in table.c and table is not UserDirectory.__table__)
+]
+
+_CLAIM_EMAIL = (
+    pg_insert(UserDirectory)
+    .values(user_id=bindparam("user_id"), email=bindparam("email"), shard=bindparam("shard"))
+    .on_conflict_do_nothing()
+    .returning(UserDirectory.user_id)
+)
+_RELEASE_EMAIL = delete(UserDirectory).where(UserDirectory.email == bindparam("email"))
+_LOCATE_EMAIL = select(UserDirectory.user_id, UserDirectory.shard).where(UserDirectory.email == bindparam("email"))
+
+
+async def claim_email(session: AsyncSession, email: str, user_id: str, shard: int) -> bool:
+    """Reserve ``email`` for a new user on ``shard``; False when it is taken. Commits."""
+    claimed = (await session.execute(_CLAIM_EMAIL, {"user_id": user_id, "email": email, "shard": shard})).first()
+    await session.commit()
+    return claimed is not None
+
+
+async def release_email(session: AsyncSession, email: str) -> None:
+    await session.execute(_RELEASE_EMAIL, {"email": email})
+    await session.commit()
+
+
+async def locate_email(session: AsyncSession, email: str) -> Optional[Tuple[str, int]]:
+    """The user id and shard registered for ``email``."""
+    row = (await session.execute(_LOCATE_EMAIL, {"email": email})).first()
+    return (row.user_id, row.shard) if row else None
+
+
+def _copied_columns(table):
+    # Generated columns are computed again on the target.
+    return [column for column in table.c if column.computed is None]
+
+
+async def move_user(user_id: str, target: int) -> Optional[int]:
+    """Move all rows of a user to shard ``target``; returns the old shard, or None if already there.
+
+    The rows are copied while the user's row is locked on the source, the
+    directory is repointed, every process is told through the invalidation
+    bus, and only then are the originals deleted.
+    """
+    if not 0 <= target < len(shard_engines):
+        raise ValueError(f"No shard {target}")
+    async with engine.connect() as conn:
+        source = (
+            await conn.execute(select(UserDirectory.shard).where(UserDirectory.user_id == user_id))
+        ).scalar_one_or_none()
+    if source is None:
+        raise ValueError(f"User {user_id} is not in the directory")
+    if source == target:
+        return None
+
+    users = User.__table__
+    async with shard_engines[source].begin() as src:
+        if (await src.execute(select(users.c.id).where(users.c.id == user_id).with_for_update())).first() is None:
+            raise ValueError(f"User {user_id} is not on shard {source}")
+        async with shard_engines[target].begin() as dst:
+            # Leftovers of an interrupted earlier move.
+            for table, column in reversed(USER_TABLES):
+                await dst.execute(delete(table).where(column == user_id))
+            months = (
+                await src.execute(select(func.substr(Ride.date, 1, 7)).where(Ride.user_id == user_id).distinct())
+            ).scalars().all()
+            await ensure_partitions(dst, months)
+            for table, column in USER_TABLES:
+                columns = _copied_columns(table)
+                rows = (await src.execute(select(*columns).where(column == user_id))).mappings().all()
+                if rows:
+                    await dst.execute(insert(table), [dict(row) for row in rows])
+
+        message = {"user_id": user_id, "origin": "sharding", "event": {"type": "moved", "shard": target}}
+        async with engine.begin() as directory:
+            await directory.execute(
+                update(UserDirectory).where(UserDirectory.user_id == user_id).values(shard=target)
+            )
+            await directory.execute(select(func.pg_notify(INVALIDATION_CHANNEL, json.dumps(message))))
+
+        for table, column in reversed(USER_TABLES):
+            await src.execute(delete(table).where(column == user_id))
+    return source
+
+
+async def register_existing_users() -> int:
+    """Add the users already stored on the shards to the directory; returns how many were added."""
+    added = 0
+    for shard, shard_engine in enumerate(shard_engines):
+        async with shard_engine.connect() as conn:
+            users = (await conn.execute(select(User.id, User.email))).all()
+        async with engine.begin() as directory:
+            for start in range(0, len(users), 1000):
+                rows = [
+                    {"user_id": user_id, "email": email, "shard": shard}
+                    for user_id, email in users[start : start + 1000]
+                ]
+                stmt = pg_insert(UserDirectory).values(rows).on_conflict_do_nothing()
+                added += len((await directory.execute(stmt.returning(UserDirectory.user_id))).all())
+    return added
+
+
+async def misplaced_users() -> List[Tuple[str, int, int]]:
+    """``(user id, shard, home shard)`` of every user not on the shard the router would pick."""
+    async with engine.connect() as conn:
+        rows = (await conn.execute(select(UserDirectory.user_id, UserDirectory.shard))).all()
+    placed = [(user_id, shard, shard_router.home(user_id)) for user_id, shard in rows]
+    return [entry for entry in placed if entry[1] != entry[2]]
+
+
+async def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Manage the placement of users over the database shards")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("init", help="add the existing users to the directory")
+    where = commands.add_parser("where", help="show the shard of a user")
+    where.add_argument("user", help="user id or email")
+    move = commands.add_parser("move", help="move a user to another shard")
+    move.add_argument("user_id")
+    move.add_argument("shard", type=int)
+    rebalance = commands.add_parser("rebalance", help="move every user to their home shard")
+    rebalance.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "init":
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all, tables=[UserDirectory.__table__])
+            print(f"Registered: {await register_existing_users()}")
+        elif args.command == "where":
+            async with engine.connect() as conn:
+                row = (
+                    await conn.execute(
+                        select(UserDirectory.user_id, UserDirectory.shard).where(
+                            (UserDirectory.user_id == args.user) | (UserDirectory.email == args.user)
+                        )
+                    )
+                ).first()
+            print(f"{row.user_id}: shard {row.shard}" if row else "Unknown user")
+        elif args.command == "move":
+            source = await move_user(args.user_id, args.shard)
+            print(f"Moved from shard {source}" if source is not None else "Already there")
+        else:
+            misplaced = await misplaced_users()
+            for user_id, shard, home in misplaced:
+                print(f"{user_id}: shard {shard} -> {home}")
+                if not args.dry_run:
+                    await move_user(user_id, home)
+            print(f"{'Misplaced' if args.dry_run else 'Moved'}: {len(misplaced)}")
+    finally:
+        for shard_engine in shard_engines:
+            await shard_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
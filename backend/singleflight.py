@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from metrics import metrics
+
+
+class SingleFlight:
+    """Run one computation per key at a time and share its result with every caller.
+
+    The computation runs in its own task, so a caller that disconnects (and is
+    cancelled) does not cancel it for the others still waiting; once the last
+    caller is gone it is cancelled too, which cancels its query. It must open
+    its own session: request sessions cannot be shared between coroutines.
+    """
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._flights: Dict[Hashable, asyncio.Task] = {}
+        self._waiting: Dict[asyncio.Task, int] = {}
+
+    async def do(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._flights.get(key)
+        if task is None:
+            metrics.incr(f"singleflight.{self._name}.executed")
+            task = asyncio.create_task(compute())
+            self._flights[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            metrics.incr(f"singleflight.{self._name}.coalesced")
+        self._waiting[task] = self._waiting.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiting[task] == 1 and not task.done():
+                metrics.incr(f"singleflight.{self._name}.cancelled")
+                task.cancel()
+                # Cancelling a query takes a round trip; callers arriving
+                # meanwhile must start afresh, not join the dying task.
+                if self._flights.get(key) is task:
+                    del self._flights[key]
+            raise
+        finally:
+            self._waiting[task] -= 1
+            if not self._waiting[task]:
+                del self._waiting[task]
+
+    def _finish(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        # Mark the exception retrieved even if every caller went away.
+        if not task.cancelled():
+            task.exception()
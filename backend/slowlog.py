@@ -0,0 +1,186 @@
+"""Slow-query log with EXPLAIN capture.
+
+Statements slower than SLOW_QUERY_MS (0 disables the log) are logged with
+their duration. SELECTs are logged with the types of their parameters, which
+hold emails and search terms; SLOW_QUERY_LOG_PARAMS=1 logs the values too. A
+background task re-runs them under ``EXPLAIN (ANALYZE, BUFFERS, FORMAT
+JSON)`` with the real values. It uses a dedicated connection to the same
+database, inside a transaction that is rolled back, so the request that was
+slow does not wait for it and no pool connection is taken. Each distinct
+statement is explained at most once per SLOW_QUERY_EXPLAIN_INTERVAL seconds.
+Writes are never re-run and their parameters, which may hold password
+hashes, are not logged.
+
+With SLOW_QUERY_TABLE=1 every entry is also stored in ``slow_queries`` on the
+primary, with its parameters as logged:
+
+    SELECT duration_ms, statement, plan->0->'Execution Time'
+    FROM slow_queries ORDER BY recorded_at DESC LIMIT 20;
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Dict, Set
+
+import asyncpg
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from db import DATABASE_URL, asyncpg_dsn, ssl_connect_args
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "0"))
+SLOW_QUERY_EXPLAIN = os.environ.get("SLOW_QUERY_EXPLAIN", "1") == "1"
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.environ.get("SLOW_QUERY_EXPLAIN_INTERVAL", "60"))
+SLOW_QUERY_TABLE = os.environ.get("SLOW_QUERY_TABLE", "0") == "1"
+SLOW_QUERY_LOG_PARAMS = os.environ.get("SLOW_QUERY_LOG_PARAMS", "0") == "1"
+# The EXPLAIN runs the query again; don't let a pathological one run forever.
+EXPLAIN_TIMEOUT_MS = 30000
+MAX_PENDING = 8
+
+_RECORD = (
+    "INSERT INTO slow_queries (duration_ms, statement, parameters, plan) "
+    "VALUES ($1, $2, $3::jsonb, $4::jsonb)"
+)
+
+
+def _is_select(statement: str) -> bool:
+    return statement.lstrip().lower().startswith("select")
+
+
+def _redact(params: list) -> list:
+    return [type(param).__name__ for param in params]
+
+
+class SlowQueryLog:
+    def __init__(
+        self,
+        threshold_ms: float = SLOW_QUERY_MS,
+        explain: bool = SLOW_QUERY_EXPLAIN,
+        explain_interval: float = SLOW_QUERY_EXPLAIN_INTERVAL,
+        record: bool = SLOW_QUERY_TABLE,
+        log_params: bool = SLOW_QUERY_LOG_PARAMS,
+    ) -> None:
+        self.threshold = threshold_ms / 1000
+        self.explain = explain
+        self.explain_interval = explain_interval
+        self.record = record
+        self.log_params = log_params
+        self._connections: Dict[str, asyncpg.Connection] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._explained: Dict[str, float] = {}
+        self._pending: Set[asyncio.Task] = set()
+
+    def install(self, engine: AsyncEngine) -> None:
+        if self.threshold <= 0:
+            return
+        event.listen(engine.sync_engine, "before_cursor_execute", self._before)
+        event.listen(engine.sync_engine, "after_cursor_execute", self._after)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        if context is not None:
+            context.slowlog_started = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        started = getattr(context, "slowlog_started", None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        if duration < self.threshold:
+            return
+        metrics.incr("sql.slow")
+        duration_ms = round(duration * 1000, 1)
+        select = _is_select(statement) and not executemany
+        params = list(parameters) if select and parameters else []
+        shown = params if self.log_params else _redact(params)
+        if select:
+            logger.warning("Slow query (%.1f ms): %s params=%r", duration_ms, statement, shown)
+        else:
+            logger.warning("Slow query (%.1f ms): %s", duration_ms, statement)
+
+        explain = self.explain and select and self._due(statement)
+        if not (explain or self.record):
+            return
+        if len(self._pending) >= MAX_PENDING:
+            metrics.incr("sql.slow.dropped")
+            return
+        url = conn.engine.url.render_as_string(hide_password=False)
+        # Listeners run synchronously on the event loop's thread, so the
+        # capture can be scheduled as a task of the running loop.
+        task = asyncio.get_running_loop().create_task(
+            self._capture(url, statement, params, shown, duration_ms, explain)
+        )
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    def _due(self, statement: str) -> bool:
+        now = time.monotonic()
+        last = self._explained.get(statement)
+        if last is not None and now - last < self.explain_interval:
+            return False
+        if len(self._explained) > 1000:
+            cutoff = now - self.explain_interval
+            self._explained = {k: v for k, v in self._explained.items() if v >= cutoff}
+        self._explained[statement] = now
+        return True
+
+    async def _connection(self, url: str) -> asyncpg.Connection:
+        connection = self._connections.get(url)
+        if connection is None or connection.is_closed():
+            connection = await asyncpg.connect(asyncpg_dsn(url), **ssl_connect_args(url))
+            self._connections[url] = connection
+        return connection
+
+    async def _capture(
+        self, url: str, statement: str, params: list, shown: list, duration_ms: float, explain: bool
+    ) -> None:
+        plan = None
+        try:
+            if explain:
+                plan = await self._explain(url, statement, params)
+                metrics.incr("sql.slow.explained")
+                logger.warning("Plan of slow query (%.1f ms): %s", duration_ms, json.dumps(plan))
+            if self.record:
+                async with self._locks.setdefault(DATABASE_URL, asyncio.Lock()):
+                    connection = await self._connection(DATABASE_URL)
+                    await connection.execute(
+                        _RECORD,
+                        duration_ms,
+                        statement,
+                        json.dumps(shown, default=str),
+                        json.dumps(plan) if plan is not None else None,
+                    )
+        except Exception as exc:
+            metrics.incr("sql.slow.failed")
+            logger.warning("Capturing slow query failed: %s", exc)
+
+    async def _explain(self, url: str, statement: str, params: list):
+        async with self._locks.setdefault(url, asyncio.Lock()):
+            connection = await self._connection(url)
+            transaction = connection.transaction()
+            await transaction.start()
+            try:
+                await connection.execute(f"SET LOCAL statement_timeout = {EXPLAIN_TIMEOUT_MS}")
+                plan = await connection.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}", *params)
+            finally:
+                # ANALYZE executes the statement; whatever it did is undone.
+                await transaction.rollback()
+        return json.loads(plan) if isinstance(plan, str) else plan
+
+    async def close(self) -> None:
+        for task in list(self._pending):
+            task.cancel()
+        await asyncio.gather(*self._pending, return_exceptions=True)
+        for connection in self._connections.values():
+            if not connection.is_closed():
+                await connection.close()
+        self._connections.clear()
+
+
+slow_query_log = SlowQueryLog()
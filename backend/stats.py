@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+from datetime import datetime as dt
+from typing import FrozenSet, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from accumulator import StatsAccumulator
+from models import Ride
+from partitions import month_range
+from serializers import ride_to_dict
+
+
+# Rides fetched per round trip while streaming them into the accumulator.
+STATS_STREAM_BATCH = 500
+
+
+def ride_time_fields(date_str: str, start_time_str: str, end_time_str: str) -> dict:
+    """Derived columns stored on each ride so stats never re-parse dates and times.
+
+    ``hour_mask`` has bit ``h`` set when the ride occupies clock hour ``h``
+    (start hour up to, not including, the end hour; wrapping past midnight).
+    """
+    weekday = week_key = None
+    try:
+        day = dt.fromisoformat(date_str)
+        weekday = day.weekday()
+        week_key = day.strftime("%Y-W%W")
+    except ValueError:
+        pass
+
+    hour_mask = 0
+    try:
+        sh = int(start_time_str.split(":")[0])
+        eh = int(end_time_str.split(":")[0])
+        if eh <= sh:
+            eh += 24
+        for h in range(sh, eh):
+            hour_mask |= 1 << (h % 24)
+    except (ValueError, IndexError):
+        pass
+
+    return {"weekday": weekday, "week_key": week_key, "hour_mask": hour_mask}
+
+
+def _time_fields(ride: Ride) -> dict:
+    if ride.hour_mask is None:
+        return ride_time_fields(ride.date, ride.start_time, ride.end_time)
+    return {"weekday": ride.weekday, "week_key": ride.week_key, "hour_mask": ride.hour_mask}
+
+
+SECTION_KEYS = {
+    "totals": (
+        "total_rides",
+        "total_hours",
+        "total_gross",
+        "total_net",
+        "total_wwv",
+        "total_overtime_hours",
+        "total_night_hours",
+        "total_social",
+        "total_extra_costs",
+        "avg_per_ride",
+        "avg_per_hour",
+    ),
+    "monthly": ("monthly_earnings",),
+    "weekly": ("weekly_earnings",),
+    "cars": ("car_stats",),
+    "brands": ("brand_stats",),
+    "clients": ("client_stats",),
+    "hourly": ("hourly_distribution",),
+    "day_of_week": ("day_of_week_stats",),
+    "recent": ("recent_rides",),
+    "facets": ("available_months", "available_clients", "available_brands"),
+}
+ALL_SECTIONS = frozenset(SECTION_KEYS)
+# Sections that need every filtered ride loaded; "recent" and "facets" have
+# their own cheap queries.
+RIDE_SECTIONS = ALL_SECTIONS - {"recent", "facets"}
+
+EMPTY_RESPONSE = {
+    "total_rides": 0,
+    "total_hours": 0,
+    "total_gross": 0,
+    "total_net": 0,
+    "total_wwv": 0,
+    "total_overtime_hours": 0,
+    "total_night_hours": 0,
+    "total_social": 0,
+    "total_extra_costs": 0,
+    "avg_per_ride": 0,
+    "avg_per_hour": 0,
+    "monthly_earnings": [],
+    "weekly_earnings": [],
+    "car_stats": [],
+    "client_stats": [],
+    "brand_stats": [],
+    "hourly_distribution": [],
+    "day_of_week_stats": [],
+    "recent_rides": [],
+    "available_months": [],
+    "available_clients": [],
+    "available_brands": [],
+}
+
+
+def parse_sections(raw: Optional[str]) -> FrozenSet[str]:
+    """Parse the comma separated ``sections=`` parameter; empty means everything."""
+    if not raw:
+        return ALL_SECTIONS
+    sections = frozenset(part.strip() for part in raw.split(",") if part.strip())
+    unknown = sections - ALL_SECTIONS
+    if unknown:
+        raise ValueError(f"Unknown sections: {', '.join(sorted(unknown))}")
+    return sections or ALL_SECTIONS
+
+
+def select_sections(payload: dict, sections: FrozenSet[str]) -> dict:
+    if sections == ALL_SECTIONS:
+        return payload
+    return {key: payload[key] for section in SECTION_KEYS if section in sections for key in SECTION_KEYS[section]}
+
+
+def _filtered(query, month, client_name, car_brand, date_from, date_to):
+    if month:
+        lower, upper = month_range(month)
+        query = query.where(Ride.date >= lower, Ride.date < upper)
+    if client_name:
+        query = query.where(Ride.client_name.ilike(f"%{client_name}%"))
+    if car_brand:
+        query = query.where(Ride.car_brand.ilike(f"%{car_brand}%"))
+    if date_from and date_to:
+        query = query.where(Ride.date >= date_from, Ride.date <= date_to)
+    elif date_from:
+        query = query.where(Ride.date >= date_from)
+    elif date_to:
+        query = query.where(Ride.date <= date_to)
+    return query
+
+
+async def _facets(session: AsyncSession, user_id: str) -> dict:
+    rows = (
+        await session.execute(
+            select(func.substr(Ride.date, 1, 7), Ride.client_name, Ride.car_brand)
+            .where(Ride.user_id == user_id)
+            .distinct()
+        )
+    ).all()
+    return {
+        "available_months": sorted({row[0] for row in rows}, reverse=True),
+        "available_clients": sorted({row[1] for row in rows}),
+        "available_brands": sorted({row[2] for row in rows}),
+    }
+
+
+async def compute_stats(
+    session: AsyncSession,
+    user_id: str,
+    month: Optional[str] = None,
+    client_name: Optional[str] = None,
+    car_brand: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    sections: FrozenSet[str] = ALL_SECTIONS,
+) -> dict:
+    """Dashboard statistics for the filtered rides, limited to ``sections``.
+
+    Sections that were not requested issue no queries and do no work.
+    """
+    filters = (month, client_name, car_brand, date_from, date_to)
+    result = {}
+
+    query = _filtered(select(Ride).where(Ride.user_id == user_id), *filters)
+    if sections & RIDE_SECTIONS:
+        query = query.execution_options(yield_per=STATS_STREAM_BATCH)
+    elif "recent" in sections:
+        query = query.order_by(Ride.date.desc()).limit(5)
+    else:
+        query = None
+
+    # Rides stream through a server-side cursor in batches, each one folded
+    # into the accumulator and dropped, so a request holds the group rows and
+    # the newest rides rather than every ride.
+    accumulator = StatsAccumulator(sections, ride_to_dict)
+    if query is not None:
+        rides = await session.stream_scalars(query)
+        async for ride in rides:
+            accumulator.add(ride, _time_fields(ride) if accumulator.needs_time_fields else None)
+
+    if not accumulator.count:
+        result.update(EMPTY_RESPONSE)
+    else:
+        result.update(accumulator.result())
+
+    if "facets" in sections:
+        result.update(await _facets(session, user_id))
+
+    return select_sections(result, sections)
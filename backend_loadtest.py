@@ -0,0 +1,199 @@
+"""Concurrent load generator for the Get Driven API.
+
+Every virtual user runs a scripted journey (login, dashboard stats, ride list,
+add ride, leaderboard) in a loop until the duration expires.  Latencies are
+recorded per endpoint and summarised as throughput and p50/p95/p99.
+
+    python backend_loadtest.py --concurrency 20 --duration 30
+    python backend_loadtest.py --spawn --workers 2 --concurrency 50
+
+/api/stats and /api/leaderboard are rate limited per user; raise
+RATE_LIMIT_STATS / RATE_LIMIT_LEADERBOARD for the server when measuring raw
+capacity rather than admission behaviour. 429/503 answers show up per
+endpoint in the status breakdown.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent / "backend"
+
+
+def log(message, level="INFO"):
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    print(f"[{timestamp}] {level}: {message}")
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class LoadStats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, name, elapsed, status):
+        self.latencies[name].append(elapsed)
+        self.statuses[name][status] += 1
+        if status >= 400 or status == 0:
+            self.errors[name] += 1
+
+    def report(self, wall_time):
+        total = sum(len(v) for v in self.latencies.values())
+        print()
+        print(f"{'endpoint':<14}{'reqs':>8}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name in sorted(self.latencies):
+            values = sorted(self.latencies[name])
+            print(
+                f"{name:<14}{len(values):>8}{self.errors[name]:>8}{len(values) / wall_time:>10.1f}"
+                f"{percentile(values, 50) * 1000:>10.1f}"
+                f"{percentile(values, 95) * 1000:>10.1f}"
+                f"{percentile(values, 99) * 1000:>10.1f}"
+            )
+        print(f"{'total':<14}{total:>8}{sum(self.errors.values()):>8}{total / wall_time:>10.1f}")
+        for name in sorted(self.statuses):
+            codes = ", ".join(f"{code}: {count}" for code, count in sorted(self.statuses[name].items()))
+            print(f"  {name}: {codes}")
+
+
+class VirtualUser:
+    def __init__(self, client, stats, email, password):
+        self.client = client
+        self.stats = stats
+        self.email = email
+        self.password = password
+        self.headers = {}
+
+    async def call(self, name, method, endpoint, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, endpoint, headers=self.headers, **kwargs)
+            status = response.status_code
+        except httpx.HTTPError:
+            response, status = None, 0
+        self.stats.record(name, time.perf_counter() - started, status)
+        return response
+
+    async def ensure_account(self):
+        response = await self.client.post(
+            "auth/register",
+            json={"email": self.email, "password": self.password, "name": self.email.split("@")[0]},
+        )
+        return response.status_code in (200, 400)
+
+    async def journey(self, ride_day):
+        response = await self.call("login", "POST", "auth/login", json={"email": self.email, "password": self.password})
+        if response is None or response.status_code != 200:
+            return
+        self.headers = {"Authorization": f"Bearer {response.json()['token']}"}
+
+        await self.call("stats", "GET", "stats")
+        await self.call("rides", "GET", "rides")
+        await self.call(
+            "add_ride",
+            "POST",
+            "rides",
+            json={
+                "date": ride_day,
+                "client_name": "Load Test",
+                "car_brand": "Mercedes",
+                "car_model": "E-Class",
+                "start_time": "18:00",
+                "end_time": "02:30",
+                "extra_costs": 0.0,
+                "wwv_km": 12.0,
+                "notes": "loadtest",
+            },
+        )
+        await self.call("leaderboard", "GET", "leaderboard", params={"metric": "net", "period": "all"})
+
+
+async def run_user(index, args, stats, deadline):
+    email = f"loadtest-{args.run_id}-{index % args.users}@loadtest.local"
+    async with httpx.AsyncClient(base_url=args.base_url.rstrip("/") + "/", timeout=args.timeout) as client:
+        user = VirtualUser(client, stats, email, "loadtest123")
+        if not await user.ensure_account():
+            log(f"Could not register {email}", "ERROR")
+            return
+        day = 1
+        while time.monotonic() < deadline:
+            await user.journey(f"2024-01-{(day % 28) + 1:02d}")
+            day += 1
+
+
+async def run(args):
+    stats = LoadStats()
+    deadline = time.monotonic() + args.duration
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(i, args, stats, deadline) for i in range(args.concurrency)))
+    stats.report(time.perf_counter() - started)
+    return 0 if not stats.errors else 1
+
+
+def wait_for_health(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(base_url.rstrip("/") + "/health", timeout=2).status_code == 200:
+                return True
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def spawn_server(args):
+    command = [
+        sys.executable, "-m", "uvicorn", "server:app",
+        "--host", "127.0.0.1", "--port", str(args.port), "--workers", str(args.workers),
+        "--log-level", "warning",
+    ]
+    log(f"Starting {' '.join(command[2:])}")
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=os.environ.copy())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test for the Get Driven API")
+    parser.add_argument("--base-url", default=None, help="API base url (default http://127.0.0.1:<port>/api)")
+    parser.add_argument("--concurrency", type=int, default=10, help="number of concurrent virtual users")
+    parser.add_argument("--users", type=int, default=None, help="distinct accounts to spread load over (default: concurrency)")
+    parser.add_argument("--duration", type=float, default=30.0, help="test duration in seconds")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per request timeout in seconds")
+    parser.add_argument("--spawn", action="store_true", help="start a local uvicorn server for the run")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers when --spawn is used")
+    args = parser.parse_args()
+
+    args.base_url = args.base_url or f"http://127.0.0.1:{args.port}/api"
+    args.users = args.users or args.concurrency
+    args.run_id = uuid.uuid4().hex[:8]
+
+    server = spawn_server(args) if args.spawn else None
+    try:
+        if not wait_for_health(args.base_url):
+            log(f"Server at {args.base_url} is not healthy", "ERROR")
+            return 1
+        log(f"Running {args.concurrency} virtual users for {args.duration:.0f}s against {args.base_url}")
+        return asyncio.run(run(args))
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""Check that caches stay coherent across two API processes.
+
+Starts two uvicorn instances on different ports against the same database
+(or uses --url-a/--url-b), primes the dashboard stats on B, writes a ride
+through A and expects B to serve the new totals once the LISTEN/NOTIFY
+invalidation has arrived.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+BACKEND_DIR = Path(__file__).resolve().parent / "backend"
+
+
+def log(message, level="INFO"):
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    print(f"[{timestamp}] {level}: {message}")
+
+
+def start_server(port):
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=os.environ.copy(),
+    )
+
+
+def wait_healthy(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{base_url}/health", timeout=2).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def run_check(url_a, url_b, timeout):
+    email = f"multiworker-{uuid.uuid4().hex[:8]}@test.local"
+    response = requests.post(f"{url_a}/auth/register", json={"email": email, "password": "test123", "name": "Multi Worker"})
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['token']}"}
+
+    # The first read schedules the precomputed document; the second one, after
+    # the debounce, loads it into B's in-process cache.
+    requests.get(f"{url_b}/stats", headers=headers).raise_for_status()
+    time.sleep(1.5)
+    before = requests.get(f"{url_b}/stats", headers=headers).json()["total_rides"]
+    etag = requests.get(f"{url_b}/stats", headers=headers).headers.get("ETag")
+    log(f"B sees {before} rides (ETag {etag})")
+
+    ride = {
+        "date": "2024-12-15",
+        "client_name": "Multi Worker",
+        "car_brand": "Mercedes",
+        "car_model": "E-Class",
+        "start_time": "09:00",
+        "end_time": "17:00",
+    }
+    requests.post(f"{url_a}/rides", json=ride, headers=headers).raise_for_status()
+    log("Created a ride through A")
+
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        response = requests.get(f"{url_b}/stats", headers={**headers, "If-None-Match": etag or ""})
+        if response.status_code == 200 and response.json()["total_rides"] == before + 1:
+            log(f"✅ B served the new totals after {(time.monotonic() - started) * 1000:.0f} ms")
+            return True
+        time.sleep(0.05)
+    log(f"❌ B still serves stale stats after {timeout:.0f}s", "ERROR")
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url-a", default=None)
+    parser.add_argument("--url-b", default=None)
+    parser.add_argument("--timeout", type=float, default=5.0)
+    args = parser.parse_args()
+
+    servers = []
+    if not args.url_a or not args.url_b:
+        servers = [start_server(8001), start_server(8002)]
+        args.url_a, args.url_b = "http://127.0.0.1:8001/api", "http://127.0.0.1:8002/api"
+    try:
+        if not (wait_healthy(args.url_a) and wait_healthy(args.url_b)):
+            log("Servers did not become healthy", "ERROR")
+            return 1
+        # Give both listeners a moment to subscribe before writing.
+        time.sleep(1)
+        return 0 if run_check(args.url_a, args.url_b, args.timeout) else 1
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+import { useEffect, useRef } from 'react';
+import { useAuth } from '@/context/AuthContext';
+
+const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+const EVENT_TYPES = ['ride', 'leaderboard', 'resync'];
+const RECONNECT_DELAY = 5000;
+
+// Listens on /api/stream while mounted and calls handlers[type](event) for
+// every server-sent event. EventSource cannot send headers, so the stream is
+// opened with a short-lived ticket in the query string. The browser retries
+// with the same URL; once the ticket has expired that fails, and a new
+// ticket is fetched to reconnect.
+export function useLiveEvents(handlers) {
+  const { token, axiosAuth } = useAuth();
+  const handlersRef = useRef(handlers);
+  handlersRef.current = handlers;
+
+  useEffect(() => {
+    if (!token || typeof EventSource === 'undefined') return undefined;
+    let source = null;
+    let timer = null;
+    let stopped = false;
+
+    const reconnect = () => {
+      if (!stopped) timer = setTimeout(connect, RECONNECT_DELAY);
+    };
+
+    const connect = async () => {
+      let ticket;
+      try {
+        ticket = (await axiosAuth().post('/stream/ticket')).data.ticket;
+      } catch (e) {
+        reconnect();
+        return;
+      }
+      if (stopped) return;
+      source = new EventSource(`${API}/stream?ticket=${encodeURIComponent(ticket)}`);
+      EVENT_TYPES.forEach((type) => {
+        source.addEventListener(type, (e) => {
+          const handler = handlersRef.current[type];
+          if (handler) handler(JSON.parse(e.data));
+        });
+      });
+      source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) reconnect();
+      };
+    };
+
+    connect();
+    return () => {
+      stopped = true;
+      clearTimeout(timer);
+      if (source) source.close();
+    };
+  }, [token, axiosAuth]);
+}
@@ -1,6 +1,7 @@
 import React, { useState, useEffect, useCallback } from 'react';
 import { Link } from 'react-router-dom';
 import { useAuth } from '@/context/AuthContext';
+import { useLiveEvents } from '@/hooks/use-live-events';
 import {
   BarChart, Bar, XAxis, YAxis, Tooltip, ResponsiveContainer,
   PieChart, Pie, Cell, AreaChart, Area, RadarChart, Radar,
@@ -70,6 +71,8 @@ export default function Dashboard() {
 
   useEffect(() => { fetchStats(); }, [fetchStats]);
 
+  useLiveEvents({ ride: fetchStats, resync: fetchStats });
+
   useEffect(() => {
     let count = 0;
     if (filterMonth !== 'all') count++;
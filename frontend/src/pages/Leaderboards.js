@@ -1,7 +1,8 @@
-import React, { useCallback, useEffect, useMemo, useState } from 'react';
+import React, { useCallback, useEffect, useMemo, useRef, useState } from 'react';
 import { Trophy, CalendarRange, Clock, Euro, Coins, Users } from 'lucide-react';
 import { toast } from 'sonner';
 import { useAuth } from '@/context/AuthContext';
+import { useLiveEvents } from '@/hooks/use-live-events';
 
 const METRICS = [
   { value: 'net', label: 'Netto', icon: Euro },
@@ -22,9 +23,50 @@ function formatMetric(metric, value) {
   return `€${value.toFixed(2)}`;
 }
 
+// Responses the server sends when it sheds load (rate limit, busy).
+const BUSY_STATUSES = [429, 503];
+const REFRESH_MIN_DELAY = 2000;
+const REFRESH_JITTER = 10000;
+
+function compareRows(a, b) {
+  if (a.metric !== b.metric) return b.metric - a.metric;
+  if (a.user_id === b.user_id) return 0;
+  return a.user_id < b.user_id ? -1 : 1;
+}
+
+// The board's order (metric descending, then user id); tied rows share the
+// rank of the first of them, as on the server.
+function rankRows(rows) {
+  const sorted = [...rows].sort(compareRows);
+  let rank = 1;
+  return sorted.map((row, index) => {
+    if (index && row.metric !== sorted[index - 1].metric) rank = index + 1;
+    return { ...row, rank };
+  });
+}
+
+// The first all-time page with a driver's new lifetime totals applied, or
+// null when only the server can tell: a driver entering the page, or one
+// dropping to its bottom while drivers beyond it may now rank higher.
+function applyTotals(rows, total, event, metric) {
+  const { user_id: userId, totals } = event;
+  // A driver's first or last ride adds them to or removes them from the board.
+  if (!totals || !rows.length || totals.rides <= 1) return null;
+  const value = totals[metric];
+  const index = rows.findIndex((row) => row.user_id === userId);
+  const partial = rows.length < total;
+  if (index === -1) {
+    return partial && value < rows[rows.length - 1].metric ? rows : null;
+  }
+  const ranked = rankRows(rows.map((row, i) => (i === index ? { ...row, ...totals, metric: value } : row)));
+  if (partial && value < rows[index].metric && ranked[ranked.length - 1].user_id === userId) return null;
+  return ranked;
+}
+
 export default function Leaderboards() {
   const { axiosAuth } = useAuth();
   const [rows, setRows] = useState([]);
+  const [total, setTotal] = useState(0);
   const [loading, setLoading] = useState(true);
   const [metric, setMetric] = useState('net');
   const [period, setPeriod] = useState('all');
@@ -36,14 +78,17 @@ export default function Leaderboards() {
     [metric]
   );
 
-  const fetchLeaderboard = useCallback(async () => {
-    setLoading(true);
+  // Background refreshes keep the current board on screen and stay quiet
+  // when the server sheds them; the next change schedules another one.
+  const fetchLeaderboard = useCallback(async ({ background = false } = {}) => {
+    if (!background) setLoading(true);
     try {
       const api = axiosAuth();
       const params = { metric, period };
       if (period === 'custom') {
         if (!dateFrom || !dateTo) {
           setRows([]);
+          setTotal(0);
           setLoading(false);
           return;
         }
@@ -52,8 +97,11 @@ export default function Leaderboards() {
       }
       const res = await api.get('/leaderboard', { params });
       setRows(res.data.rows || []);
-    } catch {
-      toast.error('Kon leaderboard niet laden');
+      setTotal(res.data.total ?? (res.data.rows || []).length);
+    } catch (err) {
+      if (!background || !BUSY_STATUSES.includes(err.response?.status)) {
+        toast.error('Kon leaderboard niet laden');
+      }
     } finally {
       setLoading(false);
     }
@@ -63,6 +111,38 @@ export default function Leaderboards() {
     fetchLeaderboard();
   }, [fetchLeaderboard]);
 
+  const rowsRef = useRef(rows);
+  rowsRef.current = rows;
+  const totalRef = useRef(total);
+  totalRef.current = total;
+
+  // Every driver's ride changes the board. Viewers refresh after a random
+  // delay so they do not all ask for the board at the same moment.
+  const refreshTimer = useRef(null);
+  const scheduleRefresh = useCallback(() => {
+    if (refreshTimer.current) return;
+    refreshTimer.current = setTimeout(() => {
+      refreshTimer.current = null;
+      fetchLeaderboard({ background: true });
+    }, REFRESH_MIN_DELAY + Math.random() * REFRESH_JITTER);
+  }, [fetchLeaderboard]);
+  useEffect(() => () => clearTimeout(refreshTimer.current), []);
+
+  // The event carries the driver's new lifetime totals, so the all-time
+  // board is updated in place unless that needs rows it does not have.
+  const onLeaderboard = useCallback((event) => {
+    if (period === 'all') {
+      const updated = applyTotals(rowsRef.current, totalRef.current, event, metric);
+      if (updated) {
+        setRows(updated);
+        return;
+      }
+    }
+    scheduleRefresh();
+  }, [period, metric, scheduleRefresh]);
+
+  useLiveEvents({ leaderboard: onLeaderboard, resync: scheduleRefresh });
+
   return (
     <div className="min-h-screen bg-[#050505] pb-16" data-testid="leaderboards-page">
       <div className="max-w-5xl mx-auto px-4 sm:px-6 pt-8">
@@ -152,7 +232,7 @@ export default function Leaderboards() {
               {metricConfig.label} leaderboard
             </div>
             {!loading && (
-              <div className="text-xs text-zinc-500">{rows.length} drivers</div>
+              <div className="text-xs text-zinc-500">{total} drivers</div>
             )}
           </div>
 
@@ -168,13 +248,13 @@ export default function Leaderboards() {
                 <div key={row.user_id} className="flex items-center justify-between px-5 py-4">
                   <div className="flex items-center gap-4">
                     <div className={`w-10 h-10 rounded-full flex items-center justify-center font-bold ${
-                      index === 0 ? 'bg-[#D9F99D] text-black' : 'bg-[#09090B] text-zinc-400'
+                      (row.rank ?? index + 1) === 1 ? 'bg-[#D9F99D] text-black' : 'bg-[#09090B] text-zinc-400'
                     }`}>
-                      #{index + 1}
+                      #{row.rank ?? index + 1}
                     </div>
                     <div>
                       <div className="text-white text-sm font-semibold">{row.name}</div>
-                      <div className="text-zinc-500 text-xs">{row.email}</div>
+                      <div className="text-zinc-500 text-xs">{row.rides} ritten</div>
                     </div>
                   </div>
                   <div className="text-right">
@@ -0,0 +1,37 @@
+import importlib
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+# The backend modules import each other by their flat names, as under uvicorn.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+
+@pytest.fixture(scope="session")
+def server():
+    """The app module, running against TEST_DATABASE_URL (a scratch database; tests add users to it)."""
+    url = os.environ.get("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    os.environ["DATABASE_URL"] = url
+    return importlib.import_module("server")
+
+
+@pytest.fixture(scope="session")
+def client(server):
+    from fastapi.testclient import TestClient
+
+    with TestClient(server.app) as client:
+        yield client
+
+
+@pytest.fixture
+def auth(client):
+    """Authorization headers of a newly registered user."""
+    email = f"test-{uuid.uuid4().hex}@example.com"
+    response = client.post("/api/auth/register", json={"email": email, "password": "geheim123", "name": "Test"})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['token']}"}
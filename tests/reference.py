@@ -0,0 +1,227 @@
+"""The original pay and stats code, kept verbatim as the reference the optimised versions must match."""
+from datetime import datetime as dt, timedelta
+
+
+def calculate_salary(start_time_str: str, end_time_str: str, date_str: str, settings: dict):
+    """Calculate salary for a ride based on Belgian rules."""
+    start_dt = dt.fromisoformat(f"{date_str}T{start_time_str}")
+    end_dt = dt.fromisoformat(f"{date_str}T{end_time_str}")
+
+    if end_dt <= start_dt:
+        end_dt += timedelta(days=1)
+
+    total_minutes = (end_dt - start_dt).total_seconds() / 60
+    total_hours = total_minutes / 60
+
+    base_rate = settings.get("base_rate", 12.83)
+    overtime_multiplier = settings.get("overtime_multiplier", 1.5)
+    night_surcharge = settings.get("night_surcharge", 1.46)
+    threshold = settings.get("normal_hours_threshold", 9.0)
+
+    normal_hours = min(total_hours, threshold)
+    overtime_hours = max(0, total_hours - threshold)
+
+    normal_pay = normal_hours * base_rate
+    overtime_pay = overtime_hours * base_rate * overtime_multiplier
+
+    night_minutes = 0
+    current = start_dt
+    while current < end_dt:
+        hour = current.hour
+        if hour >= 20 or hour < 6:
+            night_minutes += 1
+        current += timedelta(minutes=1)
+
+    night_hours = night_minutes / 60
+    night_pay = night_hours * night_surcharge
+
+    gross_pay = normal_pay + overtime_pay + night_pay
+
+    return {
+        "total_hours": round(total_hours, 2),
+        "normal_hours": round(normal_hours, 2),
+        "overtime_hours": round(overtime_hours, 2),
+        "night_hours": round(night_hours, 2),
+        "normal_pay": round(normal_pay, 2),
+        "overtime_pay": round(overtime_pay, 2),
+        "night_pay": round(night_pay, 2),
+        "gross_pay": round(gross_pay, 2),
+    }
+
+
+def ride_totals(salary: dict, wwv_km: float, extra_costs: float, settings: dict) -> dict:
+    """The amounts create_ride stored next to ``calculate_salary``'s result."""
+    wwv_amount = round(wwv_km * settings.get("wwv_rate", 0.26), 2)
+
+    wage_pay = salary["gross_pay"]
+    social_pct = settings.get("social_contribution_pct", 2.71) / 100
+    social_contribution = round(wage_pay * social_pct, 2)
+    gross_total = round(wage_pay + wwv_amount + extra_costs + social_contribution, 2)
+    net_pay = round(gross_total - social_contribution, 2)
+    return {
+        "wwv_amount": wwv_amount,
+        "social_contribution": social_contribution,
+        "gross_total": gross_total,
+        "net_pay": net_pay,
+    }
+
+
+def get_stats(rides_list: list) -> dict:
+    """The aggregation of the original /api/stats over ride dicts, in query order (facets left out)."""
+
+    def get_gross_total(r):
+        if r.get("gross_total") is not None:
+            return r["gross_total"]
+        wage = r.get("gross_pay", 0)
+        wwv = r.get("wwv_amount", 0)
+        extra = r.get("extra_costs", 0)
+        social = r.get("social_contribution", 0)
+        return wage + wwv + extra + social
+
+    total_rides = len(rides_list)
+    total_hours = sum(r.get("total_hours", 0) for r in rides_list)
+    total_gross = sum(get_gross_total(r) for r in rides_list)
+    total_net = sum(r.get("net_pay", 0) for r in rides_list)
+    total_wwv = sum(r.get("wwv_amount", 0) for r in rides_list)
+    total_overtime = sum(r.get("overtime_hours", 0) for r in rides_list)
+    total_night = sum(r.get("night_hours", 0) for r in rides_list)
+    total_social = sum(r.get("social_contribution", 0) for r in rides_list)
+    total_extra = sum(r.get("extra_costs", 0) for r in rides_list)
+    avg_per_ride = total_net / total_rides if total_rides > 0 else 0
+    avg_per_hour = total_net / total_hours if total_hours > 0 else 0
+
+    monthly = {}
+    for r in rides_list:
+        mk = r["date"][:7]
+        if mk not in monthly:
+            monthly[mk] = {
+                "month": mk,
+                "gross": 0,
+                "net": 0,
+                "rides": 0,
+                "hours": 0,
+                "overtime": 0,
+                "night": 0,
+            }
+        monthly[mk]["gross"] += get_gross_total(r)
+        monthly[mk]["net"] += r.get("net_pay", 0)
+        monthly[mk]["rides"] += 1
+        monthly[mk]["hours"] += r.get("total_hours", 0)
+        monthly[mk]["overtime"] += r.get("overtime_hours", 0)
+        monthly[mk]["night"] += r.get("night_hours", 0)
+    monthly_earnings = sorted(monthly.values(), key=lambda x: x["month"])
+    for m in monthly_earnings:
+        for k in ["gross", "net", "hours", "overtime", "night"]:
+            m[k] = round(m[k], 2)
+
+    weekly = {}
+    for r in rides_list:
+        d = dt.fromisoformat(r["date"])
+        wk = d.strftime("%Y-W%W")
+        if wk not in weekly:
+            weekly[wk] = {"week": wk, "net": 0, "rides": 0, "hours": 0}
+        weekly[wk]["net"] += r.get("net_pay", 0)
+        weekly[wk]["rides"] += 1
+        weekly[wk]["hours"] += r.get("total_hours", 0)
+    weekly_earnings = sorted(weekly.values(), key=lambda x: x["week"])[-12:]
+    for w in weekly_earnings:
+        w["net"] = round(w["net"], 2)
+        w["hours"] = round(w["hours"], 2)
+
+    cars = {}
+    for r in rides_list:
+        car_key = f"{r['car_brand']} {r['car_model']}"
+        if car_key not in cars:
+            cars[car_key] = {
+                "car": car_key,
+                "brand": r["car_brand"],
+                "rides": 0,
+                "hours": 0,
+                "earnings": 0,
+            }
+        cars[car_key]["rides"] += 1
+        cars[car_key]["hours"] += r.get("total_hours", 0)
+        cars[car_key]["earnings"] += r.get("net_pay", 0)
+    car_stats = sorted(cars.values(), key=lambda x: x["rides"], reverse=True)
+    for c in car_stats:
+        c["hours"] = round(c["hours"], 2)
+        c["earnings"] = round(c["earnings"], 2)
+
+    brands = {}
+    for r in rides_list:
+        b = r["car_brand"]
+        if b not in brands:
+            brands[b] = {"brand": b, "rides": 0, "hours": 0, "earnings": 0}
+        brands[b]["rides"] += 1
+        brands[b]["hours"] += r.get("total_hours", 0)
+        brands[b]["earnings"] += r.get("net_pay", 0)
+    brand_stats = sorted(brands.values(), key=lambda x: x["rides"], reverse=True)
+    for b in brand_stats:
+        b["hours"] = round(b["hours"], 2)
+        b["earnings"] = round(b["earnings"], 2)
+
+    clients = {}
+    for r in rides_list:
+        cl = r["client_name"]
+        if cl not in clients:
+            clients[cl] = {"client": cl, "rides": 0, "earnings": 0, "hours": 0}
+        clients[cl]["rides"] += 1
+        clients[cl]["earnings"] += r.get("net_pay", 0)
+        clients[cl]["hours"] += r.get("total_hours", 0)
+    client_stats = sorted(clients.values(), key=lambda x: x["earnings"], reverse=True)
+    for c in client_stats:
+        c["earnings"] = round(c["earnings"], 2)
+        c["hours"] = round(c["hours"], 2)
+
+    hourly = {str(h).zfill(2): 0 for h in range(24)}
+    for r in rides_list:
+        try:
+            sh = int(r["start_time"].split(":")[0])
+            eh = int(r["end_time"].split(":")[0])
+            if eh <= sh:
+                eh += 24
+            for h in range(sh, eh):
+                hourly[str(h % 24).zfill(2)] += 1
+        except (ValueError, IndexError):
+            pass
+    hourly_distribution = [{"hour": h, "count": c} for h, c in sorted(hourly.items())]
+
+    day_names = ["Ma", "Di", "Wo", "Do", "Vr", "Za", "Zo"]
+    dow = {i: {"day": day_names[i], "rides": 0, "hours": 0, "earnings": 0} for i in range(7)}
+    for r in rides_list:
+        try:
+            d = dt.fromisoformat(r["date"])
+            di = d.weekday()
+            dow[di]["rides"] += 1
+            dow[di]["hours"] += r.get("total_hours", 0)
+            dow[di]["earnings"] += r.get("net_pay", 0)
+        except (ValueError, IndexError):
+            pass
+    day_of_week_stats = [dow[i] for i in range(7)]
+    for d in day_of_week_stats:
+        d["hours"] = round(d["hours"], 2)
+        d["earnings"] = round(d["earnings"], 2)
+
+    recent_rides = sorted(rides_list, key=lambda x: x["date"], reverse=True)[:5]
+
+    return {
+        "total_rides": total_rides,
+        "total_hours": round(total_hours, 2),
+        "total_gross": round(total_gross, 2),
+        "total_net": round(total_net, 2),
+        "total_wwv": round(total_wwv, 2),
+        "total_overtime_hours": round(total_overtime, 2),
+        "total_night_hours": round(total_night, 2),
+        "total_social": round(total_social, 2),
+        "total_extra_costs": round(total_extra, 2),
+        "avg_per_ride": round(avg_per_ride, 2),
+        "avg_per_hour": round(avg_per_hour, 2),
+        "monthly_earnings": monthly_earnings,
+        "weekly_earnings": weekly_earnings,
+        "car_stats": car_stats,
+        "brand_stats": brand_stats,
+        "client_stats": client_stats,
+        "hourly_distribution": hourly_distribution,
+        "day_of_week_stats": day_of_week_stats,
+        "recent_rides": recent_rides,
+    }
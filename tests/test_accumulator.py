@@ -0,0 +1,73 @@
+import random
+import uuid
+
+import pytest
+
+from accumulator import StatsAccumulator
+from models import Ride
+from serializers import ride_to_dict
+from stats import ALL_SECTIONS, SECTION_KEYS, ride_time_fields
+
+from .reference import calculate_salary, get_stats, ride_totals
+from .test_payrules import random_time
+
+SECTIONS = ALL_SECTIONS - {"facets"}
+CARS = [("BMW", "X5"), ("BMW", "i4"), ("Audi", "A6"), ("Tesla", "Model 3"), ("Volvo", "XC90")]
+CLIENTS = ["Garage Peeters", "Autohuis Janssens", "Leasing NV", "Dealer Maes"]
+
+
+def random_ride(rng: random.Random, dates) -> Ride:
+    date, start, end = rng.choice(dates), random_time(rng), random_time(rng)
+    brand, model = rng.choice(CARS)
+    extra, wwv_km = rng.choice([0.0, round(rng.uniform(0, 40), 2)]), rng.choice([0.0, 35.5])
+    salary = calculate_salary(start, end, date, {})
+    totals = ride_totals(salary, wwv_km, extra, {})
+    ride = Ride(
+        id=str(uuid.UUID(int=rng.getrandbits(128))),
+        user_id="user",
+        date=date,
+        client_name=rng.choice(CLIENTS),
+        car_brand=brand,
+        car_model=model,
+        start_time=start,
+        end_time=end,
+        extra_costs=extra,
+        wwv_km=wwv_km,
+        notes="",
+        **salary,
+        **totals,
+    )
+    # Rides written before gross_total existed.
+    if rng.random() < 0.1:
+        ride.gross_total = None
+    return ride
+
+
+def random_rides(rng: random.Random):
+    # Few distinct dates, so equal dates (and the tie order of recent rides) are common.
+    dates = [f"{rng.randrange(2022, 2025)}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}" for _ in range(40)]
+    return [random_ride(rng, dates) for _ in range(rng.randrange(1, 300))]
+
+
+def accumulate(rides, sections) -> dict:
+    accumulator = StatsAccumulator(sections, ride_to_dict)
+    for ride in rides:
+        time_fields = ride_time_fields(ride.date, ride.start_time, ride.end_time)
+        accumulator.add(ride, time_fields if accumulator.needs_time_fields else None)
+    return accumulator.result()
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_accumulator_matches_get_stats(seed):
+    rides = random_rides(random.Random(seed))
+    assert accumulate(rides, SECTIONS) == get_stats([ride_to_dict(ride) for ride in rides])
+
+
+def test_accumulator_sections():
+    rng = random.Random(99)
+    rides = random_rides(rng)
+    expected = get_stats([ride_to_dict(ride) for ride in rides])
+    for _ in range(20):
+        sections = frozenset(rng.sample(sorted(SECTIONS), rng.randrange(1, len(SECTIONS))))
+        keys = [key for section in sections for key in SECTION_KEYS[section]]
+        assert accumulate(rides, sections) == {key: expected[key] for key in keys}
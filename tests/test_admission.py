@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from admission import DEFAULT_LIMITS, AdmissionController, RouteLimit, load_limits
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def rejection(controller: AdmissionController, key: str = "user") -> HTTPException:
+    with pytest.raises(HTTPException) as info:
+        controller.check_rate(key)
+    return info.value
+
+
+def test_burst_then_rate_limited():
+    controller = AdmissionController("stats", RouteLimit(rate=1, burst=3, max_concurrency=1), Clock())
+    for _ in range(3):
+        controller.check_rate("user")
+    error = rejection(controller)
+    assert error.status_code == 429
+    assert error.headers == {"Retry-After": "1"}
+
+
+def test_refill():
+    clock = Clock()
+    controller = AdmissionController("stats", RouteLimit(rate=0.25, burst=2, max_concurrency=1), clock)
+    controller.check_rate("user")
+    controller.check_rate("user")
+    assert rejection(controller).headers["Retry-After"] == "4"
+    clock.advance(3)
+    # A quarter of a token left to wait for: one second, rounded up.
+    assert rejection(controller).headers["Retry-After"] == "1"
+    clock.advance(1)
+    controller.check_rate("user")
+    assert rejection(controller).headers["Retry-After"] == "4"
+
+
+def test_refill_stops_at_burst():
+    clock = Clock()
+    controller = AdmissionController("stats", RouteLimit(rate=1, burst=2, max_concurrency=1), clock)
+    clock.advance(3600)
+    controller.check_rate("user")
+    controller.check_rate("user")
+    assert rejection(controller).status_code == 429
+
+
+def test_zero_rate_retries_after_a_minute():
+    controller = AdmissionController("stats", RouteLimit(rate=0, burst=1, max_concurrency=1), Clock())
+    controller.check_rate("user")
+    assert rejection(controller).headers["Retry-After"] == "60"
+
+
+def test_buckets_are_per_client():
+    controller = AdmissionController("stats", RouteLimit(rate=1, burst=1, max_concurrency=1), Clock())
+    controller.check_rate("a")
+    assert rejection(controller, "a").status_code == 429
+    controller.check_rate("b")
+
+
+def test_idle_buckets_are_pruned():
+    clock = Clock()
+    controller = AdmissionController("stats", RouteLimit(rate=1, burst=2, max_concurrency=1), clock)
+    controller.MAX_BUCKETS = 2
+    controller.check_rate("a")
+    clock.advance(5)
+    controller.check_rate("b")
+    controller.check_rate("c")
+    assert set(controller._buckets) == {"b", "c"}
+
+
+def test_concurrency_cap():
+    async def main():
+        controller = AdmissionController("stats", RouteLimit(rate=100, burst=100, max_concurrency=2), Clock())
+        async with controller.slot(), controller.slot():
+            with pytest.raises(HTTPException) as info:
+                async with controller.slot():
+                    pass
+            assert info.value.status_code == 503
+            assert info.value.headers == {"Retry-After": "1"}
+        async with controller.admit("user"):
+            pass
+
+    asyncio.run(main())
+
+
+def test_rate_limited_request_takes_no_slot():
+    async def main():
+        controller = AdmissionController("stats", RouteLimit(rate=1, burst=1, max_concurrency=1), Clock())
+        controller.check_rate("user")
+        with pytest.raises(HTTPException) as info:
+            async with controller.admit("user"):
+                pass
+        assert info.value.status_code == 429
+        async with controller.slot():
+            pass
+
+    asyncio.run(main())
+
+
+def test_load_limits_overrides(monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_STATS", " 2.5, 20 ,8")
+    monkeypatch.delenv("RATE_LIMIT_LEADERBOARD", raising=False)
+    limits = load_limits()
+    assert limits["stats"] == RouteLimit(rate=2.5, burst=20, max_concurrency=8)
+    assert limits["leaderboard"] == DEFAULT_LIMITS["leaderboard"]
+
+
+def test_load_limits_rejects_malformed_override(monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_LEADERBOARD", "1,2")
+    with pytest.raises(ValueError):
+        load_limits()
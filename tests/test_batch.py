@@ -0,0 +1,77 @@
+import pytest
+
+from admission import RouteLimit
+
+RIDE = {
+    "date": "2024-03-05",
+    "client_name": "Garage Peeters",
+    "car_brand": "BMW",
+    "car_model": "X5",
+    "start_time": "08:00",
+    "end_time": "12:00",
+}
+
+
+def batch(client, auth, *items):
+    response = client.post("/api/batch", json={"requests": list(items)}, headers=auth)
+    assert response.status_code == 200, response.text
+    return response.json()["responses"]
+
+
+def test_split_path(server):
+    from batch import BatchItem, _split_path
+
+    assert _split_path(BatchItem(path="/api/stats?month=2024-03&sections=totals")) == (
+        "/stats",
+        {"month": "2024-03", "sections": "totals"},
+    )
+    # Explicit params win over the query string.
+    assert _split_path(BatchItem(path="rides/?month=2024-03", params={"month": "2024-04"})) == (
+        "/rides",
+        {"month": "2024-04"},
+    )
+
+
+def test_failing_items_do_not_fail_their_siblings(server, client, auth, monkeypatch):
+    monkeypatch.setattr(
+        server.admission_controllers["stats"], "limit", RouteLimit(rate=0.001, burst=1, max_concurrency=4)
+    )
+    assert client.post("/api/rides", json=RIDE, headers=auth).status_code == 201
+
+    responses = batch(
+        client,
+        auth,
+        {"id": "unknown", "path": "/api/users"},
+        {"id": "invalid", "path": "/api/rides/changes", "params": {"since": -1}},
+        {"id": "stats", "path": "/api/stats?month=2024-03"},
+        {"id": "limited", "path": "/api/stats?month=2024-04"},
+        {"id": "rides", "path": "/api/rides"},
+    )
+    assert [(item["id"], item["status"]) for item in responses] == [
+        ("unknown", 404),
+        ("invalid", 422),
+        ("stats", 200),
+        ("limited", 429),
+        ("rides", 200),
+    ]
+    assert responses[2]["body"]["total_rides"] == 1
+    assert [ride["client_name"] for ride in responses[4]["body"]] == ["Garage Peeters"]
+
+
+def test_items_answer_304_for_a_current_etag(client, auth):
+    (first,) = batch(client, auth, {"path": "/api/settings"})
+    assert first["status"] == 200 and first["etag"]
+
+    (cached,) = batch(client, auth, {"path": "/api/settings", "etag": first["etag"]})
+    assert (cached["status"], cached["body"], cached["etag"]) == (304, None, first["etag"])
+
+    assert client.put("/api/settings", json={"base_rate": 14.0}, headers=auth).status_code == 200
+    (changed,) = batch(client, auth, {"path": "/api/settings", "etag": first["etag"]})
+    assert changed["status"] == 200 and changed["etag"] != first["etag"]
+    assert changed["body"]["base_rate"] == 14.0
+
+
+@pytest.mark.parametrize("count, status", [(10, 200), (11, 422)])
+def test_batch_size_limit(client, auth, count, status):
+    response = client.post("/api/batch", json={"requests": [{"path": "/api/auth/me"}] * count}, headers=auth)
+    assert response.status_code == status
@@ -0,0 +1,128 @@
+import asyncio
+import random
+from collections import namedtuple
+
+import pytest
+
+from leaderboard import (
+    _row_to_dict,
+    _shard_statements,
+    _statements,
+    sharded_leaderboard_page,
+    sharded_leaderboard_position,
+)
+
+Row = namedtuple("Row", "user_id name hours net gross rides metric rank")
+METRIC = "net"
+
+
+class Result:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def all(self):
+        return list(self._rows)
+
+    def one(self):
+        (row,) = self._rows
+        return row
+
+    def one_or_none(self):
+        return self._rows[0] if self._rows else None
+
+    def scalar_one(self):
+        return self.one()
+
+
+class FakeShard:
+    """Answers the leaderboard statements for one shard's rows, as Postgres would."""
+
+    def __init__(self, rows):
+        self.rows = sorted(rows, key=lambda row: (-row.metric, row.user_id))
+
+    def __call__(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def execute(self, statement, params):
+        page, count, _ = _statements(METRIC, False)
+        mine, counts, above, below = _shard_statements(METRIC, False)
+        if statement is page:
+            ranked = [row._replace(rank=1 + sum(other.metric > row.metric for other in self.rows)) for row in self.rows]
+            return Result(ranked[params["offset"] : params["offset"] + params["limit"]])
+        if statement is count:
+            return Result([len(self.rows)])
+        if statement is mine:
+            return Result([row for row in self.rows if row.user_id == params["user_id"]])
+
+        def before(row):
+            return (row.metric, params["user_id"]) > (params["value"], row.user_id)
+
+        def after(row):
+            return row.user_id != params["user_id"] and not before(row)
+
+        if statement is counts:
+            Counts = namedtuple("Counts", "greater before")
+            return Result([Counts(sum(row.metric > params["value"] for row in self.rows), sum(map(before, self.rows)))])
+        if statement is above:
+            return Result([row for row in self.rows if before(row)][::-1][: params["neighbours"]])
+        if statement is below:
+            return Result([row for row in self.rows if after(row)][: params["neighbours"]])
+        raise AssertionError(f"unexpected statement {statement}")
+
+
+def random_board(rng):
+    # Few distinct values, so ties are common, also across shards.
+    values = [rng.choice([0, 10, 25.5, 40]) for _ in range(rng.randrange(1, 40))]
+    rows = [Row(f"user-{i:03d}", f"Driver {i}", 1.0, value, value, 1, value, None) for i, value in enumerate(values)]
+    rng.shuffle(rows)
+    shards = [[] for _ in range(rng.randrange(1, 5))]
+    for row in rows:
+        rng.choice(shards).append(row)
+    return rows, [FakeShard(shard) for shard in shards]
+
+
+def expected_board(rows):
+    """The board as one database ranks it: RANK() over metric descending, ties by user id."""
+    ordered = sorted(rows, key=lambda row: (-row.metric, row.user_id))
+    return [_row_to_dict(row, METRIC, 1 + sum(other.metric > row.metric for other in rows)) for row in ordered]
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_sharded_page_matches_one_database(seed):
+    rng = random.Random(seed)
+    rows, shards = random_board(rng)
+    limit, offset = rng.randrange(1, 15), rng.randrange(0, 45)
+    page = asyncio.run(sharded_leaderboard_page(shards, METRIC, "all", limit=limit, offset=offset))
+    assert page == {"total": len(rows), "rows": expected_board(rows)[offset : offset + limit]}
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_sharded_position_matches_one_database(seed):
+    rng = random.Random(seed)
+    rows, shards = random_board(rng)
+    board = expected_board(rows)
+    index = rng.randrange(len(board))
+    neighbours = rng.randrange(0, 5)
+    me = board[index]
+    home = next(i for i, shard in enumerate(shards) if any(row.user_id == me["user_id"] for row in shard.rows))
+    position = asyncio.run(
+        sharded_leaderboard_position(shards, home, me["user_id"], METRIC, "all", neighbours=neighbours)
+    )
+    assert position == {
+        "rank": me["rank"],
+        "row": me,
+        "above": board[max(0, index - neighbours) : index],
+        "below": board[index + 1 : index + 1 + neighbours],
+    }
+
+
+def test_sharded_position_of_unranked_user():
+    _, shards = random_board(random.Random(1))
+    position = asyncio.run(sharded_leaderboard_position(shards, 0, "nobody", METRIC, "all"))
+    assert position == {"rank": None, "row": None, "above": [], "below": []}
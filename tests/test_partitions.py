@@ -0,0 +1,41 @@
+from datetime import date, timedelta
+
+import pytest
+
+from partitions import add_months, month_range, partition_name
+
+
+def test_month_range():
+    assert month_range("2024-03") == ("2024-03", "2024-04")
+    assert month_range("2024-12") == ("2024-12", "2024-13")
+
+
+@pytest.mark.parametrize("prefix", ["2023-09", "2023-10", "2023-12", "2024-02", "2024", "2024-02-2"])
+def test_month_range_holds_exactly_the_prefixed_dates(prefix):
+    lower, upper = month_range(prefix)
+    day = date(2022, 12, 1)
+    while day < date(2025, 2, 1):
+        value = day.isoformat()
+        # The rides.date column uses the C collation, which compares like Python strings.
+        assert (lower <= value < upper) == value.startswith(prefix), value
+        day += timedelta(days=1)
+
+
+@pytest.mark.parametrize(
+    "month, count, expected",
+    [
+        ("2024-03", 0, "2024-03"),
+        ("2024-03", 1, "2024-04"),
+        ("2024-11", 2, "2025-01"),
+        ("2024-12", 1, "2025-01"),
+        ("2024-01", -1, "2023-12"),
+        ("2024-03", -15, "2022-12"),
+        ("2024-03", 24, "2026-03"),
+    ],
+)
+def test_add_months(month, count, expected):
+    assert add_months(month, count) == expected
+
+
+def test_partition_name():
+    assert partition_name("2024-03") == "rides_2024_03"
@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+from payrules import plan_for, price_ride
+
+from .reference import calculate_salary
+
+SHIFTS = 3000
+
+
+def random_time(rng: random.Random) -> str:
+    value = f"{rng.randrange(24):02d}:{rng.randrange(60):02d}"
+    if rng.random() < 0.3:
+        value += f":{rng.randrange(60):02d}"
+    return value
+
+
+def random_date(rng: random.Random) -> str:
+    return f"{rng.randrange(2020, 2031)}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}"
+
+
+def random_settings(rng: random.Random) -> dict:
+    choices = {
+        "base_rate": lambda: round(rng.uniform(10, 25), 2),
+        "overtime_multiplier": lambda: rng.choice([1.25, 1.5, 2.0]),
+        "night_surcharge": lambda: round(rng.uniform(0, 4), 2),
+        "normal_hours_threshold": lambda: rng.choice([7.6, 8.0, 9.0, 10.0]),
+    }
+    return {name: make() for name, make in choices.items() if rng.random() < 0.5}
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_price_ride_matches_calculate_salary(seed):
+    rng = random.Random(seed)
+    for _ in range(SHIFTS // 3):
+        settings = random_settings(rng)
+        date, start, end = random_date(rng), random_time(rng), random_time(rng)
+        expected = calculate_salary(start, end, date, settings)
+        assert price_ride(plan_for(settings), date, start, end) == expected, (date, start, end, settings)
+
+
+@pytest.mark.parametrize(
+    "start, end",
+    [
+        ("20:00", "06:00"),
+        ("05:59", "06:01"),
+        ("19:59:30", "20:00:30"),
+        ("08:00", "08:00"),
+        ("23:30", "00:15"),
+        ("06:00", "20:00"),
+    ],
+)
+def test_price_ride_night_boundaries(start, end):
+    expected = calculate_salary(start, end, "2024-02-29", {})
+    assert price_ride(plan_for({}), "2024-02-29", start, end) == expected
@@ -0,0 +1,108 @@
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from middleware import SelectiveGZip
+from serializers import RIDE_FIELDS
+
+RIDES = [
+    {
+        "date": f"2024-03-{day:02d}",
+        "client_name": f"Garage {name}",
+        "car_brand": "BMW",
+        "car_model": "X5",
+        "start_time": "08:00",
+        "end_time": "12:30",
+        "notes": "Ophalen aan de achteringang",
+    }
+    for day, name in [(5, "Peeters"), (6, "Janssens"), (7, "Maes")]
+]
+
+
+@pytest.fixture
+def rides(client, auth):
+    for ride in RIDES:
+        assert client.post("/api/rides", json=ride, headers=auth).status_code == 201
+    return client.get("/api/rides", headers=auth).json()
+
+
+def columns_to_rows(columns):
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+def test_unknown_field_is_rejected(client, auth):
+    response = client.get("/api/rides", params={"fields": "date,salary"}, headers=auth)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Unknown fields: salary"
+
+
+def test_fields_select_a_subset_in_field_order(client, auth, rides):
+    response = client.get("/api/rides", params={"fields": "net_pay, date"}, headers=auth)
+    assert response.status_code == 200
+    assert response.json() == [{"date": ride["date"], "net_pay": ride["net_pay"]} for ride in rides]
+
+
+@pytest.mark.parametrize("fields", [None, "client_name,date,created_at"])
+def test_columns_round_trip_to_rows(client, auth, rides, fields):
+    params = {"fields": fields} if fields else {}
+    rows = client.get("/api/rides", params=params, headers=auth).json()
+    columns = client.get("/api/rides", params={**params, "format": "columns"}, headers=auth).json()
+    assert list(columns) == [name for name in RIDE_FIELDS if not fields or name in fields.split(",")]
+    assert all(len(values) == len(rides) for values in columns.values())
+    assert columns_to_rows(columns) == rows
+
+
+def test_etag_depends_on_fields_and_format(client, auth, rides):
+    variants = [
+        {},
+        {"fields": "date"},
+        {"fields": "date,net_pay"},
+        {"format": "columns"},
+        {"fields": "date", "format": "columns"},
+    ]
+    etags = []
+    for params in variants:
+        response = client.get("/api/rides", params=params, headers=auth)
+        assert response.status_code == 200
+        etags.append(response.headers["etag"])
+        cached = client.get("/api/rides", params=params, headers={**auth, "If-None-Match": etags[-1]})
+        assert cached.status_code == 304
+    assert len(set(etags)) == len(variants)
+    # An ETag of one shape does not validate another.
+    other = client.get("/api/rides", params={"format": "columns"}, headers={**auth, "If-None-Match": etags[0]})
+    assert other.status_code == 200
+
+
+def test_large_ride_lists_are_compressed(client, auth, rides):
+    response = client.get("/api/rides", headers={**auth, "Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json() == rides
+
+
+def test_export_is_not_compressed(client, auth, rides):
+    response = client.get("/api/rides/export", params={"format": "arrow"}, headers={**auth, "Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert len(response.content) >= 1024
+    assert "content-encoding" not in response.headers
+
+
+def test_stream_is_not_compressed(server):
+    # The app's event stream never ends, so test the same middleware settings
+    # on a stand-in whose stream does.
+    (gzip,) = [entry for entry in server.app.user_middleware if entry.cls is SelectiveGZip]
+
+    async def events(request):
+        return StreamingResponse(iter(["data: {}\n\n"] * 200), media_type="text/event-stream")
+
+    async def rides(request):
+        return PlainTextResponse("x" * 2000)
+
+    app = Starlette(routes=[Route("/api/stream", events), Route("/api/rides", rides)])
+    with TestClient(SelectiveGZip(app, *gzip.args, **gzip.kwargs)) as client:
+        streamed = client.get("/api/stream", headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in streamed.headers
+        assert streamed.text == "data: {}\n\n" * 200
+        assert client.get("/api/rides", headers={"Accept-Encoding": "gzip"}).headers["content-encoding"] == "gzip"
@@ -0,0 +1,96 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_computation():
+    async def main():
+        flights = SingleFlight("test")
+        calls = 0
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return calls
+
+        results = await asyncio.gather(*(flights.do("key", compute) for _ in range(5)))
+        assert results == [1] * 5
+        assert await flights.do("key", compute) == 2
+
+    asyncio.run(main())
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    async def main():
+        flights = SingleFlight("test")
+
+        async def compute():
+            await asyncio.sleep(0.05)
+            return "done"
+
+        first = asyncio.create_task(flights.do("key", compute))
+        second = asyncio.create_task(flights.do("key", compute))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == "done"
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+    asyncio.run(main())
+
+
+def test_caller_after_the_last_one_left_starts_a_new_computation():
+    async def main():
+        flights = SingleFlight("test")
+        started = asyncio.Event()
+
+        async def slow():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                # Cancelling a query takes a round trip to the server.
+                await asyncio.sleep(0.05)
+                raise
+
+        async def fast():
+            return "fresh"
+
+        abandoned = asyncio.create_task(flights.do("key", slow))
+        await started.wait()
+        abandoned.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await abandoned
+        # The abandoned computation is still winding down; it must not be joined.
+        assert await flights.do("key", fast) == "fresh"
+
+    asyncio.run(main())
+
+
+def test_coalesced_requests_share_one_concurrency_slot(server, client, auth, monkeypatch):
+    from admission import RouteLimit
+
+    requests = 8
+    controller = server.admission_controllers["stats"]
+    monkeypatch.setattr(controller, "limit", RouteLimit(rate=100, burst=100, max_concurrency=1))
+    compute_stats = server.compute_stats
+    calls = 0
+
+    async def slow_compute_stats(*args):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.3)
+        return await compute_stats(*args)
+
+    monkeypatch.setattr(server, "compute_stats", slow_compute_stats)
+
+    with ThreadPoolExecutor(requests) as pool:
+        responses = list(
+            pool.map(lambda _: client.get("/api/stats", params={"month": "2024-03"}, headers=auth), range(requests))
+        )
+    assert [response.status_code for response in responses] == [200] * requests
+    assert calls < requests
@@ -0,0 +1,76 @@
+import random
+
+import numpy as np
+import pytest
+
+from whatif import price_rides, summarise
+
+from .reference import calculate_salary, get_stats, ride_totals
+from .test_payrules import random_date, random_settings, random_time
+
+RIDES = 3000
+PRICED_FIELDS = (
+    "total_hours",
+    "overtime_hours",
+    "night_hours",
+    "wwv_amount",
+    "extra_costs",
+    "social_contribution",
+    "gross_total",
+    "net_pay",
+)
+
+
+def random_rides(rng: random.Random, count: int):
+    dates = [random_date(rng) for _ in range(count)]
+    starts = [random_time(rng) for _ in range(count)]
+    ends = [random_time(rng) for _ in range(count)]
+    wwv_km = np.array([rng.choice([0, round(rng.uniform(0, 120), 1)]) for _ in range(count)])
+    extra_costs = np.array([rng.choice([0, round(rng.uniform(0, 40), 2)]) for _ in range(count)])
+    return dates, starts, ends, wwv_km, extra_costs
+
+
+def reference_rides(dates, starts, ends, wwv_km, extra_costs, settings):
+    rides = []
+    for date, start, end, km, extra in zip(dates, starts, ends, wwv_km.tolist(), extra_costs.tolist()):
+        salary = calculate_salary(start, end, date, settings)
+        rides.append({
+            "date": date,
+            "client_name": "Klant",
+            "car_brand": "Merk",
+            "car_model": "Model",
+            "start_time": start,
+            "end_time": end,
+            "extra_costs": extra,
+            **salary,
+            **ride_totals(salary, km, extra, settings),
+        })
+    return rides
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_price_rides_matches_create_ride(seed):
+    rng = random.Random(seed)
+    settings = {
+        **random_settings(rng),
+        "wwv_rate": rng.choice([0.26, 0.15, 0.4]),
+        "social_contribution_pct": rng.choice([2.71, 0, 13.07]),
+    }
+    dates, starts, ends, wwv_km, extra_costs = random_rides(rng, RIDES // 3)
+    priced = price_rides(dates, starts, ends, wwv_km, extra_costs, settings)
+    expected = reference_rides(dates, starts, ends, wwv_km, extra_costs, settings)
+    for field in PRICED_FIELDS:
+        assert priced[field].tolist() == [ride[field] for ride in expected], field
+
+
+def test_summarise_matches_stats():
+    rng = random.Random(7)
+    dates, starts, ends, wwv_km, extra_costs = random_rides(rng, 400)
+    priced = price_rides(dates, starts, ends, wwv_km, extra_costs, {})
+    stats = get_stats(reference_rides(dates, starts, ends, wwv_km, extra_costs, {}))
+    summary = summarise(dates, priced)
+    assert summary == {key: stats[key] for key in summary}
+
+
+def test_summarise_empty():
+    assert summarise([], {})["total_rides"] == 0